@@ -0,0 +1,216 @@
+import collections
+import time
+from typing import Iterator, Optional, Sequence
+
+import numpy as np
+
+from nonogram import data
+from nonogram import game
+from nonogram import linesolver
+from nonogram import placement_cache
+
+# lines are indexed by dimension, rows first
+_ROW = 0
+_COL = 1
+
+# every placement of every line is held in memory, which stops being
+# reasonable long before the search itself gets slow
+MAX_PLACEMENTS = 1_000_000
+
+
+def check_size(puzzle: game.Puzzle):
+    total = sum(
+        placement_cache.placement_count(puzzle.size(dim), hints)
+        for dim, lines in puzzle.hints.items()
+        for hints in lines
+    )
+    if total > MAX_PLACEMENTS:
+        raise ValueError(
+            f"{total} line placements is too many to backtrack over, "
+            f"the most is {MAX_PLACEMENTS}"
+        )
+
+
+def _bits(mask: int) -> Iterator[int]:
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class _State:
+    """One node of the search: what's known, and what each line can still be.
+
+    A line's candidates are only filtered against what's known when
+    the line is settled, and every line whose known cells change gets
+    settled again, so at a fixed point they're all up to date.
+    """
+
+    def __init__(
+        self,
+        candidates: list[list[Sequence[int]]],
+        filled: list[list[int]],
+        empty: list[list[int]],
+    ):
+        self.candidates = candidates
+        self.filled = filled
+        self.empty = empty
+
+    def copy(self) -> "_State":
+        # candidate lists are replaced rather than modified, so the
+        # lists of them are all that needs copying
+        return _State(
+            [list(lines) for lines in self.candidates],
+            [list(lines) for lines in self.filled],
+            [list(lines) for lines in self.empty],
+        )
+
+
+class Backtracker:
+    """Depth-first search over whole-line placements, for small puzzles.
+
+    Each line starts out with every placement of its hints as a
+    bitmask, from the placement cache. Settling a line throws out the
+    placements that disagree with its known cells and marks whatever
+    the rest agree on as known, which is exactly what the line solver
+    does; when that runs out, the search picks the line with the fewest
+    placements left and tries each in turn. There's no model to build,
+    so on small puzzles this finishes long before CP-SAT would have
+    started.
+    """
+
+    def __init__(self, puzzle: game.Puzzle, cells: Optional[np.ndarray] = None):
+        check_size(puzzle)
+        self.n_rows = puzzle.n_rows
+        self.n_cols = puzzle.n_cols
+        # all of a row, all of a column
+        self.full = [(1 << self.n_cols) - 1, (1 << self.n_rows) - 1]
+        self.root = _State(
+            [
+                [
+                    placement_cache.get(self.n_cols, h).placements
+                    for h in puzzle.hints[game.Dim.ROW]
+                ],
+                [
+                    placement_cache.get(self.n_rows, h).placements
+                    for h in puzzle.hints[game.Dim.COL]
+                ],
+            ],
+            [[0] * self.n_rows, [0] * self.n_cols],
+            [[0] * self.n_rows, [0] * self.n_cols],
+        )
+        if cells is not None:
+            for row_idx, col_idx in zip(*np.nonzero(cells == linesolver.FILLED)):
+                self.root.filled[_ROW][row_idx] |= 1 << int(col_idx)
+                self.root.filled[_COL][col_idx] |= 1 << int(row_idx)
+            for row_idx, col_idx in zip(*np.nonzero(cells == linesolver.EMPTY)):
+                self.root.empty[_ROW][row_idx] |= 1 << int(col_idx)
+                self.root.empty[_COL][col_idx] |= 1 << int(row_idx)
+        self.branches = 0
+        self.conflicts = 0
+        self.propagations = 0
+        # False if the search stopped early, at the solution limit or
+        # the time limit
+        self.finished = True
+        self.timed_out = False
+
+    def _settle(self, state: _State, queue: collections.deque) -> bool:
+        """Settle lines until nothing changes; False on a contradiction."""
+        queued = set(queue)
+        while queue:
+            dim, idx = queue.popleft()
+            queued.discard((dim, idx))
+            self.propagations += 1
+            filled = state.filled[dim][idx]
+            empty = state.empty[dim][idx]
+            candidates = state.candidates[dim][idx]
+            settled = placement_cache.settle(candidates, filled, empty, self.full[dim])
+            if settled is None:
+                return False
+            kept, always, never = settled
+            if len(kept) != len(candidates):
+                state.candidates[dim][idx] = kept
+            new_filled = always & ~filled
+            new_empty = never & ~empty
+            if not new_filled and not new_empty:
+                continue
+            state.filled[dim][idx] = filled | new_filled
+            state.empty[dim][idx] = empty | new_empty
+            other = 1 - dim
+            bit = 1 << idx
+            for crossing in _bits(new_filled):
+                state.filled[other][crossing] |= bit
+                if (other, crossing) not in queued:
+                    queued.add((other, crossing))
+                    queue.append((other, crossing))
+            for crossing in _bits(new_empty):
+                state.empty[other][crossing] |= bit
+                if (other, crossing) not in queued:
+                    queued.add((other, crossing))
+                    queue.append((other, crossing))
+        return True
+
+    def _grid(self, state: _State) -> data.Grid:
+        bits = 0
+        for row_idx, row in enumerate(state.filled[_ROW]):
+            bits |= row << (row_idx * self.n_cols)
+        return data.Grid(self.n_rows, self.n_cols, bits)
+
+    def _search(self, state: _State, deadline: Optional[float]) -> Iterator[data.Grid]:
+        if deadline is not None and time.perf_counter() > deadline:
+            self.timed_out = True
+            return
+        # the most constrained line that isn't settled yet
+        best = None
+        best_count = 0
+        for dim in (_ROW, _COL):
+            for idx, candidates in enumerate(state.candidates[dim]):
+                count = len(candidates)
+                if count > 1 and (best is None or count < best_count):
+                    best = (dim, idx)
+                    best_count = count
+        if best is None:
+            yield self._grid(state)
+            return
+        dim, idx = best
+        for candidate in state.candidates[dim][idx]:
+            self.branches += 1
+            child = state.copy()
+            child.candidates[dim][idx] = [candidate]
+            if not self._settle(child, collections.deque([best])):
+                self.conflicts += 1
+                continue
+            yield from self._search(child, deadline)
+            if self.timed_out:
+                return
+
+    def solve(
+        self, solution_limit: int, time_limit: Optional[float] = None
+    ) -> Iterator[data.Grid]:
+        """Up to solution_limit solutions, in no particular order.
+
+        finished and timed_out are filled in once the grids have run
+        out.
+        """
+        self.finished = False
+        self.timed_out = False
+        self.branches = 0
+        self.conflicts = 0
+        self.propagations = 0
+        deadline = None if time_limit is None else time.perf_counter() + time_limit
+        state = self.root.copy()
+        queue = collections.deque(
+            (dim, idx)
+            for dim in (_ROW, _COL)
+            for idx in range(len(state.candidates[dim]))
+        )
+        count = 0
+        if self._settle(state, queue):
+            for grid in self._search(state, deadline):
+                yield grid
+                count += 1
+                if count >= solution_limit:
+                    return
+        else:
+            self.conflicts += 1
+        self.finished = not self.timed_out
@@ -1,7 +1,7 @@
 import dataclasses
 import enum
 import csv
-import multiprocessing
+import functools
 import pathlib
 import rich.progress
 import rich.table
@@ -12,16 +12,24 @@ import rich.status
 import rich.console
 from rich import print
 import click
+import os
 import sys
 import datetime
+import multiprocessing
+import time
 import contextlib
 import natsort
-import cmasher  # noqa: F401
 from typing import Callable, Iterable, Optional
 
-from nonogram import xmlformat
+from nonogram import benchstats
+from nonogram import corpus
+from nonogram import data
+from nonogram import placement_cache
+from nonogram import portfolio
+from nonogram import solve_cache
 from nonogram import cli_utils
 from nonogram import solver
+from nonogram import workers
 
 
 class Format(enum.Enum):
@@ -36,6 +44,15 @@ class SortBy(enum.Enum):
     TIME = enum.auto()
 
 
+class Placement(enum.Enum):
+    # as many workers as --threads asks for, wherever the OS puts them
+    SHARED = enum.auto()
+    # no more workers than cores this process may run on
+    ONE_PER_CORE = enum.auto()
+    # one per core, and each worker held to its own core
+    PINNED = enum.auto()
+
+
 @dataclasses.dataclass
 class Row:
     path: pathlib.Path
@@ -43,41 +60,205 @@ class Row:
     rows: int
     num_solutions: int
     time_taken: datetime.timedelta
+    cached: bool = False
+    # hit --time_limit, so num_solutions is only what turned up by then
+    timed_out: bool = False
+    # None if the answer came from the solve cache
+    stats: Optional[data.SolveStats] = None
+    # with --portfolio, the config that finished first and how long each
+    # one took
+    winner: Optional[str] = None
+    config_times: dict[str, Optional[datetime.timedelta]] = dataclasses.field(
+        default_factory=dict
+    )
+    # lookups in the worker's line placement cache while solving this
+    # puzzle
+    placement_hits: int = 0
+    placement_misses: int = 0
 
 
 MAX_SOLUTIONS = 10
-
-
-def _internal(p: pathlib.Path) -> Optional[Row]:
+DEFAULT_TIME_LIMIT = 30 * 60
+
+
+def _internal(
+    ref: corpus.PuzzleRef,
+    presolve: bool,
+    encoding: solver.Encoding,
+    cache_path: Optional[pathlib.Path],
+    refresh_cache: bool,
+    time_limit: Optional[float] = DEFAULT_TIME_LIMIT,
+    engine: solver.Engine = solver.Engine.AUTOMATIC,
+) -> Optional[Row]:
     try:
-        puzzle = xmlformat.load(p.read_text())
+        name, puzzle = corpus.load_ref(ref)
     except NotImplementedError:
         return None
+    placements_before = placement_cache.info()
     time_start = datetime.datetime.now(tz=datetime.UTC)
-    instance = solver.build(puzzle)
-    num_solutions = instance.model.solveAll(
-        solution_limit=MAX_SOLUTIONS, time_limit=30 * 60
+    instance = solver.build(
+        puzzle,
+        presolve=presolve,
+        encoding=encoding,
+        cache=solve_cache.open_cache(cache_path) if cache_path else None,
+        refresh_cache=refresh_cache,
+        engine=engine,
     )
+    solutions = instance.solve_all(solution_limit=MAX_SOLUTIONS, time_limit=time_limit)
     time_end = datetime.datetime.now(tz=datetime.UTC)
+    placements_after = placement_cache.info()
+    return Row(
+        path=pathlib.Path(name),
+        columns=puzzle.n_cols,
+        rows=puzzle.n_rows,
+        num_solutions=len(solutions.grids),
+        # report the time the original solve took, not the lookup
+        time_taken=(
+            solutions.solve_all_time if solutions.cached else time_end - time_start
+        ),
+        cached=solutions.cached,
+        timed_out=solutions.timed_out,
+        stats=None if solutions.cached else instance.stats,
+        placement_hits=placements_after.hits - placements_before.hits,
+        placement_misses=placements_after.misses - placements_before.misses,
+    )
+
+
+def _race(
+    ref: corpus.PuzzleRef,
+    configs: list[portfolio.SearchConfig],
+    time_limit: Optional[float] = DEFAULT_TIME_LIMIT,
+) -> Optional[Row]:
+    try:
+        name, puzzle = corpus.load_ref(ref)
+    except NotImplementedError:
+        return None
+    # everyone runs to the end, so that each config gets a time to
+    # compare rather than just the winner
+    result = portfolio.race(
+        puzzle,
+        configs,
+        solution_limit=MAX_SOLUTIONS,
+        time_limit=time_limit,
+        cancel_losers=False,
+    )
+    winner = next(
+        (entry for entry in result.entries if entry.config == result.winner), None
+    )
     return Row(
-        path=p,
+        path=pathlib.Path(name),
+        columns=puzzle.n_cols,
+        rows=puzzle.n_rows,
+        num_solutions=len(result.grids),
+        time_taken=(
+            winner.time_taken
+            if winner is not None and winner.time_taken is not None
+            else result.time_taken
+        ),
+        timed_out=(result.winner is None and len(result.grids) < MAX_SOLUTIONS),
+        stats=result.stats,
+        winner=result.winner.name() if result.winner is not None else None,
+        config_times={
+            entry.config.name(): entry.time_taken if entry.finished else None
+            for entry in result.entries
+        },
+    )
+
+
+def _measure(
+    ref: corpus.PuzzleRef,
+    presolve: bool,
+    encoding: solver.Encoding,
+    warmup: int,
+    repeats: int,
+    time_limit: Optional[float] = DEFAULT_TIME_LIMIT,
+    engine: solver.Engine = solver.Engine.AUTOMATIC,
+) -> Optional[tuple[str, benchstats.PuzzleTimings]]:
+    try:
+        name, puzzle = corpus.load_ref(ref)
+    except NotImplementedError:
+        return None
+    build_seconds = []
+    solve_seconds = []
+    wall_seconds = []
+    num_solutions = 0
+    timeouts = 0
+    # every run starts from scratch and skips the solve cache, which
+    # would otherwise turn all but the first into a lookup
+    for run in range(warmup + repeats):
+        time_start = time.perf_counter()
+        instance = solver.build(
+            puzzle, presolve=presolve, encoding=encoding, engine=engine
+        )
+        if not instance.presolved():
+            # built up front so that it isn't counted as solving
+            instance.ensure_built()
+        solutions = instance.solve_all(
+            solution_limit=MAX_SOLUTIONS, time_limit=time_limit
+        )
+        time_end = time.perf_counter()
+        if run < warmup:
+            continue
+        build_seconds.append(instance.build_time.total_seconds())
+        solve_seconds.append(solutions.solve_all_time.total_seconds())
+        wall_seconds.append(time_end - time_start)
+        num_solutions = len(solutions.grids)
+        timeouts += solutions.timed_out
+    return name, benchstats.PuzzleTimings(
         columns=puzzle.n_cols,
         rows=puzzle.n_rows,
         num_solutions=num_solutions,
-        time_taken=time_end - time_start,
+        build_seconds=build_seconds,
+        solve_seconds=solve_seconds,
+        wall_seconds=wall_seconds,
+        timeouts=timeouts,
     )
 
 
+def _pin_worker(cores: list[int]):
+    # pool workers are numbered from 1, and replacements for dead ones
+    # carry on counting
+    worker_idx = multiprocessing.current_process()._identity[-1] - 1
+    os.sched_setaffinity(0, {cores[worker_idx % len(cores)]})
+
+
 Sorter = Callable[[Iterable[Row]], list[Row]]
 
+STATS_FIELDS = [
+    "variables",
+    "constraints",
+    "build_time",
+    "first_solution_time",
+    "mean_solution_gap",
+    "branches",
+    "conflicts",
+    "propagations",
+    "search_wall_time",
+    "search_user_time",
+]
+
+
+def _total_seconds(td: Optional[datetime.timedelta]) -> str:
+    return "" if td is None else str(td.total_seconds())
+
+
+def stats_fields(stats: data.SolveStats) -> dict[str, str]:
+    return {
+        "variables": str(stats.num_variables),
+        "constraints": str(stats.num_constraints),
+        "build_time": _total_seconds(stats.build_time),
+        "first_solution_time": _total_seconds(stats.first_solution_time()),
+        "mean_solution_gap": _total_seconds(stats.mean_solution_gap()),
+        "branches": str(stats.branches),
+        "conflicts": str(stats.conflicts),
+        "propagations": str(stats.propagations),
+        "search_wall_time": _total_seconds(stats.wall_time),
+        "search_user_time": _total_seconds(stats.user_time),
+    }
+
 
 @contextlib.contextmanager
 def make_csv_writer(sorter: Sorter):
-    out = csv.DictWriter(
-        sys.stdout,
-        fieldnames=["puzzle_id", "width", "height", "is_unique", "time_taken"],
-    )
-
     rows = []
 
     def write_row(row: Row):
@@ -85,14 +266,52 @@ def make_csv_writer(sorter: Sorter):
 
     yield write_row
 
+    # a column per portfolio config, if there was a portfolio
+    config_names = list(
+        dict.fromkeys(name for row in rows for name in row.config_times)
+    )
+    out = csv.DictWriter(
+        sys.stdout,
+        fieldnames=[
+            "puzzle_id",
+            "width",
+            "height",
+            "is_unique",
+            "status",
+            "time_taken",
+            "cached",
+            *STATS_FIELDS,
+            "placement_hits",
+            "placement_misses",
+            *(["winner", *config_names] if config_names else []),
+        ],
+    )
+    # which columns there are depends on the run, and some are blank
+    out.writeheader()
     for row in sorter(rows):
         out.writerow(
             {
                 "puzzle_id": row.path.name,
                 "width": row.columns,
                 "height": row.rows,
-                "is_unique": str(row.num_solutions == 1),
+                "is_unique": str(row.num_solutions == 1 and not row.timed_out),
+                "status": row_status(row).value,
                 "time_taken": str(row.time_taken.total_seconds()),
+                "cached": str(row.cached),
+                **(stats_fields(row.stats) if row.stats is not None else {}),
+                "placement_hits": str(row.placement_hits),
+                "placement_misses": str(row.placement_misses),
+                **(
+                    {
+                        "winner": row.winner or "",
+                        **{
+                            name: _total_seconds(td)
+                            for name, td in row.config_times.items()
+                        },
+                    }
+                    if row.config_times
+                    else {}
+                ),
             }
         )
 
@@ -100,15 +319,43 @@ def make_csv_writer(sorter: Sorter):
 UNIQUE_STYLE = rich.style.Style(color="green")
 FAIL_STYLE = rich.style.Style(color="red")
 NON_UNIQUE_STYLE = rich.style.Style(color="yellow")
+TIMEOUT_STYLE = rich.style.Style(color="magenta")
+
+
+def row_status(row: Row) -> data.Uniqueness:
+    if row.timed_out:
+        return data.Uniqueness.TIMEOUT
+    if row.num_solutions == 0:
+        return data.Uniqueness.UNSOLVABLE
+    if row.num_solutions == 1:
+        return data.Uniqueness.UNIQUE
+    return data.Uniqueness.MULTIPLE
+
+
+def _placement_caption(rows: list[Row]) -> Optional[str]:
+    hits = sum(row.placement_hits for row in rows)
+    lookups = hits + sum(row.placement_misses for row in rows)
+    if not lookups:
+        return None
+    return f"line placement cache: {hits / lookups:.1%} of {lookups} lookups hit"
 
 
 def make_table(from_rows):
-    table = rich.table.Table()
+    table = rich.table.Table(caption=_placement_caption(from_rows))
     table.add_column("Puzzle ID", justify="right")
     table.add_column("Width", justify="right")
     table.add_column("Height", justify="right")
     table.add_column("#Solutions", justify="center")
     table.add_column("Time Taken", justify="right")
+    table.add_column("Vars", justify="right")
+    table.add_column("Cons", justify="right")
+    table.add_column("Build", justify="right")
+    table.add_column("First Sol.", justify="right")
+    table.add_column("Branches", justify="right")
+    table.add_column("Conflicts", justify="right")
+    raced = any(row.config_times for row in from_rows)
+    if raced:
+        table.add_column("Winner")
 
     if from_rows:
         min_time = min(r.time_taken for r in from_rows)
@@ -124,7 +371,11 @@ def make_table(from_rows):
         else:
             v = 0.5
         time_style = rich.style.Style(color=cli_utils.horizon_colormap(v))
-        if row.num_solutions == 1:
+        if row.timed_out:
+            num_solutions_text = rich.text.Text(
+                f"TIMEOUT ({row.num_solutions} found)", TIMEOUT_STYLE
+            )
+        elif row.num_solutions == 1:
             num_solutions_text = rich.text.Text("UNIQUE", UNIQUE_STYLE)
         elif row.num_solutions == 0:
             num_solutions_text = rich.text.Text("NO SOLUTION", FAIL_STYLE)
@@ -140,11 +391,32 @@ def make_table(from_rows):
             rich.text.Text(str(row.columns)),
             rich.text.Text(str(row.rows)),
             num_solutions_text,
-            rich.text.Text(str(row.time_taken), time_style),
+            rich.text.Text.assemble(
+                (str(row.time_taken), time_style),
+                (" (cached)" if row.cached else "", "dim"),
+            ),
+            *_stats_cells(row.stats),
+            *([rich.text.Text(row.winner or "none", "dim")] if raced else []),
         )
     return table
 
 
+def _stats_cells(stats: Optional[data.SolveStats]) -> list[rich.text.Text]:
+    if stats is None:
+        return [rich.text.Text("-", "dim")] * 6
+    first_solution = stats.first_solution_time()
+    return [
+        rich.text.Text(str(stats.num_variables)),
+        rich.text.Text(str(stats.num_constraints)),
+        rich.text.Text(f"{stats.build_time.total_seconds():.3f}s"),
+        rich.text.Text(
+            "-" if first_solution is None else f"{first_solution.total_seconds():.3f}s"
+        ),
+        rich.text.Text(str(stats.branches)),
+        rich.text.Text(str(stats.conflicts)),
+    ]
+
+
 @contextlib.contextmanager
 def make_rich_writer(sorter: Sorter):
     status = rich.status.Status("Running...")
@@ -168,9 +440,9 @@ def make_rich_writer(sorter: Sorter):
         end_time = datetime.datetime.now()
         live.update(
             rich.console.Group(
-                    make_table(sorter(rows)),
-                    rich.text.Text(f"Done! Took {end_time - start_time}", "green")
-                )
+                make_table(sorter(rows)),
+                rich.text.Text(f"Done! Took {end_time - start_time}", "green"),
+            )
         )
 
 
@@ -197,6 +469,173 @@ def none_sorter(solutions: Iterable[Row]) -> list[Row]:
     return list(solutions)
 
 
+@dataclasses.dataclass
+class StatsRow:
+    name: str
+    timings: benchstats.PuzzleTimings
+    # None without a --compare baseline, or if the baseline doesn't
+    # have this puzzle
+    comparison: Optional[benchstats.Comparison] = None
+
+
+def sort_stats_rows(rows: list[StatsRow], sort_by: SortBy) -> list[StatsRow]:
+    if sort_by == SortBy.ID:
+        return list(natsort.natsorted(rows, key=lambda row: row.name))
+    if sort_by == SortBy.TIME:
+        return sorted(
+            rows, key=lambda row: benchstats.summarize(row.timings.wall_seconds).median
+        )
+    return rows
+
+
+def _median_iqr(xs: list[float]) -> str:
+    summary = benchstats.summarize(xs)
+    return f"{summary.median:.4f}s ±{summary.iqr / 2:.4f}"
+
+
+def make_stats_table(rows: list[StatsRow], compared: bool) -> rich.table.Table:
+    table = rich.table.Table(
+        caption="median ± half the IQR; build and solve are CPU time"
+    )
+    table.add_column("Puzzle ID", justify="right")
+    table.add_column("Width", justify="right")
+    table.add_column("Height", justify="right")
+    table.add_column("#Solutions", justify="center")
+    table.add_column("Build", justify="right")
+    table.add_column("Solve", justify="right")
+    table.add_column("Wall", justify="right")
+    if compared:
+        table.add_column("vs Baseline", justify="right")
+    for row in rows:
+        cells = [
+            rich.text.Text(row.name),
+            rich.text.Text(str(row.timings.columns)),
+            rich.text.Text(str(row.timings.rows)),
+            (
+                rich.text.Text(f"TIMEOUT ×{row.timings.timeouts}", TIMEOUT_STYLE)
+                if row.timings.timeouts
+                else rich.text.Text(str(row.timings.num_solutions))
+            ),
+            rich.text.Text(_median_iqr(row.timings.build_seconds)),
+            rich.text.Text(_median_iqr(row.timings.solve_seconds)),
+            rich.text.Text(_median_iqr(row.timings.wall_seconds)),
+        ]
+        if compared:
+            if row.comparison is None:
+                cells.append(rich.text.Text("new", "dim"))
+            else:
+                cells.append(
+                    rich.text.Text(
+                        f"{row.comparison.ratio:.2f}x p={row.comparison.p_value:.3f}",
+                        FAIL_STYLE if row.comparison.slower else "dim",
+                    )
+                )
+        table.add_row(*cells)
+    return table
+
+
+def write_stats_csv(rows: list[StatsRow], compared: bool):
+    fieldnames = ["puzzle_id", "width", "height", "num_solutions", "timeouts"]
+    for kind in ["build", "solve", "wall"]:
+        fieldnames += [f"{kind}_median", f"{kind}_q1", f"{kind}_q3"]
+    if compared:
+        fieldnames += ["baseline_ratio", "p_value", "slower"]
+    out = csv.DictWriter(sys.stdout, fieldnames=fieldnames)
+    out.writeheader()
+    for row in rows:
+        fields = {
+            "puzzle_id": row.name,
+            "width": row.timings.columns,
+            "height": row.timings.rows,
+            "num_solutions": row.timings.num_solutions,
+            "timeouts": row.timings.timeouts,
+        }
+        for kind, xs in [
+            ("build", row.timings.build_seconds),
+            ("solve", row.timings.solve_seconds),
+            ("wall", row.timings.wall_seconds),
+        ]:
+            summary = benchstats.summarize(xs)
+            fields[f"{kind}_median"] = summary.median
+            fields[f"{kind}_q1"] = summary.q1
+            fields[f"{kind}_q3"] = summary.q3
+        if row.comparison is not None:
+            fields["baseline_ratio"] = row.comparison.ratio
+            fields["p_value"] = row.comparison.p_value
+            fields["slower"] = str(row.comparison.slower)
+        out.writerow(fields)
+
+
+def _run_stats(
+    pool: workers.WorkerPool,
+    refs: list[corpus.PuzzleRef],
+    format: Format,
+    sort_by: SortBy,
+    presolve: bool,
+    encoding: solver.Encoding,
+    warmup: int,
+    repeats: int,
+    settings: dict,
+    json_out: Optional[pathlib.Path],
+    compare: Optional[pathlib.Path],
+    alpha: float,
+    min_slowdown: float,
+    time_limit: Optional[float],
+    engine: solver.Engine,
+) -> bool:
+    """Repeat every puzzle and summarize; True if anything got slower."""
+    baseline = benchstats.read_json(compare) if compare is not None else None
+    measure = functools.partial(
+        _measure,
+        presolve=presolve,
+        encoding=encoding,
+        warmup=warmup,
+        repeats=repeats,
+        time_limit=time_limit,
+        engine=engine,
+    )
+    timings = {}
+    with rich.progress.Progress(
+        transient=True, disable=format == Format.CSV
+    ) as progress:
+        task = progress.add_task("Measuring...", total=len(refs))
+        for result in pool.imap_unordered(measure, refs):
+            progress.advance(task)
+            if result is not None:
+                name, puzzle_timings = result
+                timings[name] = puzzle_timings
+
+    if json_out is not None:
+        benchstats.write_json(json_out, settings, timings)
+
+    rows = []
+    for name, puzzle_timings in timings.items():
+        comparison = None
+        if baseline is not None:
+            comparison = benchstats.compare(
+                puzzle_timings, baseline.get(name), alpha, min_slowdown
+            )
+        rows.append(StatsRow(name, puzzle_timings, comparison))
+    rows = sort_stats_rows(rows, sort_by)
+
+    slower = [row.name for row in rows if row.comparison and row.comparison.slower]
+    if format == Format.CSV:
+        write_stats_csv(rows, compared=baseline is not None)
+    else:
+        print(make_stats_table(rows, compared=baseline is not None))
+        if baseline is not None:
+            if slower:
+                print(
+                    rich.text.Text(
+                        f"{len(slower)} significantly slower: {', '.join(slower)}",
+                        FAIL_STYLE,
+                    )
+                )
+            else:
+                print(rich.text.Text("No significant slowdowns", UNIQUE_STYLE))
+    return bool(slower)
+
+
 @click.command
 @click.option(
     "--format", type=click.Choice(Format, case_sensitive=False), default=Format.RICH
@@ -206,9 +645,10 @@ def none_sorter(solutions: Iterable[Row]) -> list[Row]:
 )
 @click.option(
     "--puzzle_dir",
+    help="Directory of puzzle XML files, or a corpus made by pack_puzzles",
     type=click.Path(
         exists=True,
-        file_okay=False,
+        file_okay=True,
         dir_okay=True,
         readable=True,
         path_type=pathlib.Path,
@@ -216,8 +656,160 @@ def none_sorter(solutions: Iterable[Row]) -> list[Row]:
     default="puzzles",
 )
 @click.option("--threads", type=int, default=20)
-def main(format: Format, sort_by: SortBy, threads: int, puzzle_dir: pathlib.Path):
-    files = list(puzzle_dir.iterdir())
+@click.option("--presolve/--no-presolve", type=bool, default=True)
+@click.option(
+    "--encoding",
+    type=click.Choice(solver.Encoding, case_sensitive=False),
+    default=solver.Encoding.STARTS,
+)
+@click.option(
+    "--engine",
+    type=click.Choice(solver.Engine, case_sensitive=False),
+    default=solver.Engine.CP_SAT,
+    help="How to search; automatic backtracks on puzzles up to "
+    f"{solver.BACKTRACK_MAX_SIZE} wide, where --encoding and --presolve"
+    " make no difference, and uses CP-SAT on the rest",
+)
+@click.option(
+    "--cache_path",
+    type=click.Path(path_type=pathlib.Path),
+    default=solve_cache.default_path,
+    help="Where to keep the solve cache; nonogram/solve_cache.sqlite3 under"
+    " $XDG_CACHE_HOME or ~/.cache by default",
+)
+@click.option(
+    "--cache/--no-cache",
+    type=bool,
+    default=False,
+    help="Answer from the solve cache where it has the same search, reporting "
+    "the time the original solve took",
+)
+@click.option(
+    "--refresh_cache", is_flag=True, help="Re-solve even if the result is cached"
+)
+@click.option(
+    "--time_limit",
+    type=float,
+    default=DEFAULT_TIME_LIMIT,
+    help="Seconds of searching before a puzzle is reported as a timeout",
+)
+@click.option(
+    "--portfolio",
+    "use_portfolio",
+    is_flag=True,
+    help=(
+        "Race every portfolio config on each puzzle in turn and time them"
+        " all; ignores --threads, --encoding, --engine, --presolve and the"
+        " cache"
+    ),
+)
+@click.option(
+    "--repeats",
+    type=int,
+    default=1,
+    help="Solve each puzzle this many times and report median and IQR",
+)
+@click.option("--warmup", type=int, default=0, help="Untimed solves before the repeats")
+@click.option(
+    "--placement",
+    type=click.Choice(Placement, case_sensitive=False),
+    default=Placement.SHARED,
+    help="Cap workers at one per core, and optionally pin each to its own",
+)
+@click.option(
+    "--json_out",
+    type=click.Path(path_type=pathlib.Path),
+    default=None,
+    help="Write every timing to this file, for a later --compare",
+)
+@click.option(
+    "--compare",
+    type=click.Path(exists=True, dir_okay=False, path_type=pathlib.Path),
+    default=None,
+    help="Flag puzzles significantly slower than in this --json_out file",
+)
+@click.option(
+    "--alpha", type=float, default=0.01, help="Significance level for --compare"
+)
+@click.option(
+    "--min_slowdown",
+    type=float,
+    default=0.05,
+    help="Ignore slowdowns of less than this fraction of the baseline median",
+)
+def main(
+    format: Format,
+    sort_by: SortBy,
+    threads: int,
+    puzzle_dir: pathlib.Path,
+    presolve: bool,
+    encoding: solver.Encoding,
+    engine: solver.Engine,
+    cache_path: pathlib.Path,
+    cache: bool,
+    refresh_cache: bool,
+    repeats: int,
+    warmup: int,
+    placement: Placement,
+    json_out: Optional[pathlib.Path],
+    compare: Optional[pathlib.Path],
+    alpha: float,
+    min_slowdown: float,
+    time_limit: float,
+    use_portfolio: bool,
+):
+    refs = corpus.refs(puzzle_dir)
+
+    ignored = cli_utils.explicit_options(solver.CP_SAT_OPTIONS)
+    if ignored and engine != solver.Engine.CP_SAT and not use_portfolio:
+        print(
+            f"[yellow]Only CP-SAT uses {', '.join(ignored)}, which make no"
+            " difference on puzzles the backtracker searches"
+        )
+
+    initializer = None
+    initargs: tuple = ()
+    if placement != Placement.SHARED:
+        cores = sorted(os.sched_getaffinity(0))
+        threads = min(threads, len(cores))
+        if placement == Placement.PINNED:
+            initializer = _pin_worker
+            initargs = (cores,)
+
+    if repeats > 1 or warmup or json_out is not None or compare is not None:
+        # every run is timed from scratch, so the solve cache stays out
+        # of it
+        settings = {
+            "repeats": repeats,
+            "warmup": warmup,
+            "presolve": presolve,
+            "encoding": encoding.name,
+            "engine": engine.name,
+            "threads": threads,
+            "placement": placement.name,
+            "time_limit": time_limit,
+        }
+        with workers.WorkerPool(threads, initializer, initargs) as pool:
+            slower = _run_stats(
+                pool,
+                refs,
+                format,
+                sort_by,
+                presolve,
+                encoding,
+                warmup,
+                repeats,
+                settings,
+                json_out,
+                compare,
+                alpha,
+                min_slowdown,
+                time_limit,
+                engine,
+            )
+        if slower:
+            sys.exit(1)
+        return
 
     if format == Format.CSV:
         make_writer_fn = make_csv_writer
@@ -233,7 +825,30 @@ def main(format: Format, sort_by: SortBy, threads: int, puzzle_dir: pathlib.Path
     elif sort_by == SortBy.NONE:
         sorter = none_sorter
 
-    with make_writer_fn(sorter) as write_cb, multiprocessing.Pool(threads) as pool:
-        solns = pool.imap_unordered(_internal, files)
+    if use_portfolio:
+        # the racers are processes of their own, which pool workers
+        # aren't allowed to start, so puzzles go one at a time
+        configs = portfolio.default_portfolio()
+        with make_writer_fn(sorter) as write_cb:
+            for row in filter(None, (_race(ref, configs, time_limit) for ref in refs)):
+                write_cb(row)
+        return
+
+    with (
+        make_writer_fn(sorter) as write_cb,
+        workers.WorkerPool(threads, initializer, initargs) as pool,
+    ):
+        solns = pool.imap_unordered(
+            functools.partial(
+                _internal,
+                presolve=presolve,
+                encoding=encoding,
+                cache_path=cache_path if cache else None,
+                refresh_cache=refresh_cache,
+                time_limit=time_limit,
+                engine=engine,
+            ),
+            refs,
+        )
         for soln in filter(None, solns):
             write_cb(soln)
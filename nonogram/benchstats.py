@@ -0,0 +1,132 @@
+import dataclasses
+import json
+import math
+import pathlib
+import statistics
+from typing import Optional, Sequence
+
+JSON_VERSION = 1
+
+
+@dataclasses.dataclass(frozen=True)
+class Summary:
+    median: float
+    q1: float
+    q3: float
+
+    @property
+    def iqr(self) -> float:
+        return self.q3 - self.q1
+
+
+def summarize(xs: Sequence[float]) -> Summary:
+    if len(xs) == 1:
+        return Summary(xs[0], xs[0], xs[0])
+    q1, median, q3 = statistics.quantiles(xs, n=4, method="inclusive")
+    return Summary(median, q1, q3)
+
+
+def mann_whitney_greater(xs: Sequence[float], ys: Sequence[float]) -> float:
+    """One-sided p-value for xs tending to be larger than ys.
+
+    Mann-Whitney U with the normal approximation, corrected for ties
+    and continuity. Makes no assumptions about the shape of the timing
+    distributions, but wants at least five or so of each to mean much.
+    """
+    n, m = len(xs), len(ys)
+    if not n or not m:
+        return 1.0
+    pooled = sorted([(x, 0) for x in xs] + [(y, 1) for y in ys])
+
+    # midranks, so tied timings share their rank
+    ranks = [0.0] * len(pooled)
+    tie_term = 0.0
+    idx = 0
+    while idx < len(pooled):
+        end = idx
+        while end + 1 < len(pooled) and pooled[end + 1][0] == pooled[idx][0]:
+            end += 1
+        for k in range(idx, end + 1):
+            ranks[k] = (idx + end) / 2 + 1
+        tied = end - idx + 1
+        tie_term += tied**3 - tied
+        idx = end + 1
+
+    rank_sum = sum(rank for rank, (_, group) in zip(ranks, pooled) if group == 0)
+    u = rank_sum - n * (n + 1) / 2
+    mean = n * m / 2
+    total = n + m
+    variance = n * m / 12 * ((total + 1) - tie_term / (total * (total - 1)))
+    if variance <= 0:
+        return 1.0
+    z = (u - mean - 0.5) / math.sqrt(variance)
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+@dataclasses.dataclass(frozen=True)
+class PuzzleTimings:
+    columns: int
+    rows: int
+    num_solutions: int
+    build_seconds: list[float]
+    solve_seconds: list[float]
+    wall_seconds: list[float]
+    # repeats that hit the time limit
+    timeouts: int = 0
+
+
+def write_json(path: pathlib.Path, settings: dict, timings: dict[str, PuzzleTimings]):
+    with path.open("w") as f:
+        json.dump(
+            {
+                "version": JSON_VERSION,
+                "settings": settings,
+                "puzzles": {
+                    name: dataclasses.asdict(t) for name, t in sorted(timings.items())
+                },
+            },
+            f,
+            indent=2,
+        )
+
+
+def read_json(path: pathlib.Path) -> dict[str, PuzzleTimings]:
+    with path.open() as f:
+        doc = json.load(f)
+    if doc.get("version") != JSON_VERSION:
+        raise ValueError(f"{path} is not version {JSON_VERSION} benchmark output")
+    return {name: PuzzleTimings(**t) for name, t in doc["puzzles"].items()}
+
+
+@dataclasses.dataclass(frozen=True)
+class Comparison:
+    # median wall time over the baseline's
+    ratio: float
+    p_value: float
+    slower: bool
+
+
+def compare(
+    current: PuzzleTimings,
+    baseline: Optional[PuzzleTimings],
+    alpha: float,
+    min_slowdown: float,
+) -> Optional[Comparison]:
+    """Whether current is significantly slower than baseline.
+
+    Both have to hold: the one-sided Mann-Whitney test says the wall
+    times got longer at level alpha, and the median got worse by more
+    than min_slowdown, so that a real but negligible change isn't
+    flagged.
+    """
+    if baseline is None:
+        return None
+    ratio = statistics.median(current.wall_seconds) / max(
+        statistics.median(baseline.wall_seconds), 1e-9
+    )
+    p_value = mann_whitney_greater(current.wall_seconds, baseline.wall_seconds)
+    return Comparison(
+        ratio=ratio,
+        p_value=p_value,
+        slower=p_value < alpha and ratio > 1 + min_slowdown,
+    )
@@ -1,16 +1,21 @@
 import os
+import pathlib
 import random
 from rich import print
-import rich.progress
 import rich.table
 import rich.text
-import rich.live
-import rich.layout
 import rich.status
 import rich.console
 import click
+import datetime
+from typing import Optional
 
 
+from nonogram import cli_utils
+from nonogram import corpus
+from nonogram import data
+from nonogram import portfolio
+from nonogram import solve_cache
 from nonogram import xmlformat
 from nonogram import solver
 
@@ -21,40 +26,202 @@ def lowpriority():
     os.nice(10)
 
 
+def _seconds(td: Optional[datetime.timedelta]) -> str:
+    return "-" if td is None else f"{td.total_seconds():.4f}s"
+
+
+def make_stats_table(stats: data.SolveStats) -> rich.table.Table:
+    table = rich.table.Table(title="Solver statistics")
+    table.add_column("")
+    table.add_column("", justify="right")
+    table.add_row("Variables", str(stats.num_variables))
+    table.add_row("Constraints", str(stats.num_constraints))
+    table.add_row("Build (CPU)", _seconds(stats.build_time))
+    table.add_row("First solution", _seconds(stats.first_solution_time()))
+    table.add_row("Between solutions", _seconds(stats.mean_solution_gap()))
+    table.add_row("Branches", str(stats.branches))
+    table.add_row("Conflicts", str(stats.conflicts))
+    table.add_row("Propagations", str(stats.propagations))
+    table.add_row("Search (wall)", _seconds(stats.wall_time))
+    table.add_row("Search (user)", _seconds(stats.user_time))
+    return table
+
+
 @click.command
-@click.argument("puzzle_file", type=click.File())
+@click.argument(
+    "puzzle_file",
+    type=click.Path(exists=True, dir_okay=False, readable=True, path_type=pathlib.Path),
+)
+@click.option(
+    "--puzzle_id",
+    help="Name or index of the puzzle to solve when PUZZLE_FILE is a packed corpus",
+)
 @click.option("--save_solutions_file", type=click.File(mode="w"))
 @click.option("--max_solutions", type=int, default=DEFAULT_MAX_SOLUTIONS)
-def solve_nonogram(puzzle_file, save_solutions_file, max_solutions: int):
-    puzzle = xmlformat.load(puzzle_file.read())
-    instance = solver.build(puzzle)
+@click.option("--presolve/--no-presolve", type=bool, default=True)
+@click.option(
+    "--encoding",
+    type=click.Choice(solver.Encoding, case_sensitive=False),
+    default=solver.Encoding.STARTS,
+)
+@click.option(
+    "--engine",
+    type=click.Choice(solver.Engine, case_sensitive=False),
+    default=solver.Engine.AUTOMATIC,
+    help="How to search; automatic backtracks on puzzles up to "
+    f"{solver.BACKTRACK_MAX_SIZE} wide and uses CP-SAT on the rest",
+)
+@click.option(
+    "--cache_path",
+    type=click.Path(path_type=pathlib.Path),
+    default=solve_cache.default_path,
+    help="Where to keep the solve cache; nonogram/solve_cache.sqlite3 under"
+    " $XDG_CACHE_HOME or ~/.cache by default",
+)
+@click.option("--cache/--no-cache", type=bool, default=True)
+@click.option(
+    "--refresh_cache", is_flag=True, help="Re-solve even if the result is cached"
+)
+@click.option(
+    "--stats", is_flag=True, help="Show model size and CP-SAT search statistics"
+)
+@click.option(
+    "--time_limit",
+    type=float,
+    default=None,
+    help="Stop searching after this many seconds",
+)
+@click.option(
+    "--workers",
+    type=int,
+    default=None,
+    help="CP-SAT search threads, one per core by default",
+)
+@click.option(
+    "--portfolio",
+    "use_portfolio",
+    is_flag=True,
+    help=(
+        "Race several encodings and search strategies in separate processes"
+        " and keep the first to finish; ignores --encoding, --engine,"
+        " --presolve and the cache"
+    ),
+)
+def solve_nonogram(
+    puzzle_file: pathlib.Path,
+    puzzle_id: Optional[str],
+    save_solutions_file,
+    max_solutions: int,
+    presolve: bool,
+    encoding: solver.Encoding,
+    engine: solver.Engine,
+    cache_path: pathlib.Path,
+    cache: bool,
+    refresh_cache: bool,
+    stats: bool,
+    time_limit: Optional[float],
+    workers: Optional[int],
+    use_portfolio: bool,
+):
+    if corpus.is_corpus(puzzle_file):
+        if puzzle_id is None:
+            raise click.UsageError("--puzzle_id is required to solve from a corpus")
+        c = corpus.open_corpus(puzzle_file)
+        try:
+            puzzle = c.puzzle(c.find(puzzle_id))
+        except KeyError as e:
+            raise click.BadParameter(e.args[0], param_hint="--puzzle_id")
+    else:
+        puzzle = xmlformat.load(puzzle_file.read_text())
     print(f"Puzzle of size {puzzle.n_rows} x {puzzle.n_cols}, solving...")
 
-    solutions = instance.solve_all(max_solutions)
+    results = None
+    race_result = None
+    if use_portfolio:
+        configs = portfolio.default_portfolio(workers or 1)
+        with rich.status.Status(f"Racing {len(configs)} configurations..."):
+            race_result = portfolio.race(puzzle, configs, max_solutions, time_limit)
+        grids = race_result.grids
+        solve_stats = race_result.stats
+    else:
+        ignored = cli_utils.explicit_options(solver.CP_SAT_OPTIONS)
+        if ignored and solver.choose_engine(puzzle, engine) == solver.Engine.BACKTRACK:
+            raise click.UsageError(
+                f"Only CP-SAT uses {', '.join(ignored)}, but this puzzle"
+                " would be searched by the backtracker; pass --engine cp_sat"
+                " to use them"
+            )
+        results = solve_cache.SolveCache(cache_path) if cache else None
+        try:
+            instance = solver.build(
+                puzzle,
+                presolve=presolve,
+                encoding=encoding,
+                cache=results,
+                refresh_cache=refresh_cache,
+                num_workers=workers,
+                engine=engine,
+            )
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="--engine")
+        grids = stream = instance.iter_solutions(max_solutions, time_limit)
+        solve_stats = instance.stats
+
+    if save_solutions_file:
+        c = rich.console.Console(file=save_solutions_file)
+
+    num_solutions = 0
+    random_solution = None
+    solution_number = 0
+    matching_solution_no = None
+    with rich.status.Status("Solving...") as status:
+        for grid in grids:
+            if save_solutions_file:
+                c.print(puzzle.to_text(with_hints=False, with_solution=grid))
+                c.print("\n")
+                c.print("\n")
+            # a reservoir of one: solution k replaces the pick with
+            # probability 1/k, so every solution is equally likely to
+            # be printed without keeping them all around
+            num_solutions += 1
+            if random.randrange(num_solutions) == 0:
+                solution_number, random_solution = num_solutions - 1, grid
+            if matching_solution_no is None and grid == puzzle.solution:
+                matching_solution_no = num_solutions - 1
+            status.update(f"Solving... found {num_solutions} solutions")
+    if results is not None:
+        results.close()
 
-    if len(solutions.grids) == 0:
+    if race_result is not None:
+        timed_out = race_result.winner is None and num_solutions < max_solutions
+    else:
+        timed_out = stream.timed_out
+
+    if timed_out and num_solutions == 0:
+        print(f"[bold magenta]Timed out after {time_limit}s without a solution")
+        if stats and solve_stats is not None:
+            print(make_stats_table(solve_stats))
+        exit(1)
+    elif num_solutions == 0:
         print("[bold red]No solutions found")
+        if stats and solve_stats is not None:
+            print(make_stats_table(solve_stats))
         exit(1)
 
-    if len(solutions.grids) == 1:
+    if timed_out:
+        print(
+            f"[magenta]Timed out after {time_limit}s with {num_solutions}"
+            " solutions found, there may be more"
+        )
+    elif num_solutions == 1:
         print("[green]Puzzle has a unique solution")
-    elif len(solutions.grids) == max_solutions:
+    elif num_solutions == max_solutions:
         print(f"[red]Puzzle has at least {max_solutions} solutions, stopping")
     else:
-        print(f"[yellow]Found {len(solutions.grids)} solutions")
+        print(f"[yellow]Found {num_solutions} solutions")
 
-    if save_solutions_file:
-        c = rich.console.Console(file=save_solutions_file)
-        for grid in solutions.grids:
-            c.print(puzzle.to_text(with_hints=False, with_solution=grid))
-            c.print("\n")
-            c.print("\n")
-
-    if solutions.grids:
-        solution_number, random_solution = random.choice(
-            list(enumerate(solutions.grids))
-        )
-        if len(solutions.grids) > 1:
+    if random_solution is not None:
+        if num_solutions > 1:
             print(f"Randomly selected solution {solution_number} to print:")
         print(puzzle.to_text(with_hints=True, with_solution=random_solution))
         print("")
@@ -63,11 +230,22 @@ def solve_nonogram(puzzle_file, save_solutions_file, max_solutions: int):
         print("Puzzle's given solution:")
         print(puzzle.to_text(with_hints=True, with_solution=puzzle.solution))
         print("")
-        for solution_no, solution in enumerate(solutions.grids):
-            if solution == puzzle.solution:
-                print("Solution", solution_no, rich.text.Text("MATCHES", "bold green"))
-                break
+        if matching_solution_no is not None:
+            print(
+                "Solution",
+                matching_solution_no,
+                rich.text.Text("MATCHES", "bold green"),
+            )
         else:
             print(rich.text.Text("  No solution matches", "bold red"))
 
-    print(f"Took {solutions.solve_all_time}")
+    if race_result is not None:
+        print(portfolio.make_table(race_result))
+        print(f"Took {race_result.time_taken}")
+    elif stream.cached:
+        print(f"Took {stream.solve_time} (cached)")
+    else:
+        print(f"Took {stream.solve_time}")
+
+    if stats and solve_stats is not None:
+        print(make_stats_table(solve_stats))
@@ -1,24 +1,99 @@
-import matplotlib
-import cmasher  # noqa: F401
+import click
+import click.core
 import rich.color
 
-EMBER_COLORMAP = matplotlib.colormaps["cmr.ember"]
-HORIZON_COLORMAP = matplotlib.colormaps["cmr.horizon"]
+# cmasher's ember and horizon colormaps, sampled the way matplotlib
+# samples them: 256 colors, three bytes each. Baked in here so that
+# drawing a table doesn't mean importing matplotlib, which takes longer
+# than the rest of startup put together; regenerate with
+# _colormap_table if they ever need changing.
+_EMBER = bytes.fromhex(
+    "000000000000000000000001010101010101010102010203020204020305030306030407"
+    "04040805050a06050b06060d07070e0907100a08110b09130d09140e0a160f0b17110b18"
+    "120c1a130d1b150d1c160e1d180e1f190f201b10211c10221e11231f1124211225221226"
+    "24132825132927132a28142b2a142c2b152c2d152d2e152e30162f311630331631341732"
+    "3617333717343918343b18353c18363e18373f193741193843193944193a46193a47193b"
+    "491a3b4b1a3c4c1a3d4e1a3d501a3e511a3e531a3f551a3f561a40581a405a1a415b1a41"
+    "5d1a425f1a42601a42621a43641a43651a43671a44691a446a1a446c19456e1945701945"
+    "7119457319457518457618467818467a18467c17467d17467f1746811646821646841546"
+    "8615458815458914458b14458d13458f1345901244921244941144951043971043990f43"
+    "9b0f429c0e429e0d41a00d41a10c40a30c40a50b3fa60b3fa80a3eaa0a3dab0a3dad0a3c"
+    "ae093bb0093ab10a3ab30a39b50a38b60b37b70c36b90c35ba0d34bc0e33bd1033bf1132"
+    "c01231c11430c2152fc4172ec5182dc61a2cc71b2bc81d2aca1f29cb2128cc2227cd2426"
+    "ce2625cf2824d02923d12b22d22d21d32f20d3301fd4321fd5341ed6361dd7381cd8391b"
+    "d83b1ad93d19da3f18db4018db4217dc4416dd4615dd4714de4913df4b12df4c12e04e11"
+    "e15010e1510fe2530ee2550de3570ce4580ce45a0be55c0ae55d09e65f08e66107e76207"
+    "e76406e86605e86705e96904e96b04ea6c03ea6e03ea6f02eb7102eb7302ec7402ec7601"
+    "ec7801ed7901ed7b01ed7d01ee7e01ee8001ee8101ef8301ef8502ef8602f08802f08a03"
+    "f08b03f08d04f18f05f19005f19206f19307f29508f29709f2980af29a0bf29c0cf39d0d"
+    "f39f0ef3a10ff3a211f3a412f3a613f3a714f3a915f3ab16f4ac17f4ae19f4af1af4b11b"
+    "f4b31cf4b41df4b61ff4b820f4b921f4bb22f4bd23f4bf25f4c026f4c227f4c428f3c529"
+    "f3c72bf3c92cf3ca2df3cc2ef3ce30f3cf31f3d132f2d333f2d535f2d636f2d837f2da39"
+    "f1db3af1dd3bf1df3cf1e13e"
+)
+_HORIZON = bytes.fromhex(
+    "0d340b0d350c0c360e0c37100b38110b39130a3a140a3a16093b17093c19083d1a083e1c"
+    "083f1d073f1f07402006412206422306432505442605442805452905462a05472c04482d"
+    "04482f044930044a32044b33044c35044c36044d37044e39054f3a054f3c05503d05513f"
+    "06524006524106534307544407554608554708564909574a09584b0a584d0a594e0b5a50"
+    "0c5b510d5b520d5c540e5d550f5e570f5e58105f5a11605b11605d12615e13625f146361"
+    "14636215646416656517656717666818676a19686b1a686d1a696e1b6a701c6a711d6b73"
+    "1d6c741e6d761f6d77206e79216f7a216f7c22707d23717f247180257282267383267385"
+    "27748728758829768a2a768b2b778d2c788f2d78902d79922e7a932f7a95307b97317c98"
+    "327c9a337d9c347e9d357e9f367fa1377fa23880a43981a63a81a73c82a93d83ab3e83ac"
+    "3f84ae4085b04185b24386b34486b54587b74688b84788ba4989bc4a89be4b8abf4d8ac1"
+    "4e8bc34f8cc5518cc6528dc8548dca558ecb578ecd588fcf5a8fd15b90d25d90d45e91d6"
+    "6091d76292d96392da6593dc6793de6894df6a94e16c95e26e95e46f96e57196e77397e8"
+    "7597e97798eb7998ec7a98ed7c99ee7e99f0809af1829af2849bf3869bf3889cf48a9cf5"
+    "8c9df68e9df6909ef7929ef8949ff8959ff897a0f999a1f99ba1f99da2f99fa2f9a0a3f9"
+    "a2a4f9a4a5f9a5a5f9a7a6f9a9a7f9aaa8f9aca8f9ada9f8afaaf8b0abf8b2acf8b3acf7"
+    "b4adf7b6aef7b7aff7b9b0f6bab1f6bbb2f6bcb3f5beb4f5bfb5f5c0b6f5c1b7f4c2b8f4"
+    "c3b9f4c5baf4c6bbf3c7bcf3c8bdf3c9bef3cabff3cbc0f2ccc1f2cdc2f2cec3f2cfc4f2"
+    "d0c5f2d1c6f2d2c7f2d3c8f1d4c9f1d5caf1d6cbf1d7ccf1d8cdf1d9cff1dad0f1dbd1f1"
+    "dcd2f1ddd3f1ded4f2ded5f2dfd6f2e0d7f2e1d9f2e2daf2e3dbf2e4dcf3e5ddf3e6def3"
+    "e7dff3e7e0f3e8e2f4e9e3f4eae4f4ebe5f4ece6f5ede7f5eee9f5efeaf6f0ebf6f0ecf6"
+    "f1edf7f2eef7f3f0f8f4f1f8f5f2f9f6f3f9f7f4faf8f5faf9f7fbfaf8fbfbf9fcfbfafc"
+    "fcfbfdfdfdfefefefeffffff"
+)
+
+
+def _colormap_table(name: str) -> str:
+    """One of the tables above, as hex, from the colormap of this name.
+
+    Needs matplotlib and cmasher, which are only in the dev dependency
+    group: `uv sync --group dev` first.
+    """
+    import matplotlib
+    import cmasher  # noqa: F401
+
+    colormap = matplotlib.colormaps[name]
+    return bytes(
+        round(255 * channel)
+        for idx in range(colormap.N)
+        for channel in colormap(idx)[:3]
+    ).hex()
+
+
+def _lookup(table: bytes, value: float) -> rich.color.Color:
+    # out-of-range values get the end colors, as in matplotlib
+    idx = 3 * min(max(int(value * 256), 0), 255)
+    return rich.color.Color.from_rgb(table[idx], table[idx + 1], table[idx + 2])
 
 
 def ember_colormap(value: float) -> rich.color.Color:
-    rgba = EMBER_COLORMAP(value)
-    return rich.color.Color.from_rgb(
-        255 * rgba[0],
-        255 * rgba[1],
-        255 * rgba[2],
-    )
+    return _lookup(_EMBER, value)
 
 
 def horizon_colormap(value: float) -> rich.color.Color:
-    rgba = HORIZON_COLORMAP(value)
-    return rich.color.Color.from_rgb(
-        255 * rgba[0],
-        255 * rgba[1],
-        255 * rgba[2],
-    )
+    return _lookup(_HORIZON, value)
+
+
+def explicit_options(names) -> list[str]:
+    """The options among names that were given rather than left at their defaults."""
+    ctx = click.get_current_context()
+    return [
+        f"--{name}"
+        for name in names
+        if ctx.get_parameter_source(name)
+        not in (None, click.core.ParameterSource.DEFAULT)
+    ]
@@ -0,0 +1,233 @@
+import functools
+import pathlib
+import struct
+from typing import Iterable, Iterator, Optional
+
+import click
+import natsort
+import numpy as np
+from rich import print
+
+from nonogram import data
+from nonogram import game
+from nonogram import xmlformat
+
+# A packed corpus is a header followed by five sections, each starting
+# on an 8-byte boundary:
+#
+#   index        one INDEX_DTYPE record per puzzle
+#   line counts  int32 number of hints in each line, rows then columns
+#   hints        int32 hint values of every line, back to back
+#   solutions    bit-packed goal grids, row-major, one bit per cell
+#   names        utf-8 puzzle names, back to back
+MAGIC = b"NONOGRAM"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQQQQQ")
+INDEX_DTYPE = np.dtype(
+    [
+        ("rows", "<i4"),
+        ("cols", "<i4"),
+        ("line_start", "<i8"),
+        ("hint_start", "<i8"),
+        # byte offset into the solutions section, -1 if no solution
+        ("solution_start", "<i8"),
+        ("name_start", "<i8"),
+        ("name_len", "<i8"),
+    ]
+)
+
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def is_corpus(path: pathlib.Path) -> bool:
+    if not path.is_file():
+        return False
+    with path.open("rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class Corpus:
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self.buf = np.memmap(path, dtype=np.uint8, mode="r")
+        (
+            magic,
+            version,
+            count,
+            index_off,
+            line_counts_off,
+            hints_off,
+            solutions_off,
+            names_off,
+        ) = HEADER.unpack_from(self.buf[: HEADER.size].tobytes())
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} puzzle corpus")
+
+        self.index = self.buf[index_off : index_off + count * INDEX_DTYPE.itemsize]
+        self.index = self.index.view(INDEX_DTYPE)
+        self.line_counts = self.buf[line_counts_off:hints_off].view("<i4")
+        self.hints = self.buf[hints_off:solutions_off].view("<i4")
+        self.solutions = self.buf[solutions_off:names_off]
+        self.names = self.buf[names_off:]
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __iter__(self) -> Iterator[game.Puzzle]:
+        for idx in range(len(self)):
+            yield self.puzzle(idx)
+
+    def name(self, idx: int) -> str:
+        entry = self.index[idx]
+        start = int(entry["name_start"])
+        return self.names[start : start + int(entry["name_len"])].tobytes().decode()
+
+    def find(self, puzzle_id: str) -> int:
+        for idx in range(len(self)):
+            if self.name(idx) in (puzzle_id, f"{puzzle_id}.xml"):
+                return idx
+        if puzzle_id.isdigit() and int(puzzle_id) < len(self):
+            return int(puzzle_id)
+        raise KeyError(f"no puzzle {puzzle_id} in {self.path}")
+
+    def puzzle(self, idx: int) -> game.Puzzle:
+        entry = self.index[idx]
+        n_rows = int(entry["rows"])
+        n_cols = int(entry["cols"])
+
+        line_start = int(entry["line_start"])
+        counts = self.line_counts[line_start : line_start + n_rows + n_cols]
+        offsets = [0] + np.cumsum(counts).tolist()
+        hint_start = int(entry["hint_start"])
+        values = self.hints[hint_start : hint_start + offsets[-1]].tolist()
+        lines = [values[lo:hi] for lo, hi in zip(offsets, offsets[1:])]
+        hints = {game.Dim.ROW: lines[:n_rows], game.Dim.COL: lines[n_rows:]}
+
+        grid = None
+        solution_start = int(entry["solution_start"])
+        if solution_start >= 0:
+            n_bytes = (n_rows * n_cols + 7) // 8
+            bits = np.unpackbits(
+                self.solutions[solution_start : solution_start + n_bytes],
+                count=n_rows * n_cols,
+            )
+            grid = data.Grid.from_numpy(bits.reshape(n_rows, n_cols))
+
+        # same as xmlformat.load
+        size = (n_rows + n_cols) // 2
+        if grid:
+            prob = grid.count() / (n_rows * n_cols)
+        else:
+            prob = 0
+        return game.Puzzle(
+            config=data.InstanceConfig(size=size, prob=prob),
+            hints=hints,
+            solution=grid,
+        )
+
+
+@functools.cache
+def open_corpus(path: pathlib.Path) -> Corpus:
+    # cached so every pool worker maps each corpus once
+    return Corpus(path)
+
+
+# a puzzle lives either in its own xml file (index None) or at an
+# index in a packed corpus
+PuzzleRef = tuple[pathlib.Path, Optional[int]]
+
+
+def refs(path: pathlib.Path) -> list[PuzzleRef]:
+    if path.is_dir():
+        return [(p, None) for p in path.iterdir()]
+    if is_corpus(path):
+        return [(path, idx) for idx in range(len(open_corpus(path)))]
+    return [(path, None)]
+
+
+def load_ref(ref: PuzzleRef) -> tuple[str, game.Puzzle]:
+    path, idx = ref
+    if idx is None:
+        return path.name, xmlformat.load(path.read_text())
+    c = open_corpus(path)
+    return c.name(idx), c.puzzle(idx)
+
+
+def pack(puzzles: Iterable[tuple[str, game.Puzzle]], path: pathlib.Path) -> int:
+    entries = []
+    line_counts: list[int] = []
+    hints: list[int] = []
+    solutions = bytearray()
+    names = bytearray()
+    for name, puzzle in puzzles:
+        lines = puzzle.hints[game.Dim.ROW] + puzzle.hints[game.Dim.COL]
+        if puzzle.solution is not None:
+            solution_start = len(solutions)
+            solutions += np.packbits(puzzle.solution.to_numpy()).tobytes()
+        else:
+            solution_start = -1
+        encoded_name = name.encode()
+        entries.append(
+            (
+                puzzle.n_rows,
+                puzzle.n_cols,
+                len(line_counts),
+                len(hints),
+                solution_start,
+                len(names),
+                len(encoded_name),
+            )
+        )
+        line_counts.extend(len(line) for line in lines)
+        for line in lines:
+            hints.extend(line)
+        names += encoded_name
+
+    sections = [
+        np.array(entries, dtype=INDEX_DTYPE).tobytes(),
+        np.array(line_counts, dtype="<i4").tobytes(),
+        np.array(hints, dtype="<i4").tobytes(),
+        bytes(solutions),
+        bytes(names),
+    ]
+    offsets = []
+    pos = _align(HEADER.size)
+    for section in sections:
+        offsets.append(pos)
+        pos = _align(pos + len(section))
+
+    with path.open("wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(entries), *offsets))
+        for offset, section in zip(offsets, sections):
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(section)
+    return len(entries)
+
+
+def _load_dir(puzzle_dir: pathlib.Path) -> Iterator[tuple[str, game.Puzzle]]:
+    for p in natsort.natsorted(puzzle_dir.iterdir()):
+        puzzles = xmlformat.load_all(p.read_text(), skip_unsupported=True)
+        if len(puzzles) == 1:
+            yield p.name, puzzles[0]
+        else:
+            for idx, puzzle in enumerate(puzzles):
+                yield f"{p.name}:{idx}", puzzle
+
+
+@click.command
+@click.argument(
+    "puzzle_dir",
+    type=click.Path(
+        exists=True,
+        file_okay=False,
+        dir_okay=True,
+        readable=True,
+        path_type=pathlib.Path,
+    ),
+)
+@click.argument("corpus_file", type=click.Path(path_type=pathlib.Path))
+def pack_puzzles(puzzle_dir: pathlib.Path, corpus_file: pathlib.Path):
+    count = pack(_load_dir(puzzle_dir), corpus_file)
+    print(f"Packed {count} puzzles into {corpus_file}")
@@ -1,20 +1,51 @@
 import dataclasses
 import datetime
+import enum
 import itertools
-from typing import Optional
+import math
+from typing import Iterator, Optional, Sequence
+
+import numpy as np
 
 
 @dataclasses.dataclass
 class SolutionStatistics:
     unique: int
+    # trials that ran to an answer; timeouts aren't counted here, so
+    # they don't bias the ratio either way
     total: int
+    # includes the time spent on timeouts
     runtime: datetime.timedelta
+    timeouts: int = 0
+
+    def attempts(self) -> int:
+        return self.total + self.timeouts
 
     def ratio(self) -> float:
         return float(self.unique) / float(self.total)
 
     def average_runtime(self) -> datetime.timedelta:
-        return self.runtime / self.total
+        # per attempt, since a timeout costs as much as any other trial
+        return self.runtime / self.attempts()
+
+    def wilson_interval(self, z: float = 1.96) -> tuple[float, float]:
+        # behaves itself at 0 and 1, unlike the normal approximation,
+        # which matters since most configs sit near one or the other
+        return wilson_interval(self.unique, self.total, z)
+
+
+def wilson_interval(
+    successes: float, total: float, z: float = 1.96
+) -> tuple[float, float]:
+    if total <= 0:
+        return 0.0, 1.0
+    p = successes / total
+    denominator = 1 + z * z / total
+    center = (p + z * z / (2 * total)) / denominator
+    half_width = (
+        z * math.sqrt(p * (1 - p) / total + z * z / (4 * total * total)) / denominator
+    )
+    return max(0.0, center - half_width), min(1.0, center + half_width)
 
 
 @dataclasses.dataclass(frozen=True)
@@ -48,15 +79,161 @@ class SamplerConfig:
         ]
 
 
+@dataclasses.dataclass(frozen=True)
+class StoppingConfig:
+    # a config is done once its 95% Wilson interval on p_unique is no
+    # wider than this
+    target_ci_width: Optional[float] = None
+    # limits on a single run, not on what's already in the database
+    max_cpu_seconds: Optional[float] = None
+    max_trials: Optional[int] = None
+
+    def converged(self, stats: SolutionStatistics) -> bool:
+        if self.target_ci_width is None:
+            return False
+        lo, hi = stats.wilson_interval()
+        return hi - lo <= self.target_ci_width
+
+
+@dataclasses.dataclass(frozen=True)
+class Grid:
+    """A filled/empty grid packed into one integer bitset.
+
+    Cell (r, c) is bit r * n_cols + c, so equality, hashing and
+    pickling all cost one bit per cell rather than one object.
+    """
+
+    n_rows: int
+    n_cols: int
+    bits: int
+
+    @classmethod
+    def from_numpy(cls, cells: np.ndarray) -> "Grid":
+        n_rows, n_cols = cells.shape
+        packed = np.packbits(cells.astype(bool, copy=False), bitorder="little")
+        return cls(n_rows, n_cols, int.from_bytes(packed.tobytes(), "little"))
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Sequence[bool]]) -> "Grid":
+        return cls.from_numpy(np.array(rows, dtype=bool).reshape(len(rows), -1))
+
+    def to_numpy(self) -> np.ndarray:
+        n_cells = self.n_rows * self.n_cols
+        packed = np.frombuffer(
+            self.bits.to_bytes((n_cells + 7) // 8, "little"), dtype=np.uint8
+        )
+        cells = np.unpackbits(packed, count=n_cells, bitorder="little")
+        return cells.astype(bool).reshape(self.n_rows, self.n_cols)
+
+    def to_rows(self) -> list[list[bool]]:
+        return self.to_numpy().tolist()
+
+    def cell(self, row_idx: int, col_idx: int) -> bool:
+        return bool(self.bits >> (row_idx * self.n_cols + col_idx) & 1)
+
+    def row(self, row_idx: int) -> list[bool]:
+        line = self.bits >> (row_idx * self.n_cols)
+        return [bool(line >> col_idx & 1) for col_idx in range(self.n_cols)]
+
+    def col(self, col_idx: int) -> list[bool]:
+        return [self.cell(row_idx, col_idx) for row_idx in range(self.n_rows)]
+
+    def transpose(self) -> "Grid":
+        return Grid.from_numpy(self.to_numpy().T)
+
+    def count(self) -> int:
+        return self.bits.bit_count()
+
+    # enough of the list-of-rows interface for code that just walks
+    # the rows
+    def __len__(self) -> int:
+        return self.n_rows
+
+    def __getitem__(self, row_idx: int) -> list[bool]:
+        return self.row(row_idx)
+
+    def __iter__(self) -> Iterator[list[bool]]:
+        return iter(self.to_rows())
+
+
 @dataclasses.dataclass(frozen=True)
 class Solution:
     is_unique: bool
     solve_time: datetime.timedelta
     config: InstanceConfig
-    grid: Optional[list[list[bool]]] = None
+    grid: Optional[Grid] = None
+    # enough to regenerate the puzzle with generate.generate
+    seed: Optional[int] = None
+    build_time: datetime.timedelta = datetime.timedelta()
+    # game.pack_hints of the puzzle, if anyone wants to keep it
+    hints: Optional[bytes] = None
+    # the search hit its time limit before it could tell; is_unique is
+    # meaningless then
+    timed_out: bool = False
+    # CPU time of the worker process, search threads included
+    cpu_time: datetime.timedelta = datetime.timedelta()
+
+
+@dataclasses.dataclass
+class SolveStats:
+    """What the model looked like and what CP-SAT did with it.
+
+    Everything but build_time is about the most recent search; an
+    answer from the line solver or the solve cache leaves the search
+    fields at zero.
+    """
+
+    num_variables: int = 0
+    num_constraints: int = 0
+    build_time: datetime.timedelta = datetime.timedelta()
+    # wall time from the start of the search to each solution
+    solution_times: list[datetime.timedelta] = dataclasses.field(default_factory=list)
+    branches: int = 0
+    conflicts: int = 0
+    # boolean and integer propagations together
+    propagations: int = 0
+    wall_time: datetime.timedelta = datetime.timedelta()
+    # CPU time across all of CP-SAT's threads
+    user_time: datetime.timedelta = datetime.timedelta()
+
+    def first_solution_time(self) -> Optional[datetime.timedelta]:
+        return self.solution_times[0] if self.solution_times else None
+
+    def solution_gaps(self) -> list[datetime.timedelta]:
+        return [b - a for a, b in itertools.pairwise(self.solution_times)]
+
+    def mean_solution_gap(self) -> Optional[datetime.timedelta]:
+        gaps = self.solution_gaps()
+        return sum(gaps, datetime.timedelta()) / len(gaps) if gaps else None
 
 
 @dataclasses.dataclass(frozen=True)
 class Solutions:
     solve_all_time: datetime.timedelta
-    grids: list[list[list[bool]]]
+    grids: list[Grid]
+    # answered from the solve cache; solve_all_time is from the
+    # original solve
+    cached: bool = False
+    # the search hit its time limit before finding solution_limit
+    # solutions or running out of them, so grids may not be all of them
+    timed_out: bool = False
+
+
+@enum.unique
+class Uniqueness(enum.Enum):
+    UNIQUE = "unique"
+    MULTIPLE = "multiple"
+    UNSOLVABLE = "unsolvable"
+    # hit the time limit before finding a second solution or ruling one
+    # out
+    TIMEOUT = "timeout"
+
+
+@dataclasses.dataclass(frozen=True)
+class UniquenessCheck:
+    uniqueness: Uniqueness
+    solve_time: datetime.timedelta
+    # no grids if unsolvable, the solution if unique, and two
+    # different solutions if there are multiple
+    grids: list[Grid]
+    cached: bool = False
@@ -0,0 +1,188 @@
+import dataclasses
+import functools
+from typing import Iterator, Sequence
+
+import numpy as np
+
+from nonogram import placement_cache
+
+# 2**36 grids at 6 on a side is most of an hour on one core; 7 would
+# be 2**13 times that
+MAX_SIZE = 6
+# grids counted at once by one worker, which holds a few int64s for
+# each of them
+CHUNK_GRIDS = 1 << 22
+
+
+def line_hints(mask: int) -> tuple[int, ...]:
+    """The hints of a line given as a mask with bit c for cell c."""
+    hints = []
+    while mask:
+        # skip to the next run, then measure it
+        mask >>= (mask & -mask).bit_length() - 1
+        run = (~mask & (mask + 1)).bit_length() - 1
+        hints.append(run)
+        mask >>= run
+    return tuple(hints)
+
+
+@dataclasses.dataclass(frozen=True)
+class _Tables:
+    size: int
+    # every hint sequence that fits on a line, which is what a line
+    # gets reduced to in a grid's signature
+    classes: list[tuple[int, ...]]
+    # the index into classes of every line mask
+    class_of: np.ndarray
+    # the index of each class's mirror image
+    mirror: list[int]
+    # every line mask with each class's hints
+    placements: list[np.ndarray]
+    # spread[r][mask] puts row r's cells into every column at once, with
+    # column c's mask at bits size * c and up
+    spread: list[np.ndarray]
+    popcount: np.ndarray
+
+
+@functools.cache
+def _tables(size: int) -> _Tables:
+    classes = list(placement_cache.all_hints(size))
+    index = {hints: idx for idx, hints in enumerate(classes)}
+    masks = range(1 << size)
+    spread = []
+    for row in range(size):
+        spread.append(
+            np.array(
+                [
+                    sum(1 << (c * size + row) for c in range(size) if mask >> c & 1)
+                    for mask in masks
+                ],
+                dtype=np.int64,
+            )
+        )
+    return _Tables(
+        size=size,
+        classes=classes,
+        class_of=np.array([index[line_hints(mask)] for mask in masks], dtype=np.int64),
+        mirror=[index[hints[::-1]] for hints in classes],
+        placements=[
+            np.array(placement_cache.placements(size, hints), dtype=np.int64)
+            for hints in classes
+        ],
+        spread=spread,
+        popcount=np.array([mask.bit_count() for mask in masks], dtype=np.int64),
+    )
+
+
+def _chunk_grids(tables: _Tables, prefix: Sequence[int]) -> int:
+    grids = 1 << (tables.size * (tables.size - len(prefix)))
+    for cls in prefix:
+        grids *= len(tables.placements[cls])
+    return grids
+
+
+def chunks(size: int) -> Iterator[tuple[tuple[int, ...], int]]:
+    """Groups of grids that can be counted on their own, with their weights.
+
+    A chunk is every grid whose first few rows have the given hints,
+    as indices into the hint classes. Two grids with the same hints
+    are always in the same chunk, so a grid's signature is unique
+    overall exactly when it's unique within its chunk. Rows are added
+    to the prefix until a chunk is at most CHUNK_GRIDS grids. Mirroring
+    every row left to right turns one chunk into another with the same
+    counts, so only one of each pair is yielded, with weight 2.
+    """
+    tables = _tables(size)
+
+    def split(prefix: tuple[int, ...]) -> Iterator[tuple[tuple[int, ...], int]]:
+        if len(prefix) == size or _chunk_grids(tables, prefix) <= CHUNK_GRIDS:
+            mirrored = tuple(tables.mirror[cls] for cls in prefix)
+            if prefix < mirrored:
+                yield prefix, 2
+            elif prefix == mirrored:
+                yield prefix, 1
+            return
+        for cls in range(len(tables.classes)):
+            yield from split(prefix + (cls,))
+
+    yield from split(())
+
+
+@functools.cache
+def _suffix(size: int, rows: int) -> tuple[np.ndarray, np.ndarray]:
+    """Every way to fill the last rows rows: their signature and their columns."""
+    tables = _tables(size)
+    first = size - rows
+    line_mask = (1 << size) - 1
+    grids = np.arange(1 << (size * rows), dtype=np.int64)
+    columns = np.zeros_like(grids)
+    popcount = np.zeros_like(grids)
+    signature = np.zeros_like(grids)
+    for idx in range(rows):
+        row = (grids >> (idx * size)) & line_mask
+        columns |= tables.spread[first + idx][row]
+        popcount += tables.popcount[row]
+        signature = signature * len(tables.classes) + tables.class_of[row]
+    # the filled cell count sits above the row hints, which sit above
+    # the column hints added on later
+    base = len(tables.classes) ** (rows + size)
+    return popcount * base + signature * len(tables.classes) ** size, columns
+
+
+def count_chunk(size: int, prefix: Sequence[int], weight: int = 1) -> list[int]:
+    """How many grids in a chunk have a signature of their own, by filled cells."""
+    tables = _tables(size)
+    n_classes = len(tables.classes)
+    line_mask = (1 << size) - 1
+
+    # every combination of placements of the prefix rows, as columns
+    prefix_columns = np.zeros(1, dtype=np.int64)
+    prefix_popcount = 0
+    for row, cls in enumerate(prefix):
+        spread = tables.spread[row][tables.placements[cls]]
+        prefix_columns = (prefix_columns[:, None] | spread[None, :]).ravel()
+        prefix_popcount += sum(tables.classes[cls])
+
+    suffix_signature, suffix_columns = _suffix(size, size - len(prefix))
+    columns = (prefix_columns[:, None] | suffix_columns[None, :]).ravel()
+    signature = np.broadcast_to(
+        suffix_signature[None, :], (len(prefix_columns), len(suffix_signature))
+    ).ravel()
+    for col in range(size):
+        col_class = tables.class_of[(columns >> (col * size)) & line_mask]
+        signature = signature + col_class * n_classes ** (size - 1 - col)
+
+    signature.sort()
+    alone = np.ones(len(signature), dtype=bool)
+    same = signature[1:] == signature[:-1]
+    alone[1:] &= ~same
+    alone[:-1] &= ~same
+    filled = signature[alone] // n_classes ** (2 * size - len(prefix))
+    counts = np.bincount(filled, minlength=size * size + 1 - prefix_popcount)
+    return [0] * prefix_popcount + [weight * int(c) for c in counts]
+
+
+def count_task(task: tuple[int, tuple[int, ...], int]) -> list[int]:
+    size, prefix, weight = task
+    return count_chunk(size, prefix, weight)
+
+
+def tasks(size: int) -> list[tuple[int, tuple[int, ...], int]]:
+    return [(size, prefix, weight) for prefix, weight in chunks(size)]
+
+
+def add_counts(a: Sequence[int], b: Sequence[int]) -> list[int]:
+    return [x + y for x, y in zip(a, b, strict=True)]
+
+
+def p_unique(unique_counts: Sequence[int], p: float) -> float:
+    """P(unique) when each cell is filled with probability p.
+
+    unique_counts[k] is the number of grids with k filled cells whose
+    hints belong to no other grid.
+    """
+    cells = len(unique_counts) - 1
+    return sum(
+        count * p**filled * (1 - p) ** (cells - filled)
+        for filled, count in enumerate(unique_counts)
+    )
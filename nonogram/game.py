@@ -1,6 +1,7 @@
 import dataclasses
 import enum
 from typing import Optional, Iterator
+import numpy as np
 import rich.text
 import rich.style
 
@@ -17,7 +18,7 @@ class Dim(enum.Enum):
 class Puzzle:
     config: data.InstanceConfig
     hints: dict[Dim, list[list[int]]]
-    solution: Optional[list[list[bool]]] = None
+    solution: Optional[data.Grid] = None
 
     def size(self, dim):
         if dim == Dim.ROW:
@@ -42,7 +43,7 @@ class Puzzle:
         return max(len(str(h)) for h in self.all_hints())
 
     def to_text(
-        self, with_hints: bool = True, with_solution: Optional[list[list[bool]]] = None
+        self, with_hints: bool = True, with_solution: Optional[data.Grid] = None
     ) -> rich.text.Text:
         cw = self.max_hint_width()
 
@@ -99,3 +100,30 @@ class Puzzle:
                         )
 
         return rich.text.Text("\n").join(rich.text.Text("").join(r) for r in chars)
+
+
+# pack_hints layout: little-endian uint16s holding the row count, the
+# column count, the number of hints in each line (rows then columns),
+# then every hint back to back
+HINT_DTYPE = np.dtype("<u2")
+
+
+def pack_hints(hints: dict[Dim, list[list[int]]]) -> bytes:
+    lines = hints[Dim.ROW] + hints[Dim.COL]
+    values = [len(hints[Dim.ROW]), len(hints[Dim.COL])]
+    values.extend(len(line) for line in lines)
+    for line in lines:
+        values.extend(line)
+    return np.array(values, dtype=HINT_DTYPE).tobytes()
+
+
+def unpack_hints(blob: bytes) -> dict[Dim, list[list[int]]]:
+    values = np.frombuffer(blob, dtype=HINT_DTYPE).tolist()
+    n_rows, n_cols = values[:2]
+    counts = values[2 : 2 + n_rows + n_cols]
+    pos = 2 + n_rows + n_cols
+    lines = []
+    for count in counts:
+        lines.append(values[pos : pos + count])
+        pos += count
+    return {Dim.ROW: lines[:n_rows], Dim.COL: lines[n_rows:]}
@@ -1,32 +1,132 @@
-import random
-import more_itertools
+import dataclasses
 import itertools
+from typing import Iterator, Optional, Sequence
+
+import numpy as np
 
 from nonogram import game
 from nonogram import data
 
 
-def generate(config: data.InstanceConfig) -> game.Puzzle:
-    cells = random.choices(
-        [True, False], cum_weights=[config.prob, 1], k=config.size**2
+def _line_hints(lines: np.ndarray) -> list[list[int]]:
+    # each line's cells as bytes of 0 and 1, so the runs of filled
+    # cells are whatever's left between the zero bytes
+    return [
+        [len(run) for run in line.tobytes().split(b"\0") if run]
+        for line in np.ascontiguousarray(lines).view(np.uint8)
+    ]
+
+
+def generate(config: data.InstanceConfig, seed: Optional[int] = None) -> game.Puzzle:
+    # the same seed and config always give the same puzzle, and the
+    # same one generate_batch(config, 1, seed) would
+    rng = np.random.default_rng(seed)
+    grid = rng.random((config.size, config.size)) < config.prob
+    return game.Puzzle(
+        config=config,
+        hints={game.Dim.ROW: _line_hints(grid), game.Dim.COL: _line_hints(grid.T)},
+        solution=data.Grid.from_numpy(grid),
     )
-    grid = list(more_itertools.chunked(cells, config.size, strict=True))
-    rows = []
-    for row in range(config.size):
-        row_hints = []
-        for value, group in itertools.groupby(grid[row]):
-            if value:
-                row_hints.append(len(list(group)))
-        rows.append(row_hints)
-    grid_t = list(more_itertools.transpose(grid))
-    cols = []
-    for col in range(config.size):
-        col_hints = []
-        for value, group in itertools.groupby(grid_t[col]):
-            if value:
-                col_hints.append(len(list(group)))
-        cols.append(col_hints)
-    result = game.Puzzle(
-        config=config, hints={game.Dim.ROW: rows, game.Dim.COL: cols}, solution=grid
+
+
+def root_seed(seed: Optional[int] = None) -> int:
+    """The root of a run's trial seeds: seed itself, or fresh entropy if None."""
+    entropy = np.random.SeedSequence(seed).entropy
+    assert isinstance(entropy, int)
+    return entropy
+
+
+def trial_seed(root: int, trial: int) -> int:
+    """The seed for the trial-th puzzle of the run rooted at root.
+
+    Depends only on root and trial, not on which worker runs the trial
+    or when, and different trials get independent streams.
+    """
+    # the same child that SeedSequence(root).spawn would hand out
+    # trial-th, without spawning everything before it. cut to 63 bits
+    # so it fits in a sqlite INTEGER.
+    child = np.random.SeedSequence(root, spawn_key=(trial,))
+    return int(child.generate_state(1, np.uint64)[0]) >> 1
+
+
+def run_lengths(grids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Hints for every row of every grid in an (n, rows, cols) batch.
+
+    Returns the run lengths of all rows concatenated, and offsets such
+    that the hints for row r of grid i are
+    lengths[offsets[i * rows + r] : offsets[i * rows + r + 1]].
+    """
+    n, rows, cols = grids.shape
+    padded = np.zeros((n, rows, cols + 2), dtype=np.int8)
+    padded[:, :, 1:-1] = grids
+    edges = np.diff(padded, axis=-1)
+    # nonzero walks in C order, so the k-th run start and the k-th run
+    # end belong to the same run
+    grid_idx, line_idx, starts = np.nonzero(edges == 1)
+    ends = np.nonzero(edges == -1)[2]
+    lengths = (ends - starts).astype(np.int32)
+    counts = np.bincount(grid_idx * rows + line_idx, minlength=n * rows)
+    offsets = np.zeros(n * rows + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return lengths, offsets
+
+
+@dataclasses.dataclass(frozen=True)
+class PuzzleBatch:
+    config: data.InstanceConfig
+    grids: np.ndarray
+    row_hints: np.ndarray
+    row_offsets: np.ndarray
+    col_hints: np.ndarray
+    col_offsets: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.grids)
+
+    def __iter__(self) -> Iterator[game.Puzzle]:
+        for idx in range(len(self)):
+            yield self.puzzle(idx)
+
+    def _lines(self, hints: np.ndarray, offsets: np.ndarray, idx: int):
+        size = self.config.size
+        bounds = offsets[idx * size : (idx + 1) * size + 1].tolist()
+        return [hints[lo:hi].tolist() for lo, hi in itertools.pairwise(bounds)]
+
+    def puzzle(self, idx: int) -> game.Puzzle:
+        return game.Puzzle(
+            config=self.config,
+            hints={
+                game.Dim.ROW: self._lines(self.row_hints, self.row_offsets, idx),
+                game.Dim.COL: self._lines(self.col_hints, self.col_offsets, idx),
+            },
+            solution=data.Grid.from_numpy(self.grids[idx]),
+        )
+
+
+def generate_batch(
+    config: data.InstanceConfig, n: int, seed: Optional[int] = None
+) -> PuzzleBatch:
+    rng = np.random.default_rng(seed)
+    return _batch(config, rng.random((n, config.size, config.size)) < config.prob)
+
+
+def generate_seeded(config: data.InstanceConfig, seeds: Sequence[int]) -> PuzzleBatch:
+    """A puzzle for each seed, the same one generate(config, seed) would give."""
+    grids = np.empty((len(seeds), config.size, config.size), dtype=bool)
+    for idx, seed in enumerate(seeds):
+        rng = np.random.default_rng(seed)
+        grids[idx] = rng.random((config.size, config.size)) < config.prob
+    return _batch(config, grids)
+
+
+def _batch(config: data.InstanceConfig, grids: np.ndarray) -> PuzzleBatch:
+    row_hints, row_offsets = run_lengths(grids)
+    col_hints, col_offsets = run_lengths(grids.transpose(0, 2, 1))
+    return PuzzleBatch(
+        config=config,
+        grids=grids,
+        row_hints=row_hints,
+        row_offsets=row_offsets,
+        col_hints=col_hints,
+        col_offsets=col_offsets,
     )
-    return result
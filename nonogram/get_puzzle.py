@@ -1,4 +1,3 @@
-import requests
 import click
 from rich import print
 import pathlib
@@ -38,6 +37,9 @@ def main(
         if n <= verbosity:
             print(*args)
 
+    # slow to import, and not needed for --help
+    import requests
+
     puzzle_dir.mkdir(parents=True, exist_ok=True)
 
     for puzzle_id in puzzle_ids:
@@ -0,0 +1,264 @@
+import collections
+from typing import Optional, Sequence
+
+import numpy as np
+
+from nonogram import data
+from nonogram import game
+from nonogram import placement_cache
+
+# cell states in the shared grid
+UNKNOWN = -1
+EMPTY = 0
+FILLED = 1
+
+# lines with up to this many placements are settled by filtering their
+# placements from the placement cache, which beats _placements up to
+# about here
+CACHED_MAX_PLACEMENTS = 1000
+
+
+def blank(puzzle: game.Puzzle) -> np.ndarray:
+    return np.full((puzzle.n_rows, puzzle.n_cols), UNKNOWN, dtype=np.int8)
+
+
+def is_solved(cells: np.ndarray) -> bool:
+    return not bool((cells == UNKNOWN).any())
+
+
+def to_grid(cells: np.ndarray) -> data.Grid:
+    return data.Grid.from_numpy(cells == FILLED)
+
+
+def overlap(hints: Sequence[int], length: int) -> Optional[list[int]]:
+    # the classic "simple boxes" rule on a line with nothing known
+    # yet: pack every extent as far left as it'll go and as far right
+    # as it'll go, and whatever an extent covers in both packings has
+    # to be filled.
+    slack = length - (sum(hints) + len(hints) - 1)
+    if not hints:
+        return [EMPTY] * length
+    if slack < 0:
+        return None
+
+    line = [UNKNOWN] * length
+    pos = 0
+    for hint in hints:
+        # leftmost start is pos, rightmost start is pos + slack
+        for idx in range(pos + slack, pos + hint):
+            line[idx] = FILLED
+        pos += hint + 1
+
+    if slack == 0:
+        # the line is packed solid, so the gaps are known too
+        line = [EMPTY if v == UNKNOWN else v for v in line]
+    return line
+
+
+def _placements(
+    hints: Sequence[int], line: Sequence[int]
+) -> Optional[tuple[list[list[int]], list[bool]]]:
+    """Every consistent start for each extent, and which cells can be empty.
+
+    Returns None if the hints can't be placed on the line at all.
+    """
+    n = len(line)
+    k = len(hints)
+
+    can_empty = [v != FILLED for v in line]
+    # empties[j] is the number of known-empty cells in line[:j], so
+    # an extent fits in [s, e) iff empties[s] == empties[e]
+    empties = [0] * (n + 1)
+    for j, v in enumerate(line):
+        empties[j + 1] = empties[j] + (v == EMPTY)
+
+    # fwd[i][j]: line[:j] can hold exactly the first i extents
+    fwd = [[False] * (n + 1) for _ in range(k + 1)]
+    fwd[0][0] = True
+    for j in range(1, n + 1):
+        fwd[0][j] = fwd[0][j - 1] and can_empty[j - 1]
+    for i in range(1, k + 1):
+        hint = hints[i - 1]
+        row = fwd[i]
+        prev = fwd[i - 1]
+        for j in range(hint, n + 1):
+            ok = row[j - 1] and can_empty[j - 1]
+            if not ok and empties[j] == empties[j - hint]:
+                s = j - hint
+                ok = prev[0] if s == 0 else (can_empty[s - 1] and prev[s - 1])
+            row[j] = ok
+
+    if not fwd[k][n]:
+        return None
+
+    # bwd[i][j]: line[j:] can hold exactly the extents from i onwards
+    bwd = [[False] * (n + 1) for _ in range(k + 1)]
+    bwd[k][n] = True
+    for j in range(n - 1, -1, -1):
+        bwd[k][j] = bwd[k][j + 1] and can_empty[j]
+    for i in range(k - 1, -1, -1):
+        hint = hints[i]
+        row = bwd[i]
+        nxt = bwd[i + 1]
+        for j in range(n - 1, -1, -1):
+            ok = row[j + 1] and can_empty[j]
+            e = j + hint
+            if not ok and e <= n and empties[e] == empties[j]:
+                ok = nxt[n] if e == n else (can_empty[e] and nxt[e + 1])
+            row[j] = ok
+
+    starts = []
+    for i, hint in enumerate(hints):
+        hint_starts = []
+        for s in range(n - hint + 1):
+            e = s + hint
+            if empties[e] != empties[s]:
+                continue
+            if s == 0:
+                left = fwd[i][0]
+            else:
+                left = can_empty[s - 1] and fwd[i][s - 1]
+            if not left:
+                continue
+            if e == n:
+                right = bwd[i + 1][n]
+            else:
+                right = can_empty[e] and bwd[i + 1][e + 1]
+            if right:
+                hint_starts.append(s)
+        starts.append(hint_starts)
+
+    gaps = [
+        can_empty[c] and any(fwd[i][c] and bwd[i][c + 1] for i in range(k + 1))
+        for c in range(n)
+    ]
+    return starts, gaps
+
+
+def _settle_cached(hints: Sequence[int], line: Sequence[int]) -> Optional[list[int]]:
+    n = len(line)
+    cached = placement_cache.get(n, hints)
+    if not cached.placements:
+        return None
+    filled = 0
+    empty = 0
+    for c, v in enumerate(line):
+        if v == FILLED:
+            filled |= 1 << c
+        elif v == EMPTY:
+            empty |= 1 << c
+    if filled or empty:
+        settled = placement_cache.settle(cached.placements, filled, empty, (1 << n) - 1)
+        if settled is None:
+            return None
+        _, always, never = settled
+    else:
+        always = cached.filled
+        never = cached.empty
+    return [
+        FILLED if always >> c & 1 else EMPTY if never >> c & 1 else UNKNOWN
+        for c in range(n)
+    ]
+
+
+def settle_line(hints: Sequence[int], line: Sequence[int]) -> Optional[list[int]]:
+    """Fix every cell that has the same value in all consistent placements."""
+    if placement_cache.placement_count(len(line), hints) <= CACHED_MAX_PLACEMENTS:
+        return _settle_cached(hints, line)
+    placements = _placements(hints, line)
+    if placements is None:
+        return None
+    starts, gaps = placements
+
+    n = len(line)
+    # a difference array over the cells covered by any consistent
+    # placement of any extent
+    covered = [0] * (n + 1)
+    for hint, hint_starts in zip(hints, starts):
+        for s in hint_starts:
+            covered[s] += 1
+            covered[s + hint] -= 1
+
+    result = []
+    coverage = 0
+    for c in range(n):
+        coverage += covered[c]
+        if coverage and not gaps[c]:
+            result.append(FILLED)
+        elif gaps[c] and not coverage:
+            result.append(EMPTY)
+        elif coverage:
+            result.append(UNKNOWN)
+        else:
+            return None
+    return result
+
+
+def start_bounds(
+    hints: Sequence[int], line: Sequence[int]
+) -> Optional[list[tuple[int, int]]]:
+    """The leftmost and rightmost consistent start of each extent."""
+    placements = _placements(hints, line)
+    if placements is None:
+        return None
+    starts, _ = placements
+    return [(hint_starts[0], hint_starts[-1]) for hint_starts in starts]
+
+
+def line_view(cells: np.ndarray, dim: game.Dim, line_idx: int) -> np.ndarray:
+    if dim == game.Dim.ROW:
+        return cells[line_idx, :]
+    return cells[:, line_idx]
+
+
+def propagate(
+    puzzle: game.Puzzle, cells: Optional[np.ndarray] = None
+) -> Optional[np.ndarray]:
+    """Run line solving on every row and column until nothing changes.
+
+    Returns the resulting cell states, or None if the hints contradict
+    each other.
+    """
+    if cells is None:
+        cells = blank(puzzle)
+        for dim, lines in puzzle.hints.items():
+            for line_idx, hints in enumerate(lines):
+                simple = overlap(hints, puzzle.size(dim))
+                if simple is None:
+                    return None
+                view = line_view(cells, dim, line_idx)
+                for c, v in enumerate(simple):
+                    if v == UNKNOWN:
+                        continue
+                    if view[c] != UNKNOWN and view[c] != v:
+                        return None
+                    view[c] = v
+    else:
+        cells = cells.copy()
+
+    other = {game.Dim.ROW: game.Dim.COL, game.Dim.COL: game.Dim.ROW}
+    queue = collections.deque(
+        (dim, line_idx)
+        for dim, lines in puzzle.hints.items()
+        for line_idx in range(len(lines))
+    )
+    queued = set(queue)
+    while queue:
+        dim, line_idx = queue.popleft()
+        queued.discard((dim, line_idx))
+
+        view = line_view(cells, dim, line_idx)
+        line = view.tolist()
+        settled = settle_line(puzzle.hints[dim][line_idx], line)
+        if settled is None:
+            return None
+        for c, (old, new) in enumerate(zip(line, settled)):
+            if old == new:
+                continue
+            view[c] = new
+            crossing = (other[dim], c)
+            if crossing not in queued:
+                queued.add(crossing)
+                queue.append(crossing)
+
+    return cells
@@ -0,0 +1,278 @@
+import dataclasses
+import datetime
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+import natsort
+import rich.table
+from rich import print
+
+from nonogram import benchstats
+from nonogram import corpus
+from nonogram import data
+from nonogram import generate
+from nonogram import solver
+
+
+@dataclasses.dataclass
+class CallbackOverhead:
+    name: str
+    encoding: solver.Encoding
+    num_solutions: int
+    enumerate_time: datetime.timedelta
+    # time spent inside the solution callback over the whole
+    # enumeration. comparing against an enumeration with a no-op
+    # callback would be simpler, but CP-SAT's run to run noise swamps
+    # the difference.
+    callback_time: datetime.timedelta
+    # extract_grid on its own, averaged over many calls
+    per_call: datetime.timedelta
+
+    def per_solution(self) -> datetime.timedelta:
+        return self.callback_time / max(self.num_solutions, 1)
+
+    def callback_fraction(self) -> float:
+        return self.callback_time / self.enumerate_time
+
+
+def callback_overhead(
+    name: str,
+    puzzle,
+    encoding: solver.Encoding,
+    solution_limit: int,
+    calls: int,
+) -> CallbackOverhead:
+    instance = solver.build(
+        puzzle, presolve=False, encoding=encoding, engine=solver.Engine.CP_SAT
+    )
+    model = instance.ensure_model()
+
+    callback_seconds = 0.0
+
+    def solution_cb():
+        nonlocal callback_seconds
+        time_start = time.perf_counter()
+        instance.extract_grid()
+        callback_seconds += time.perf_counter() - time_start
+
+    time_start = time.perf_counter()
+    num_solutions = model.solveAll(display=solution_cb, solution_limit=solution_limit)
+    time_end = time.perf_counter()
+
+    # the variables still hold the last solution found
+    call_start = time.perf_counter()
+    for _ in range(calls):
+        instance.extract_grid()
+    call_end = time.perf_counter()
+
+    return CallbackOverhead(
+        name=name,
+        encoding=encoding,
+        num_solutions=num_solutions,
+        enumerate_time=datetime.timedelta(seconds=time_end - time_start),
+        callback_time=datetime.timedelta(seconds=callback_seconds),
+        per_call=datetime.timedelta(seconds=call_end - call_start) / calls,
+    )
+
+
+def _microseconds(td: datetime.timedelta) -> str:
+    return f"{td.total_seconds() * 1e6:.1f}µs"
+
+
+def make_table(results: list[CallbackOverhead]) -> rich.table.Table:
+    table = rich.table.Table()
+    table.add_column("Puzzle ID", justify="right")
+    table.add_column("Encoding")
+    table.add_column("#Solutions", justify="right")
+    table.add_column("Enumerate", justify="right")
+    table.add_column("In Callback", justify="right")
+    table.add_column("Per Solution", justify="right")
+    table.add_column("Per Call", justify="right")
+    for result in results:
+        table.add_row(
+            result.name,
+            result.encoding.name,
+            str(result.num_solutions),
+            f"{result.enumerate_time.total_seconds():.3f}s",
+            f"{result.callback_fraction():.1%}",
+            _microseconds(result.per_solution()),
+            _microseconds(result.per_call),
+        )
+    return table
+
+
+# every one of [project.scripts] in pyproject.toml, as the module and
+# function each one runs; new commands belong here too
+_ENTRY_POINTS = [
+    ("solve_nonogram", "nonogram.cli", "solve_nonogram"),
+    ("get_nonogram", "nonogram.get_puzzle", "main"),
+    ("benchmark_nonogram", "nonogram.benchmark", "main"),
+    ("microbench_nonogram", "nonogram.microbench", "main"),
+    ("pack_puzzles", "nonogram.corpus", "pack_puzzles"),
+    (
+        "solve_random_nonograms",
+        "nonogram.solve_random_nonograms",
+        "solve_random_nonograms",
+    ),
+    (
+        "continue_random_nonograms",
+        "nonogram.solve_random_nonograms",
+        "continue_random_nonograms",
+    ),
+    ("replay_trial", "nonogram.solve_random_nonograms", "replay_trial"),
+    ("exact_uniqueness", "nonogram.solve_random_nonograms", "exact_uniqueness"),
+]
+
+
+@dataclasses.dataclass
+class StartupTime:
+    name: str
+    # wall seconds for each run, from launching the interpreter to it
+    # exiting
+    seconds: list[float]
+
+
+def _time_process(code: str, args: list[str], repeats: int) -> list[float]:
+    # a fresh interpreter every time, since a second import in the same
+    # process is free
+    seconds = []
+    for _ in range(repeats):
+        time_start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-c", code, *args],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        seconds.append(time.perf_counter() - time_start)
+    return seconds
+
+
+def startup_times(puzzle_file: pathlib.Path, repeats: int) -> list[StartupTime]:
+    results = [StartupTime("python", _time_process("pass", [], repeats))]
+    for script, module, function in _ENTRY_POINTS:
+        results.append(
+            StartupTime(
+                f"import {module}", _time_process(f"import {module}", [], repeats)
+            )
+        )
+        results.append(
+            StartupTime(
+                f"{script} --help",
+                _time_process(
+                    f"from {module} import {function}; {function}()",
+                    ["--help"],
+                    repeats,
+                ),
+            )
+        )
+    solve = "from nonogram.cli import solve_nonogram; solve_nonogram()"
+    solve_args = [str(puzzle_file), "--puzzle_id", "random", "--no-cache"]
+    results.append(
+        StartupTime("solve_nonogram 5x5", _time_process(solve, solve_args, repeats))
+    )
+    # small puzzles go to the backtracker by default, and the line
+    # solver would finish most of them for CP-SAT anyway, so this is
+    # the one that has to load the CP solver
+    cp_sat_args = ["--engine", "cp_sat", "--no-presolve"]
+    results.append(
+        StartupTime(
+            "solve_nonogram 5x5 --engine cp_sat --no-presolve",
+            _time_process(solve, solve_args + cp_sat_args, repeats),
+        )
+    )
+    return results
+
+
+def make_startup_table(results: list[StartupTime]) -> rich.table.Table:
+    table = rich.table.Table(caption="wall time of a fresh interpreter")
+    table.add_column("Command")
+    table.add_column("Median", justify="right")
+    table.add_column("IQR", justify="right")
+    for result in results:
+        summary = benchstats.summarize(result.seconds)
+        table.add_row(
+            result.name,
+            f"{summary.median * 1e3:.0f}ms",
+            f"{summary.iqr * 1e3:.0f}ms",
+        )
+    return table
+
+
+@click.group
+def main():
+    pass
+
+
+@main.command
+@click.option(
+    "--puzzle_dir",
+    help="Directory of puzzle XML files, or a corpus made by pack_puzzles",
+    type=click.Path(
+        exists=True,
+        file_okay=True,
+        dir_okay=True,
+        readable=True,
+        path_type=pathlib.Path,
+    ),
+    default=None,
+)
+@click.option(
+    "--size",
+    type=int,
+    default=20,
+    help="Size of the random puzzles used when no --puzzle_dir is given",
+)
+@click.option("--prob", type=float, default=0.3)
+@click.option("--count", type=int, default=5)
+@click.option("--seed", type=int, default=0)
+@click.option("--solution_limit", type=int, default=1000)
+@click.option("--calls", type=int, default=1000)
+def callbacks(
+    puzzle_dir: pathlib.Path,
+    size: int,
+    prob: float,
+    count: int,
+    seed: int,
+    solution_limit: int,
+    calls: int,
+):
+    """Time the per-solution callback that solve_all runs."""
+    if puzzle_dir is not None:
+        puzzles = []
+        for ref in natsort.natsorted(corpus.refs(puzzle_dir)):
+            try:
+                puzzles.append(corpus.load_ref(ref))
+            except NotImplementedError:
+                continue
+    else:
+        # sparse random puzzles have lots of solutions, which is where
+        # the callback cost shows
+        batch = generate.generate_batch(
+            data.InstanceConfig(size=size, prob=prob), count, seed=seed
+        )
+        puzzles = [(f"random-{idx}", puzzle) for idx, puzzle in enumerate(batch)]
+
+    results = []
+    for name, puzzle in puzzles:
+        for encoding in solver.Encoding:
+            results.append(
+                callback_overhead(name, puzzle, encoding, solution_limit, calls)
+            )
+    print(make_table(results))
+
+
+@main.command
+@click.option("--repeats", type=int, default=10)
+@click.option("--seed", type=int, default=0)
+def startup(repeats: int, seed: int):
+    """Time how long each command takes to import and get going."""
+    puzzle = generate.generate(data.InstanceConfig(size=5, prob=0.5), seed=seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        puzzle_file = pathlib.Path(tmp) / "startup.corpus"
+        corpus.pack([("random", puzzle)], puzzle_file)
+        results = startup_times(puzzle_file, repeats)
+    print(make_startup_table(results))
@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import collections
+import threading
+from typing import TYPE_CHECKING, Optional, Sequence
+
+import numpy as np
+
+from nonogram import linesolver
+
+if TYPE_CHECKING:
+    import cpmpy.solvers.ortools
+
+# templates kept per process; a sweep only visits a handful of sizes
+MAX_TEMPLATES = 32
+
+# an automaton as solver._automaton makes them: transitions as (state,
+# cell value, next state), the starting state and the accepting states
+Automaton = tuple[list[tuple[int, int, int]], int, list[int]]
+
+
+class ModelTemplate:
+    """The cells encoding for every puzzle of one shape, rebound per puzzle.
+
+    The model is the cells encoding's, a boolvar per cell and an
+    automaton per line, but the hints are never built into it. bind()
+    writes each line's transition table straight into the CP-SAT model
+    proto, and fixes the cells the line solver settled by narrowing
+    their domains there, so building the model through cpmpy and
+    translating it to CP-SAT happens once per shape rather than once
+    per puzzle.
+
+    CP-SAT itself starts every search from scratch whatever it's given,
+    so the saving is all in building.
+    """
+
+    def __init__(self, n_rows: int, n_cols: int):
+        import cpmpy
+
+        self.n_rows = n_rows
+        self.n_cols = n_cols
+        self.solver = cpmpy.SolverLookup.get("ortools")
+        self.cells = cpmpy.boolvar(shape=(n_rows, n_cols), name="cell")
+        # proto index of each line's automaton constraint, rows then
+        # columns
+        self.automata: list[int] = []
+        lines = [self.cells[row_idx, :] for row_idx in range(n_rows)] + [
+            self.cells[:, col_idx] for col_idx in range(n_cols)
+        ]
+        for line in lines:
+            # a stand-in until the first bind(): a line with no hints
+            self.solver += cpmpy.DirectConstraint(
+                "AddAutomaton", (list(line), 0, [0], [(0, 0, 0)]), novar=[1, 2, 3]
+            )
+            self.automata.append(len(self.solver.ort_model.Proto().constraints) - 1)
+        self.cell_indices = [self.solver.solver_var(v).Index() for v in self.cells.flat]
+        # what the model was last bound to, see bind()
+        self.bound: Optional[object] = None
+
+    def bind(
+        self,
+        owner: object,
+        automata: Sequence[Automaton],
+        cells: Optional[np.ndarray],
+    ) -> cpmpy.solvers.ortools.CPM_ortools:
+        """Point the model at a puzzle, and remember owner as what it's bound to.
+
+        automata has one automaton per line, rows then columns, and
+        cells is whatever the line solver settled, if it ran.
+        """
+        from ortools.sat.python import cp_model
+
+        assert len(automata) == len(self.automata)
+        proto = self.solver.ort_model.Proto()
+        for constraint_idx, (transitions, start, accepting) in zip(
+            self.automata, automata
+        ):
+            automaton = proto.constraints[constraint_idx].automaton
+            automaton.starting_state = start
+            _replace(automaton.final_states, accepting)
+            _replace(automaton.transition_tail, [t for t, _, _ in transitions])
+            _replace(automaton.transition_label, [label for _, label, _ in transitions])
+            _replace(automaton.transition_head, [h for _, _, h in transitions])
+
+        known = (
+            [linesolver.UNKNOWN] * len(self.cell_indices)
+            if cells is None
+            else cells.ravel().tolist()
+        )
+        for var_idx, value in zip(self.cell_indices, known):
+            # every cell's domain is a single interval, two entries long
+            domain = proto.variables[var_idx].domain
+            if value == linesolver.UNKNOWN:
+                domain[0] = 0
+                domain[1] = 1
+            else:
+                domain[0] = value
+                domain[1] = value
+
+        # cpmpy sets every solve's parameters on the CpSolver and leaves
+        # them there, so the last puzzle's time limit and enumeration
+        # would carry over
+        self.solver.ort_solver = cp_model.CpSolver()
+        self.bound = owner
+        return self.solver
+
+
+def _replace(field, values: Sequence[int]):
+    field.clear()
+    field.extend(values)
+
+
+class TemplateCache:
+    """ModelTemplates by (rows, columns), least recently used first out."""
+
+    def __init__(self, max_entries: int = MAX_TEMPLATES):
+        self.max_entries = max_entries
+        self.entries: collections.OrderedDict[tuple[int, int], ModelTemplate] = (
+            collections.OrderedDict()
+        )
+        self.lock = threading.Lock()
+
+    def get(self, n_rows: int, n_cols: int) -> ModelTemplate:
+        key = (n_rows, n_cols)
+        with self.lock:
+            found = self.entries.get(key)
+            if found is not None:
+                self.entries.move_to_end(key)
+                return found
+        found = ModelTemplate(n_rows, n_cols)
+        with self.lock:
+            self.entries[key] = found
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return found
+
+
+# one per process; pool workers each have their own
+_CACHE = TemplateCache()
+
+
+def get(n_rows: int, n_cols: int) -> ModelTemplate:
+    return _CACHE.get(n_rows, n_cols)
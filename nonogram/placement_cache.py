@@ -0,0 +1,225 @@
+import collections
+import dataclasses
+import json
+import math
+import pathlib
+import sys
+import threading
+from typing import Iterator, Optional, Sequence
+
+# lines, not placements, so a handful of long lines with a lot of
+# placements each can still take up a fair bit of memory
+DEFAULT_MAX_ENTRIES = 100_000
+# every line up to this long is 6763 lines and 2**17 placements; each
+# length past it doubles the placements, which every worker would hold
+MAX_PREWARM_LENGTH = 16
+FILE_VERSION = 1
+
+
+def placement_count(length: int, hints: Sequence[int]) -> int:
+    # the slack can be handed out over the len(hints) + 1 gaps in any
+    # way at all
+    slack = length - (sum(hints) + len(hints) - 1)
+    if not hints:
+        return 1
+    if slack < 0:
+        return 0
+    return math.comb(slack + len(hints), len(hints))
+
+
+def placements(length: int, hints: Sequence[int]) -> list[int]:
+    """Every way to lay hints out on a line, as masks with bit c for cell c."""
+    if not hints:
+        return [0]
+    result = []
+    # room the extents after each one need, gaps included
+    tails = [0] * len(hints)
+    for idx in range(len(hints) - 2, -1, -1):
+        tails[idx] = tails[idx + 1] + hints[idx + 1] + 1
+
+    def place(idx: int, pos: int, mask: int):
+        hint = hints[idx]
+        block = (1 << hint) - 1
+        for start in range(pos, length - hint - tails[idx] + 1):
+            placed = mask | block << start
+            if idx + 1 == len(hints):
+                result.append(placed)
+            else:
+                place(idx + 1, start + hint + 1, placed)
+
+    place(0, 0, 0)
+    return result
+
+
+def settle(
+    candidates: Sequence[int], filled: int, empty: int, full: int
+) -> Optional[tuple[Sequence[int], int, int]]:
+    """The candidates that agree with the known cells, and what they all agree on.
+
+    Returns the surviving candidates along with the cells filled in all
+    of them and the cells filled in none, or None if there are no
+    survivors.
+    """
+    if filled or empty:
+        candidates = [p for p in candidates if not p & empty and p & filled == filled]
+        if not candidates:
+            return None
+    always = full
+    sometimes = 0
+    for p in candidates:
+        always &= p
+        sometimes |= p
+    return candidates, always, full & ~sometimes
+
+
+@dataclasses.dataclass(frozen=True)
+class LinePlacements:
+    placements: tuple[int, ...]
+    # cells filled in every placement, and cells filled in none
+    filled: int
+    empty: int
+
+    @classmethod
+    def of(cls, length: int, found: Sequence[int]) -> "LinePlacements":
+        settled = settle(found, 0, 0, (1 << length) - 1)
+        if not found or settled is None:
+            return cls((), 0, 0)
+        _, filled, empty = settled
+        return cls(tuple(found), filled, empty)
+
+    @classmethod
+    def compute(cls, length: int, hints: Sequence[int]) -> "LinePlacements":
+        return cls.of(length, placements(length, hints))
+
+
+@dataclasses.dataclass(frozen=True)
+class CacheInfo:
+    hits: int
+    misses: int
+    entries: int
+    max_entries: int
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class PlacementCache:
+    """Line placements by (length, hints), least recently used first out.
+
+    Random puzzles of one size keep turning up the same few hundred
+    hint sequences, so every puzzle after the first few finds most of
+    its lines already worked out.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries: collections.OrderedDict[
+            tuple[int, tuple[int, ...]], LinePlacements
+        ] = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, length: int, hints: Sequence[int]) -> LinePlacements:
+        key = (length, tuple(hints))
+        with self.lock:
+            found = self.entries.get(key)
+            if found is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return found
+            self.misses += 1
+        # worked out outside the lock; a second thread missing on the
+        # same line just does the same work twice
+        found = LinePlacements.compute(length, hints)
+        self._put(key, found)
+        return found
+
+    def _put(self, key: tuple[int, tuple[int, ...]], value: LinePlacements):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def info(self) -> CacheInfo:
+        with self.lock:
+            return CacheInfo(
+                self.hits, self.misses, len(self.entries), self.max_entries
+            )
+
+    def prewarm(self, max_length: int):
+        """Work out every line up to max_length long, without counting misses."""
+        if max_length > MAX_PREWARM_LENGTH:
+            raise ValueError(
+                f"Lines up to {max_length} long have too many placements to "
+                f"prewarm, at most {MAX_PREWARM_LENGTH} long"
+            )
+        for length in range(max_length + 1):
+            for hints in all_hints(length):
+                self._put((length, hints), LinePlacements.compute(length, hints))
+
+    def save(self, path: pathlib.Path):
+        with self.lock:
+            lines = [
+                [length, list(hints), list(value.placements)]
+                for (length, hints), value in self.entries.items()
+            ]
+        path.write_text(json.dumps({"version": FILE_VERSION, "lines": lines}))
+
+    def load(self, path: pathlib.Path):
+        contents = json.loads(path.read_text())
+        if contents.get("version") != FILE_VERSION:
+            raise ValueError(
+                f"{path} is placement cache version {contents.get('version')}, "
+                f"expected {FILE_VERSION}"
+            )
+        lines = contents["lines"]
+        with self.lock:
+            # room for the whole file, or the first lines in it would
+            # be pushed out by the last
+            self.max_entries = max(self.max_entries, len(lines))
+        for length, hints, found in lines:
+            self._put((length, tuple(hints)), LinePlacements.of(length, found))
+
+
+def all_hints(length: int) -> Iterator[tuple[int, ...]]:
+    """Every hint sequence that fits on a line of this length."""
+    yield ()
+
+    def extend(prefix: tuple[int, ...], room: int) -> Iterator[tuple[int, ...]]:
+        for hint in range(1, room + 1):
+            hints = prefix + (hint,)
+            yield hints
+            # and a gap before the next one
+            yield from extend(hints, room - hint - 1)
+
+    yield from extend((), length)
+
+
+# one per process; pool workers each have their own
+_CACHE = PlacementCache()
+
+
+def get(length: int, hints: Sequence[int]) -> LinePlacements:
+    return _CACHE.get(length, hints)
+
+
+def info() -> CacheInfo:
+    return _CACHE.info()
+
+
+def prewarm(max_length: int):
+    _CACHE.prewarm(max_length)
+
+
+def load(path: pathlib.Path):
+    _CACHE.load(path)
+
+
+def write_prewarmed(path: pathlib.Path, max_length: int):
+    """Save every line up to max_length long to path, for load to read back."""
+    cache = PlacementCache(max_entries=sys.maxsize)
+    cache.prewarm(max_length)
+    cache.save(path)
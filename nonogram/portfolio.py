@@ -0,0 +1,189 @@
+import dataclasses
+import datetime
+import queue
+import time
+from typing import Optional
+
+import rich.table
+import rich.text
+
+from nonogram import data
+from nonogram import game
+from nonogram import solver
+from nonogram import workers
+
+# how often the race checks on workers that died without reporting
+POLL_SECONDS = 0.1
+
+
+@dataclasses.dataclass(frozen=True)
+class SearchConfig:
+    encoding: solver.Encoding
+    presolve: bool
+    search: solver.Search
+    # CP-SAT threads per racer; one each by default, since the racers
+    # are already spread over the cores
+    num_workers: Optional[int] = 1
+
+    def name(self) -> str:
+        presolve = "presolve" if self.presolve else "no-presolve"
+        return f"{self.encoding.name.lower()}/{presolve}/{self.search.name.lower()}"
+
+
+def default_portfolio(num_workers: Optional[int] = 1) -> list[SearchConfig]:
+    # each knob is varied at least once; which one wins depends a lot
+    # on the puzzle
+    return [
+        SearchConfig(
+            solver.Encoding.STARTS, True, solver.Search.AUTOMATIC, num_workers
+        ),
+        SearchConfig(solver.Encoding.CELLS, True, solver.Search.AUTOMATIC, num_workers),
+        SearchConfig(solver.Encoding.CELLS, True, solver.Search.FIXED, num_workers),
+        SearchConfig(
+            solver.Encoding.STARTS, False, solver.Search.QUICK_RESTART, num_workers
+        ),
+    ]
+
+
+@dataclasses.dataclass
+class Entry:
+    config: SearchConfig
+    # from the start of the race to this config reporting back, None if
+    # it was cancelled
+    time_taken: Optional[datetime.timedelta] = None
+    # False if the search hit the time limit
+    finished: bool = False
+    error: Optional[str] = None
+
+
+@dataclasses.dataclass
+class RaceResult:
+    # None if every racer hit the time limit, in which case
+    # grids are from whichever racer found the most
+    winner: Optional[SearchConfig]
+    grids: list[data.Grid]
+    stats: Optional[data.SolveStats]
+    entries: list[Entry]
+    time_taken: datetime.timedelta
+
+
+def _run(
+    idx: int,
+    config: SearchConfig,
+    puzzle: game.Puzzle,
+    solution_limit: int,
+    time_limit: Optional[float],
+    results,
+):
+    try:
+        instance = solver.build(
+            puzzle,
+            presolve=config.presolve,
+            encoding=config.encoding,
+            search=config.search,
+            num_workers=config.num_workers,
+            engine=solver.Engine.CP_SAT,
+        )
+        stream = instance.iter_solutions(solution_limit, time_limit)
+        grids = list(stream)
+        # stopping at solution_limit is as good as running out of
+        # solutions; only the time limit means the racer didn't get there
+        results.put((idx, grids, not stream.timed_out, instance.stats, None))
+    except Exception as e:
+        results.put((idx, [], False, None, repr(e)))
+
+
+def race(
+    puzzle: game.Puzzle,
+    configs: list[SearchConfig],
+    solution_limit: int,
+    time_limit: Optional[float] = None,
+    cancel_losers: bool = True,
+) -> RaceResult:
+    """Solve puzzle with every config at once, one process each.
+
+    The first config whose search ends inside the time limit, whether
+    it ran out of solutions or reached solution_limit, wins. The rest
+    are killed then, unless cancel_losers is off, in which case they
+    all run to the end so that each config gets a time.
+    """
+    ctx = workers._context()
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(
+            target=_run,
+            args=(idx, config, puzzle, solution_limit, time_limit, results),
+            daemon=True,
+        )
+        for idx, config in enumerate(configs)
+    ]
+    entries = [Entry(config) for config in configs]
+    reported: set[int] = set()
+    winner: Optional[int] = None
+    # the racer with the most grids, in case nobody finishes
+    fallback: Optional[tuple[int, list[data.Grid], data.SolveStats]] = None
+    time_start = time.perf_counter()
+    for process in processes:
+        process.start()
+    try:
+        while len(reported) < len(processes):
+            try:
+                idx, grids, finished, stats, error = results.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                for idx, process in enumerate(processes):
+                    if idx not in reported and process.exitcode not in (None, 0):
+                        reported.add(idx)
+                        entries[idx].error = f"exited with {process.exitcode}"
+                continue
+            reported.add(idx)
+            entries[idx].time_taken = datetime.timedelta(
+                seconds=time.perf_counter() - time_start
+            )
+            entries[idx].finished = finished
+            entries[idx].error = error
+            if error is not None:
+                continue
+            if finished and winner is None:
+                winner = idx
+                fallback = (idx, grids, stats)
+                if cancel_losers:
+                    break
+            elif winner is None and (fallback is None or len(grids) > len(fallback[1])):
+                fallback = (idx, grids, stats)
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
+    time_end = time.perf_counter()
+
+    if fallback is None:
+        errors = "; ".join(f"{entry.config.name()}: {entry.error}" for entry in entries)
+        raise RuntimeError(f"every search failed: {errors}")
+    _, grids, stats = fallback
+    return RaceResult(
+        winner=configs[winner] if winner is not None else None,
+        grids=grids,
+        stats=stats,
+        entries=entries,
+        time_taken=datetime.timedelta(seconds=time_end - time_start),
+    )
+
+
+def make_table(result: RaceResult) -> rich.table.Table:
+    table = rich.table.Table(title="Portfolio")
+    table.add_column("Configuration")
+    table.add_column("Time Taken", justify="right")
+    for entry in result.entries:
+        if entry.error is not None:
+            time_text = rich.text.Text(entry.error, "red")
+        elif entry.time_taken is None:
+            time_text = rich.text.Text("cancelled", "dim")
+        elif not entry.finished:
+            time_text = rich.text.Text(f"{entry.time_taken} (timed out)", "yellow")
+        else:
+            time_text = rich.text.Text(str(entry.time_taken))
+        style = "bold green" if entry.config == result.winner else ""
+        table.add_row(rich.text.Text(entry.config.name(), style), time_text)
+    return table
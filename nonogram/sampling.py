@@ -1,10 +1,18 @@
 import dataclasses
 import abc
+import datetime
+import enum
+import heapq
 import random
 import collections
+from typing import Optional
 
 from nonogram import data
 
+# floor on the per-trial cost, so a point whose trials have all been
+# near-instant doesn't get infinite priority
+MIN_COST_SECONDS = 1e-3
+
 
 class Sampler(abc.ABC):
     @abc.abstractmethod
@@ -15,32 +23,162 @@ class Sampler(abc.ABC):
         self, existing_data: dict[data.InstanceConfig, data.SolutionStatistics]
     ): ...
 
+    @abc.abstractmethod
+    def retire(self, pt: data.InstanceConfig):
+        """Stop sampling pt. Don't call sample() once every point is retired."""
+
 
 @dataclasses.dataclass
 class UniformSampler(Sampler):
     config: data.SamplerConfig
+    retired: set[data.InstanceConfig] = dataclasses.field(default_factory=set)
+    rng: random.Random = dataclasses.field(default_factory=random.Random)
 
     def sample(self) -> data.InstanceConfig:
-        return random.choice(self.config.all_pts())
+        return self.rng.choice(
+            [pt for pt in self.config.all_pts() if pt not in self.retired]
+        )
 
     def update(self, existing_data: dict[data.InstanceConfig, data.SolutionStatistics]):
         pass
 
+    def retire(self, pt: data.InstanceConfig):
+        self.retired.add(pt)
+
 
 @dataclasses.dataclass
 class FillGapsSampler(Sampler):
     config: data.SamplerConfig
     existing: dict[data.InstanceConfig, data.SolutionStatistics]
+    retired: set[data.InstanceConfig] = dataclasses.field(default_factory=set)
+    rng: random.Random = dataclasses.field(default_factory=random.Random)
 
     def sample(self) -> data.InstanceConfig:
-        pts = self.config.all_pts()
+        pts = [pt for pt in self.config.all_pts() if pt not in self.retired]
         totals = collections.defaultdict(lambda: 0)
-        for pt in self.config.all_pts():
+        for pt in pts:
             if pt in self.existing:
                 totals[pt] = self.existing[pt].total
-        random.shuffle(pts)
+        self.rng.shuffle(pts)
         pts.sort(key=lambda pt: totals[pt])
-        return random.choices(pts, weights=range(len(pts)), k=1)[0]
+        return self.rng.choices(pts, weights=range(len(pts), 0, -1), k=1)[0]
+
+    def update(self, existing_data: dict[data.InstanceConfig, data.SolutionStatistics]):
+        self.existing = existing_data
+
+    def retire(self, pt: data.InstanceConfig):
+        self.retired.add(pt)
+
+
+class AdaptiveSampler(Sampler):
+    """Sends trials where the estimate of p_unique is least certain per CPU second.
+
+    Each point's priority is how much one more trial would narrow the
+    Wilson interval on its p_unique, divided by its average runtime,
+    and points with no data come first. Trials that have been handed
+    out but haven't come back yet count towards a point's total, so a
+    batch of samples spreads out instead of piling onto whichever point
+    was on top.
+    """
+
+    def __init__(
+        self,
+        config: data.SamplerConfig,
+        existing: dict[data.InstanceConfig, data.SolutionStatistics],
+        rng: Optional[random.Random] = None,
+    ):
+        self.config = config
+        self.rng = rng if rng is not None else random.Random()
+        self.pts = config.all_pts()
+        self.stats: dict[data.InstanceConfig, data.SolutionStatistics] = {}
+        self.pending: dict[data.InstanceConfig, int] = {pt: 0 for pt in self.pts}
+        # a max-heap by priority, with stale entries left in place and
+        # skipped when they surface; current holds each point's live
+        # entry
+        self.heap: list[tuple[float, float, data.InstanceConfig]] = []
+        self.current: dict[data.InstanceConfig, tuple[float, float]] = {}
+        for pt in self.pts:
+            self.stats[pt] = existing.get(
+                pt, data.SolutionStatistics(0, 0, datetime.timedelta())
+            )
+            self._push(pt)
+
+    def priority(self, pt: data.InstanceConfig) -> float:
+        stats = self.stats[pt]
+        # nothing known yet, so assume the widest interval and the
+        # cheapest trials, which puts these points first
+        rate = stats.ratio() if stats.total else 0.5
+        if stats.attempts():
+            # timeouts count towards the cost without narrowing anything
+            cost = stats.average_runtime().total_seconds()
+        else:
+            cost = MIN_COST_SECONDS
+        # pending trials are assumed to come back at the rate seen so
+        # far, which narrows the interval without moving it
+        total = stats.total + self.pending[pt]
+        lo, hi = data.wilson_interval(rate * total, total)
+        next_lo, next_hi = data.wilson_interval(rate * (total + 1), total + 1)
+        # how much one more trial narrows the interval, per second it
+        # costs. the raw width per second would pour everything into
+        # the cheapest points, since a small puzzle's interval can get
+        # very narrow long before a big one's is worth looking at.
+        return ((hi - lo) - (next_hi - next_lo)) / max(cost, MIN_COST_SECONDS)
+
+    def _push(self, pt: data.InstanceConfig):
+        # the random tiebreak keeps points with no data from being
+        # visited in grid order
+        key = (-self.priority(pt), self.rng.random())
+        self.current[pt] = key
+        heapq.heappush(self.heap, (*key, pt))
+
+    def sample(self) -> data.InstanceConfig:
+        while True:
+            neg_priority, tiebreak, pt = heapq.heappop(self.heap)
+            if self.current.get(pt) == (neg_priority, tiebreak):
+                break
+        self.pending[pt] += 1
+        self._push(pt)
+        return pt
 
     def update(self, existing_data: dict[data.InstanceConfig, data.SolutionStatistics]):
-        self.existing_data = existing_data
+        for pt in self.pts:
+            stats = existing_data.get(pt)
+            if stats is None or stats.attempts() == self.stats[pt].attempts():
+                continue
+            if pt not in self.current:
+                # retired, so its priority doesn't matter any more
+                continue
+            arrived = stats.attempts() - self.stats[pt].attempts()
+            self.pending[pt] = max(0, self.pending[pt] - arrived)
+            self.stats[pt] = stats
+            self._push(pt)
+        # stale entries pile up as points get pushed again, so start
+        # over once they're most of the heap
+        if len(self.heap) > 4 * len(self.pts):
+            self.heap = [(*key, pt) for pt, key in self.current.items()]
+            heapq.heapify(self.heap)
+
+    def retire(self, pt: data.InstanceConfig):
+        # its heap entries go stale and get skipped
+        self.current.pop(pt, None)
+
+
+@enum.unique
+class Strategy(enum.Enum):
+    UNIFORM = enum.auto()
+    FILL_GAPS = enum.auto()
+    ADAPTIVE = enum.auto()
+
+
+def make_sampler(
+    strategy: Strategy,
+    config: data.SamplerConfig,
+    existing: dict[data.InstanceConfig, data.SolutionStatistics],
+    seed: Optional[int] = None,
+) -> Sampler:
+    rng = random.Random(seed)
+    if strategy == Strategy.UNIFORM:
+        return UniformSampler(config, rng=rng)
+    elif strategy == Strategy.FILL_GAPS:
+        return FillGapsSampler(config, existing, rng=rng)
+    return AdaptiveSampler(config, existing, rng=rng)
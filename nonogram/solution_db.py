@@ -1,25 +1,170 @@
+import dataclasses
 import sqlite3
-from typing import Iterable
+import threading
+from typing import Iterable, Optional, Sequence
 import datetime
 import sys
 import pathlib
 
 from nonogram import data
 
+# the writer flushes every FLUSH_SECONDS, or sooner once FLUSH_ROWS
+# solutions are waiting
+FLUSH_ROWS = 1000
+FLUSH_SECONDS = 2.0
+# never modified, like every SolutionStatistics in here
+_NO_SOLUTIONS = data.SolutionStatistics(0, 0, datetime.timedelta())
+
+
+def _add(
+    a: data.SolutionStatistics, b: data.SolutionStatistics
+) -> data.SolutionStatistics:
+    return data.SolutionStatistics(
+        unique=a.unique + b.unique,
+        total=a.total + b.total,
+        runtime=a.runtime + b.runtime,
+        timeouts=a.timeouts + b.timeouts,
+    )
+
+
+def _read_stats(
+    con: sqlite3.Connection,
+) -> dict[data.InstanceConfig, data.SolutionStatistics]:
+    res = con.execute(
+        "SELECT size, probability, uniq, total, seconds, timeouts FROM solves"
+    )
+    result = {}
+    for size, probability, unique, total, seconds, timeouts in res.fetchall():
+        conf = data.InstanceConfig(size=size, prob=probability)
+        result[conf] = data.SolutionStatistics(
+            unique=unique,
+            total=total,
+            runtime=datetime.timedelta(seconds=seconds),
+            timeouts=timeouts,
+        )
+    return result
+
+
+def _ensure_column(con: sqlite3.Connection, table: str, column: str, decl: str):
+    # tables from before the column existed get it, with the old rows
+    # taking its default
+    columns = {row[1] for row in con.execute(f"PRAGMA table_info({table})")}
+    if not columns or column in columns:
+        # no such table, or nothing to do
+        return
+    try:
+        con.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+    except sqlite3.OperationalError as e:
+        # someone else opening the same file got there first
+        if "duplicate column" not in str(e):
+            raise
+
+
+@dataclasses.dataclass(frozen=True)
+class Trial:
+    trial_id: int
+    seed: int
+    config: data.InstanceConfig
+    is_unique: bool
+    solve_time: datetime.timedelta
+    build_time: datetime.timedelta
+    hints: Optional[bytes]
+    timed_out: bool = False
+
 
 class SolutionDb:
-    def __init__(self, db_path: pathlib.Path):
-        self.con = sqlite3.connect(db_path)
+    """Per-configuration solve counts, written behind the caller's back.
+
+    add_solutions only touches memory: a writer thread folds the new
+    solutions into the database every FLUSH_SECONDS or FLUSH_ROWS
+    solutions, as increments, so several sweeps can share one file.
+    get_stats answers from a mirror of the table that's kept up to date
+    with this process's solutions as they're added and re-read from
+    the database, picking up everyone else's, after each flush.
+
+    With record_trials, every solution also gets a row of its own in
+    the append-only trials table, written in the same flushes.
+    """
+
+    def __init__(
+        self,
+        db_path: pathlib.Path,
+        flush_rows: int = FLUSH_ROWS,
+        flush_seconds: float = FLUSH_SECONDS,
+        record_trials: bool = False,
+    ):
+        self.db_path = db_path
+        self.record_trials = record_trials
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.con = self._connect()
+        self.con.execute("PRAGMA journal_mode=WAL")
         self.con.execute(
             " ".join(
                 [
                     "CREATE TABLE IF NOT EXISTS solves(",
                     "probability REAL,size INT,total INT,uniq INT,seconds REAL,",
+                    "timeouts INT DEFAULT 0,",
                     "PRIMARY KEY (probability, size))",
                     "STRICT",
                 ]
             )
         )
+        _ensure_column(self.con, "solves", "timeouts", "INT DEFAULT 0")
+        if record_trials:
+            self.con.execute(
+                " ".join(
+                    [
+                        "CREATE TABLE IF NOT EXISTS trials(",
+                        "id INTEGER PRIMARY KEY,seed INT,size INT,probability REAL,",
+                        "uniq INT,solve_seconds REAL,build_seconds REAL,hints BLOB,",
+                        "timed_out INT DEFAULT 0)",
+                        "STRICT",
+                    ]
+                )
+            )
+            self.con.execute(
+                "CREATE INDEX IF NOT EXISTS trials_config ON trials(size, probability)"
+            )
+            self.con.execute(
+                " ".join(
+                    [
+                        "CREATE INDEX IF NOT EXISTS trials_solve_seconds",
+                        "ON trials(solve_seconds)",
+                    ]
+                )
+            )
+        # replay_trial reads trials without recording any
+        _ensure_column(self.con, "trials", "timed_out", "INT DEFAULT 0")
+        # exact counts of unique grids by filled cells, from
+        # exact_uniqueness
+        self.con.execute(
+            " ".join(
+                [
+                    "CREATE TABLE IF NOT EXISTS exact(",
+                    "size INT,filled INT,uniq INT,",
+                    "PRIMARY KEY (size, filled))",
+                    "STRICT",
+                ]
+            )
+        )
+
+        self.lock = threading.Lock()
+        self.stats = _read_stats(self.con)
+        # added but not yet written, and how many solutions that is
+        self.unflushed: dict[data.InstanceConfig, data.SolutionStatistics] = {}
+        self.unflushed_count = 0
+        self.unflushed_trials: list[data.Solution] = []
+        self.wake = threading.Event()
+        self.closing = False
+        self.error: Optional[BaseException] = None
+        self.writer = threading.Thread(target=self._write_behind, daemon=True)
+        self.writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        # autocommit, so flushes can take the write lock up front with
+        # BEGIN IMMEDIATE instead of upgrading to it halfway through
+        return sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
 
     def infer_config(self) -> tuple[data.SamplerConfig, int, int]:
         cur = self.con.cursor()
@@ -48,56 +193,200 @@ class SolutionDb:
         return best, best_score[0], best_score[1]
 
     def close(self):
-        self.con.commit()
+        self.closing = True
+        self.wake.set()
+        self.writer.join()
         self.con.close()
+        self._check()
+
+    def _check(self):
+        if self.error is not None:
+            raise RuntimeError("solution database writer failed") from self.error
+
+    def _write_behind(self):
+        con = self._connect()
+        try:
+            while True:
+                self.wake.wait(timeout=self.flush_seconds)
+                self.wake.clear()
+                closing = self.closing
+                self._flush(con)
+                if closing:
+                    break
+        except BaseException as e:
+            self.error = e
+        finally:
+            con.close()
+
+    def _flush(self, con: sqlite3.Connection):
+        with self.lock:
+            deltas = self.unflushed
+            self.unflushed = {}
+            self.unflushed_count = 0
+            trials = self.unflushed_trials
+            self.unflushed_trials = []
+
+        if deltas:
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                con.executemany(
+                    " ".join(
+                        [
+                            "INSERT INTO solves",
+                            "(probability, size, total, uniq, seconds, timeouts)",
+                            "VALUES(:prob, :size, :total, :uniq, :time, :timeouts)",
+                            "ON CONFLICT DO",
+                            "UPDATE SET",
+                            "total = total + :total,uniq = uniq + :uniq,",
+                            "seconds = seconds + :time,",
+                            "timeouts = timeouts + :timeouts",
+                        ]
+                    ),
+                    (
+                        {
+                            "prob": config.prob,
+                            "size": config.size,
+                            "total": delta.total,
+                            "uniq": delta.unique,
+                            "time": delta.runtime.total_seconds(),
+                            "timeouts": delta.timeouts,
+                        }
+                        for config, delta in deltas.items()
+                    ),
+                )
+                if trials:
+                    con.executemany(
+                        " ".join(
+                            [
+                                "INSERT INTO trials(seed, size, probability, uniq,",
+                                "solve_seconds, build_seconds, hints, timed_out)",
+                                "VALUES(:seed, :size, :prob, :uniq, :time, :build,",
+                                ":hints, :timed_out)",
+                            ]
+                        ),
+                        (
+                            {
+                                "seed": s.seed,
+                                "size": s.config.size,
+                                "prob": s.config.prob,
+                                "uniq": 1 if s.is_unique else 0,
+                                "time": s.solve_time.total_seconds(),
+                                "build": s.build_time.total_seconds(),
+                                "hints": s.hints,
+                                "timed_out": 1 if s.timed_out else 0,
+                            }
+                            for s in trials
+                        ),
+                    )
+                con.execute("COMMIT")
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+
+        # what's in the file now, which includes other processes'
+        # solutions, plus whatever arrived here since the swap above
+        stats = _read_stats(con)
+        with self.lock:
+            for config, delta in self.unflushed.items():
+                stats[config] = _add(stats.get(config, _NO_SOLUTIONS), delta)
+            self.stats = stats
 
     def get_solution_count(self) -> int:
-        cur = self.con.cursor()
-        res = cur.execute("select sum(total) from solves")
-        return res.fetchone()[0] or 0
+        with self.lock:
+            return sum(s.total for s in self.stats.values())
 
     def get_total_runtime(self) -> datetime.timedelta:
-        cur = self.con.cursor()
-        res = cur.execute("select sum(seconds) from solves")
-        s = res.fetchone()[0] or 0
-        return datetime.timedelta(seconds=s)
+        with self.lock:
+            return sum(
+                (s.runtime for s in self.stats.values()), start=datetime.timedelta()
+            )
 
     def add_solutions(
         self,
         solutions: Iterable[data.Solution],
     ):
-        self.con.executemany(
+        self._check()
+        with self.lock:
+            for s in solutions:
+                if s.timed_out:
+                    delta = data.SolutionStatistics(
+                        unique=0, total=0, runtime=s.solve_time, timeouts=1
+                    )
+                else:
+                    delta = data.SolutionStatistics(
+                        unique=1 if s.is_unique else 0, total=1, runtime=s.solve_time
+                    )
+                for table in (self.stats, self.unflushed):
+                    table[s.config] = _add(table.get(s.config, _NO_SOLUTIONS), delta)
+                self.unflushed_count += 1
+                if self.record_trials:
+                    self.unflushed_trials.append(s)
+            if self.unflushed_count >= self.flush_rows:
+                self.wake.set()
+
+    def get_stats(self) -> dict[data.InstanceConfig, data.SolutionStatistics]:
+        # a shallow copy is enough to keep the caller's view still
+        with self.lock:
+            return dict(self.stats)
+
+    def get_trial(self, trial_id: int) -> Optional[Trial]:
+        res = self.con.execute(
             " ".join(
                 [
-                    "INSERT INTO solves",
-                    "VALUES(:prob, :size, 1, :uniq, :time)",
-                    "ON CONFLICT DO",
-                    "UPDATE SET",
-                    "total = total + 1,uniq = uniq + :uniq,",
-                    "seconds = seconds + :time",
+                    "SELECT id, seed, size, probability, uniq, solve_seconds,",
+                    "build_seconds, hints, timed_out FROM trials WHERE id = ?",
                 ]
             ),
-            (
-                {
-                    "prob": s.config.prob,
-                    "size": s.config.size,
-                    "uniq": 1 if s.is_unique else 0,
-                    "time": s.solve_time.total_seconds(),
-                }
-                for s in solutions
-            ),
+            (trial_id,),
+        ).fetchone()
+        if res is None:
+            return None
+        (
+            _,
+            seed,
+            size,
+            probability,
+            uniq,
+            solve_seconds,
+            build_seconds,
+            hints,
+            timed_out,
+        ) = res
+        return Trial(
+            trial_id=trial_id,
+            seed=seed,
+            config=data.InstanceConfig(size=size, prob=probability),
+            is_unique=bool(uniq),
+            solve_time=datetime.timedelta(seconds=solve_seconds),
+            build_time=datetime.timedelta(seconds=build_seconds),
+            hints=hints,
+            timed_out=bool(timed_out),
         )
-        self.con.commit()
 
-    def get_stats(self) -> dict[data.InstanceConfig, data.SolutionStatistics]:
-        result: dict[data.InstanceConfig, data.SolutionStatistics] = {}
-        cur = self.con.cursor()
-        res = cur.execute("SELECT size, probability, uniq, total, seconds FROM solves")
-        result = {}
-        for size, probability, unique, total, seconds in res.fetchall():
-            conf = data.InstanceConfig(size=size, prob=probability)
-            d = data.SolutionStatistics(
-                unique=unique, total=total, runtime=datetime.timedelta(seconds=seconds)
+    def slowest_trials(self, n: int) -> list[int]:
+        res = self.con.execute(
+            "SELECT id FROM trials ORDER BY solve_seconds DESC LIMIT ?", (n,)
+        )
+        return [trial_id for (trial_id,) in res.fetchall()]
+
+    def put_exact(self, size: int, unique_counts: Sequence[int]):
+        """Replace size's exact counts; unique_counts[k] is for k filled cells."""
+        self.con.execute("BEGIN IMMEDIATE")
+        try:
+            self.con.execute("DELETE FROM exact WHERE size = ?", (size,))
+            self.con.executemany(
+                "INSERT INTO exact(size, filled, uniq) VALUES(?, ?, ?)",
+                ((size, filled, count) for filled, count in enumerate(unique_counts)),
             )
-            result[conf] = d
-        return result
+            self.con.execute("COMMIT")
+        except BaseException:
+            self.con.execute("ROLLBACK")
+            raise
+
+    def get_exact(self, size: int) -> Optional[list[int]]:
+        res = self.con.execute(
+            "SELECT filled, uniq FROM exact WHERE size = ? ORDER BY filled", (size,)
+        ).fetchall()
+        if len(res) != size * size + 1:
+            return None
+        return [count for _, count in res]
@@ -0,0 +1,202 @@
+import dataclasses
+import datetime
+import functools
+import hashlib
+import itertools
+import json
+import os
+import pathlib
+import sqlite3
+import time
+from typing import Optional
+
+import numpy as np
+
+from nonogram import data
+from nonogram import game
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# rough per-row cost on top of the grid blob, for the eviction budget
+ROW_OVERHEAD = 128
+
+
+@dataclasses.dataclass(frozen=True)
+class Transform:
+    # applied in this order: reverse the order of the rows, reverse the
+    # order of the columns, then transpose
+    flip_rows: bool
+    flip_cols: bool
+    transpose: bool
+
+    def hints(self, hints: dict[game.Dim, list[list[int]]]):
+        rows = hints[game.Dim.ROW]
+        cols = hints[game.Dim.COL]
+        if self.flip_rows:
+            rows = rows[::-1]
+            cols = [line[::-1] for line in cols]
+        if self.flip_cols:
+            rows = [line[::-1] for line in rows]
+            cols = cols[::-1]
+        if self.transpose:
+            rows, cols = cols, rows
+        return {game.Dim.ROW: rows, game.Dim.COL: cols}
+
+    def grids(self, grids: np.ndarray) -> np.ndarray:
+        if self.flip_rows:
+            grids = grids[:, ::-1, :]
+        if self.flip_cols:
+            grids = grids[:, :, ::-1]
+        if self.transpose:
+            grids = grids.transpose(0, 2, 1)
+        return grids
+
+    def inverse_grids(self, grids: np.ndarray) -> np.ndarray:
+        # the flips are their own inverses and commute with each other
+        if self.transpose:
+            grids = grids.transpose(0, 2, 1)
+        return Transform(self.flip_rows, self.flip_cols, False).grids(grids)
+
+
+ALL_TRANSFORMS = [Transform(*t) for t in itertools.product([False, True], repeat=3)]
+
+
+def canonicalize(puzzle: game.Puzzle) -> tuple[str, Transform]:
+    """A serialization of the hints shared by all rotations and mirror images.
+
+    Also returns the transform that takes this puzzle to the canonical
+    orientation.
+    """
+    forms = []
+    for transform in ALL_TRANSFORMS:
+        hints = transform.hints(puzzle.hints)
+        forms.append(
+            (json.dumps([hints[game.Dim.ROW], hints[game.Dim.COL]]), transform)
+        )
+    return min(forms, key=lambda form: form[0])
+
+
+@dataclasses.dataclass(frozen=True)
+class CachedResult:
+    grids: list[data.Grid]
+    solve_time: datetime.timedelta
+
+
+def default_path() -> pathlib.Path:
+    # under the user's cache directory, rather than wherever the command
+    # happens to be run from
+    base = os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache"
+    return pathlib.Path(base) / "nonogram" / "solve_cache.sqlite3"
+
+
+class SolveCache:
+    def __init__(self, db_path: pathlib.Path, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        # several pool workers may share the file
+        self.con = sqlite3.connect(db_path, timeout=60)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute(
+            " ".join(
+                [
+                    "CREATE TABLE IF NOT EXISTS results(",
+                    "key TEXT PRIMARY KEY,num_solutions INT,rows INT,cols INT,",
+                    "grids BLOB,seconds REAL,last_used REAL)",
+                    "STRICT",
+                ]
+            )
+        )
+        self.con.execute(
+            "CREATE INDEX IF NOT EXISTS results_last_used ON results(last_used)"
+        )
+
+    def close(self):
+        self.con.commit()
+        self.con.close()
+
+    @staticmethod
+    def _key(canonical: str, settings: str) -> str:
+        return hashlib.sha256(f"{settings}\n{canonical}".encode()).hexdigest()
+
+    def get(self, puzzle: game.Puzzle, settings: str) -> Optional[CachedResult]:
+        canonical, transform = canonicalize(puzzle)
+        key = self._key(canonical, settings)
+        res = self.con.execute(
+            " ".join(
+                [
+                    "SELECT num_solutions, rows, cols, grids, seconds",
+                    "FROM results WHERE key = ?",
+                ]
+            ),
+            (key,),
+        ).fetchone()
+        if res is None:
+            return None
+        num_solutions, rows, cols, blob, seconds = res
+        self.con.execute(
+            "UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key)
+        )
+        self.con.commit()
+
+        bits = np.unpackbits(
+            np.frombuffer(blob, dtype=np.uint8), count=num_solutions * rows * cols
+        )
+        grids = transform.inverse_grids(
+            bits.astype(bool).reshape(num_solutions, rows, cols)
+        )
+        return CachedResult(
+            grids=[data.Grid.from_numpy(grid) for grid in grids],
+            solve_time=datetime.timedelta(seconds=seconds),
+        )
+
+    def fits(self, puzzle: game.Puzzle, num_grids: int) -> bool:
+        """Whether num_grids grids could be stored without being evicted at once."""
+        grid_bytes = -(-num_grids * puzzle.n_rows * puzzle.n_cols // 8)
+        return grid_bytes + ROW_OVERHEAD <= self.max_bytes
+
+    def put(
+        self,
+        puzzle: game.Puzzle,
+        settings: str,
+        grids: list[data.Grid],
+        solve_time: datetime.timedelta,
+    ):
+        canonical, transform = canonicalize(puzzle)
+        key = self._key(canonical, settings)
+        stacked = np.zeros((len(grids), puzzle.n_rows, puzzle.n_cols), dtype=bool)
+        for grid_idx, grid in enumerate(grids):
+            stacked[grid_idx] = grid.to_numpy()
+        packed = transform.grids(stacked)
+        _, rows, cols = packed.shape
+        self.con.execute(
+            "INSERT OR REPLACE INTO results VALUES(?, ?, ?, ?, ?, ?, ?)",
+            (
+                key,
+                len(grids),
+                rows,
+                cols,
+                np.packbits(packed).tobytes(),
+                solve_time.total_seconds(),
+                time.time(),
+            ),
+        )
+        # least recently used entries go once the running total of the
+        # newer ones is over budget
+        self.con.execute(
+            " ".join(
+                [
+                    "DELETE FROM results WHERE key IN (",
+                    "SELECT key FROM (",
+                    "SELECT key, SUM(LENGTH(grids) + :overhead)",
+                    "OVER (ORDER BY last_used DESC) AS running FROM results)",
+                    "WHERE running > :max_bytes)",
+                ]
+            ),
+            {"overhead": ROW_OVERHEAD, "max_bytes": self.max_bytes},
+        )
+        self.con.commit()
+
+
+@functools.cache
+def open_cache(db_path: pathlib.Path, max_bytes: int = DEFAULT_MAX_BYTES) -> SolveCache:
+    # one connection per process, so pool workers can share a cache
+    return SolveCache(db_path, max_bytes)
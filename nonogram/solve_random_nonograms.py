@@ -1,8 +1,9 @@
+import collections
+import functools
 import more_itertools
 import pathlib
-from typing import Iterator
+from typing import Iterator, Optional
 import os
-import multiprocessing
 from rich import print
 import rich.progress
 import rich.table
@@ -14,27 +15,38 @@ import rich.console
 import click
 import datetime
 import contextlib
+import time
+import cProfile
+import pstats
+import sqlite3
 
 from rich_heatmap import heatmap
 
+from nonogram import game
 from nonogram import generate
+from nonogram import placement_cache
 from nonogram import sampling
 from nonogram import solver
 from nonogram import solution_db
 from nonogram import data
+from nonogram import exact
 from nonogram import cli_utils
+from nonogram import workers
 
 
 def lower_priority():
     os.nice(10)
 
 
-def render_progress(existing_data):
+def render_progress(existing_data, converged: Optional[tuple[int, int]] = None):
     if not existing_data:
         return rich.text.Text("No data")
 
     cells = []
     for instance, solutions in existing_data.items():
+        if not solutions.total:
+            # nothing but timeouts so far
+            continue
         cells.append(
             heatmap.HeatmapCell(
                 instance.size,
@@ -48,6 +60,7 @@ def render_progress(existing_data):
     )
 
     total_runs = sum(d.total for d in existing_data.values())
+    total_timeouts = sum(d.timeouts for d in existing_data.values())
     total_runtime = sum(
         (d.runtime for d in existing_data.values()), start=datetime.timedelta()
     )
@@ -60,6 +73,17 @@ def render_progress(existing_data):
         (str(total_runtime), "yellow"),
         " CPU time",
     )
+    if total_timeouts:
+        progress.append_text(
+            rich.text.Text.assemble(", ", (str(total_timeouts), "red"), " timeouts")
+        )
+    if converged is not None:
+        n_converged, n_points = converged
+        progress.append_text(
+            rich.text.Text.assemble(
+                ", ", (f"{n_converged}/{n_points}", "cyan"), " converged"
+            )
+        )
     legend = rich.text.Text()
     legend.append("   p_unique   0.0 ")
     for i in range(100):
@@ -76,46 +100,168 @@ def render_progress(existing_data):
     )
 
 
-# has to be at module level so it can be called by multiprocessing
-def _solve_random_nonograms_internal(
-    instance_config: data.InstanceConfig,
+def _solve_trial(
+    puzzle: game.Puzzle,
+    seed: int,
+    generate_time: datetime.timedelta,
+    generate_cpu: float,
+    record_trials: bool,
+    time_limit: Optional[float],
+    engine: solver.Engine,
 ) -> data.Solution:
     start = datetime.datetime.now()
-    puzzle = generate.generate(instance_config)
-    instance = solver.build(puzzle)
-    solution_count = instance.model.solveAll(solution_limit=2)
-    unique = solution_count == 1
+    cpu_start = time.process_time()
+    # every trial of a size in this worker shares one model, rebound to
+    # each puzzle, whenever CP-SAT is the one searching
+    instance = solver.build(puzzle, encoding=solver.Encoding.TEMPLATE, engine=engine)
+    uniqueness = instance.check_uniqueness(time_limit).uniqueness
     end = datetime.datetime.now()
+    cpu_end = time.process_time()
+    if uniqueness == data.Uniqueness.TIMEOUT:
+        # whatever a search that ran that long left behind, the next
+        # trial gets a fresh process instead
+        workers.retire()
     return data.Solution(
-        config=instance_config, is_unique=unique, solve_time=end - start
+        config=puzzle.config,
+        is_unique=uniqueness == data.Uniqueness.UNIQUE,
+        solve_time=end - start + generate_time,
+        seed=seed,
+        build_time=instance.build_time,
+        hints=game.pack_hints(puzzle.hints) if record_trials else None,
+        timed_out=uniqueness == data.Uniqueness.TIMEOUT,
+        cpu_time=datetime.timedelta(seconds=cpu_end - cpu_start + generate_cpu),
     )
 
 
+# has to be at module level so it can be called by multiprocessing
+def _solve_random_nonograms_internal(
+    tasks: list[tuple[data.InstanceConfig, int]],
+    record_trials: bool = False,
+    time_limit: Optional[float] = None,
+    engine: solver.Engine = solver.Engine.AUTOMATIC,
+) -> list[data.Solution]:
+    # a whole chunk of trials at once, so that each configuration's
+    # puzzles are generated together, every one from its own trial's
+    # seed
+    by_config: dict[data.InstanceConfig, list[int]] = collections.defaultdict(list)
+    for idx, (instance_config, _) in enumerate(tasks):
+        by_config[instance_config].append(idx)
+    solutions: list[Optional[data.Solution]] = [None] * len(tasks)
+    for instance_config, idxs in by_config.items():
+        start = datetime.datetime.now()
+        cpu_start = time.process_time()
+        batch = generate.generate_seeded(
+            instance_config, [tasks[idx][1] for idx in idxs]
+        )
+        # each trial is charged an even share of the batch
+        generate_time = (datetime.datetime.now() - start) / len(idxs)
+        generate_cpu = (time.process_time() - cpu_start) / len(idxs)
+        for batch_idx, idx in enumerate(idxs):
+            solutions[idx] = _solve_trial(
+                batch.puzzle(batch_idx),
+                tasks[idx][1],
+                generate_time,
+                generate_cpu,
+                record_trials,
+                time_limit,
+                engine,
+            )
+    return [solution for solution in solutions if solution is not None]
+
+
 def _solve_random_nonograms(
     sampler: sampling.Sampler,
+    sampler_config: data.SamplerConfig,
+    stopping: data.StoppingConfig,
+    root_seed: int,
     threads: int,
     batch: int,
     db: solution_db.SolutionDb,
+    time_limit: Optional[float] = None,
+    engine: solver.Engine = solver.Engine.AUTOMATIC,
+    placements_path: Optional[pathlib.Path] = None,
 ):
     lower_priority()
+    print(f"Seed: {root_seed}")
+
+    pts = sampler_config.all_pts()
+    existing_data = db.get_stats()
+    retired: set[data.InstanceConfig] = set()
+    trials_started = 0
+    cpu_seconds = 0.0
+
+    def retire_converged():
+        for pt in pts:
+            if pt in retired or pt not in existing_data:
+                continue
+            if stopping.converged(existing_data[pt]):
+                retired.add(pt)
+                sampler.retire(pt)
+
+    def stop_reason() -> Optional[str]:
+        if len(retired) == len(pts):
+            return "every configuration has converged"
+        if stopping.max_trials is not None and trials_started >= stopping.max_trials:
+            return f"reached {stopping.max_trials} trials"
+        if stopping.max_cpu_seconds is not None and (
+            cpu_seconds >= stopping.max_cpu_seconds
+        ):
+            return f"spent {stopping.max_cpu_seconds} CPU seconds"
+        return None
 
-    existing_data: dict[data.InstanceConfig, data.SolutionStatistics] = {}
+    def tasks() -> Iterator[tuple[data.InstanceConfig, int]]:
+        # the pool only pulls a task once a worker is free for it, so
+        # this sees every result that came back before then. each
+        # trial's puzzle comes from a seed fixed by its place in the
+        # run, whichever worker ends up with it.
+        nonlocal trials_started
+        while stop_reason() is None:
+            seed = generate.trial_seed(root_seed, trials_started)
+            trials_started += 1
+            yield sampler.sample(), seed
 
+    def progress():
+        if stopping.target_ci_width is None:
+            return render_progress(existing_data)
+        return render_progress(existing_data, (len(retired), len(pts)))
+
+    retire_converged()
+    initializer = None
+    initargs: tuple = ()
+    if placements_path is not None:
+        if not placements_path.exists():
+            # longer lines are still cached as they come up
+            prewarm_length = min(
+                sampler_config.s_max, placement_cache.MAX_PREWARM_LENGTH
+            )
+            print(f"Writing line placements up to {prewarm_length} long")
+            placement_cache.write_prewarmed(placements_path, prewarm_length)
+        initializer = placement_cache.load
+        initargs = (placements_path,)
     with (
-        multiprocessing.Pool(threads) as pool,
-        rich.live.Live(render_progress(existing_data), auto_refresh=False) as live,
+        workers.WorkerPool(threads, initializer, initargs) as pool,
+        rich.live.Live(progress(), auto_refresh=False) as live,
     ):
-        config_itr: Iterator[data.InstanceConfig] = more_itertools.repeatfunc(
-            sampler.sample
-        )
         result_itr: Iterator[data.Solution] = pool.imap_unordered(
-            _solve_random_nonograms_internal, config_itr, chunksize=1
+            functools.partial(
+                _solve_random_nonograms_internal,
+                record_trials=db.record_trials,
+                time_limit=time_limit,
+                engine=engine,
+            ),
+            tasks(),
+            batched=True,
         )
-        batched_itr = more_itertools.ichunked(iterable=result_itr, n=batch)
-        for solution_batch in batched_itr:
+        for solution_batch in more_itertools.chunked(result_itr, batch):
             db.add_solutions(solutions=solution_batch)
+            cpu_seconds += sum(s.cpu_time.total_seconds() for s in solution_batch)
             existing_data = db.get_stats()
-            live.update(render_progress(existing_data), refresh=True)
+            sampler.update(existing_data)
+            retire_converged()
+            live.update(progress(), refresh=True)
+
+    # the loop above only ends once tasks() has
+    print(f"[green]Done: {stop_reason()}")
 
 
 @click.command
@@ -129,6 +275,52 @@ def _solve_random_nonograms(
 @click.option(
     "--db_path", type=click.Path(path_type=pathlib.Path), default="data.sqlite3"
 )
+@click.option(
+    "--sampler",
+    type=click.Choice(sampling.Strategy, case_sensitive=False),
+    default=sampling.Strategy.ADAPTIVE,
+)
+@click.option(
+    "--seed",
+    type=int,
+    help="Root of every trial's seed, to repeat an earlier run's puzzles",
+)
+@click.option(
+    "--record_trials",
+    is_flag=True,
+    help="Also keep every trial, with its seed, in the trials table",
+)
+@click.option(
+    "--target_ci_width",
+    type=float,
+    help="Stop sampling a configuration once the 95% interval on p_unique is "
+    "this narrow",
+)
+@click.option(
+    "--max_cpu_seconds", type=float, help="Stop after this much solving in this run"
+)
+@click.option("--max_trials", type=int, help="Stop after this many trials in this run")
+@click.option(
+    "--time_limit",
+    type=float,
+    help="Give up on a trial after this many seconds of searching and count it "
+    "as a timeout",
+)
+@click.option(
+    "--engine",
+    type=click.Choice(solver.Engine, case_sensitive=False),
+    default=solver.Engine.AUTOMATIC,
+    help="How to search; automatic backtracks on puzzles up to "
+    f"{solver.BACKTRACK_MAX_SIZE} wide and uses CP-SAT on the rest",
+)
+@click.option(
+    "--placement_cache",
+    "placements_path",
+    type=click.Path(dir_okay=False, path_type=pathlib.Path),
+    help="Start every worker with the line placements in this file, writing "
+    f"it first, up to {placement_cache.MAX_PREWARM_LENGTH} long, if it doesn't"
+    " exist",
+)
 def solve_random_nonograms(
     p_min: float,
     p_max: float,
@@ -138,14 +330,32 @@ def solve_random_nonograms(
     threads: int,
     batch: int,
     db_path: pathlib.Path,
+    sampler: sampling.Strategy,
+    target_ci_width: Optional[float],
+    max_cpu_seconds: Optional[float],
+    max_trials: Optional[int],
+    record_trials: bool,
+    seed: Optional[int],
+    time_limit: Optional[float],
+    engine: solver.Engine,
+    placements_path: Optional[pathlib.Path],
 ):
-    with contextlib.closing(solution_db.SolutionDb(db_path)) as db:
+    root = generate.root_seed(seed)
+    with contextlib.closing(
+        solution_db.SolutionDb(db_path, record_trials=record_trials)
+    ) as db:
         config = data.SamplerConfig(p_min, p_max, p_steps, s_min, s_max)
         _solve_random_nonograms(
-            sampling.UniformSampler(config),
+            sampling.make_sampler(sampler, config, db.get_stats(), root),
+            config,
+            data.StoppingConfig(target_ci_width, max_cpu_seconds, max_trials),
+            root,
             threads,
             batch,
             db,
+            time_limit,
+            engine,
+            placements_path,
         )
 
 
@@ -155,8 +365,70 @@ def solve_random_nonograms(
 @click.option(
     "--db_path", type=click.Path(path_type=pathlib.Path), default="data.sqlite3"
 )
-def continue_random_nonograms(threads: int, batch: int, db_path: pathlib.Path):
-    with contextlib.closing(solution_db.SolutionDb(db_path)) as db:
+@click.option(
+    "--sampler",
+    type=click.Choice(sampling.Strategy, case_sensitive=False),
+    default=sampling.Strategy.ADAPTIVE,
+)
+@click.option(
+    "--seed",
+    type=int,
+    help="Root of every trial's seed, to repeat an earlier run's puzzles",
+)
+@click.option(
+    "--record_trials",
+    is_flag=True,
+    help="Also keep every trial, with its seed, in the trials table",
+)
+@click.option(
+    "--target_ci_width",
+    type=float,
+    help="Stop sampling a configuration once the 95% interval on p_unique is "
+    "this narrow",
+)
+@click.option(
+    "--max_cpu_seconds", type=float, help="Stop after this much solving in this run"
+)
+@click.option("--max_trials", type=int, help="Stop after this many trials in this run")
+@click.option(
+    "--time_limit",
+    type=float,
+    help="Give up on a trial after this many seconds of searching and count it "
+    "as a timeout",
+)
+@click.option(
+    "--engine",
+    type=click.Choice(solver.Engine, case_sensitive=False),
+    default=solver.Engine.AUTOMATIC,
+    help="How to search; automatic backtracks on puzzles up to "
+    f"{solver.BACKTRACK_MAX_SIZE} wide and uses CP-SAT on the rest",
+)
+@click.option(
+    "--placement_cache",
+    "placements_path",
+    type=click.Path(dir_okay=False, path_type=pathlib.Path),
+    help="Start every worker with the line placements in this file, writing "
+    f"it first, up to {placement_cache.MAX_PREWARM_LENGTH} long, if it doesn't"
+    " exist",
+)
+def continue_random_nonograms(
+    threads: int,
+    batch: int,
+    db_path: pathlib.Path,
+    sampler: sampling.Strategy,
+    target_ci_width: Optional[float],
+    max_cpu_seconds: Optional[float],
+    max_trials: Optional[int],
+    record_trials: bool,
+    seed: Optional[int],
+    time_limit: Optional[float],
+    engine: solver.Engine,
+    placements_path: Optional[pathlib.Path],
+):
+    root = generate.root_seed(seed)
+    with contextlib.closing(
+        solution_db.SolutionDb(db_path, record_trials=record_trials)
+    ) as db:
         sampler_config, unmatched_probs, extra_probs = db.infer_config()
         existing_data = db.get_stats()
 
@@ -171,8 +443,195 @@ def continue_random_nonograms(threads: int, batch: int, db_path: pathlib.Path):
         print("Inferred following configuration: ", sampler_config)
 
         _solve_random_nonograms(
-            sampling.FillGapsSampler(sampler_config, existing_data),
+            sampling.make_sampler(sampler, sampler_config, existing_data, root),
+            sampler_config,
+            data.StoppingConfig(target_ci_width, max_cpu_seconds, max_trials),
+            root,
             threads,
             batch,
             db,
+            time_limit,
+            engine,
+            placements_path,
         )
+
+
+def _recorded_result(trial: solution_db.Trial) -> str:
+    if trial.timed_out:
+        return data.Uniqueness.TIMEOUT.value
+    return "unique" if trial.is_unique else "not unique"
+
+
+@click.command
+@click.argument("trial_id", type=int, required=False)
+@click.option(
+    "--slowest",
+    type=int,
+    help="Replay the N slowest recorded trials instead of TRIAL_ID",
+)
+@click.option("--profile", is_flag=True, help="Print a cProfile of each solve")
+@click.option(
+    "--db_path", type=click.Path(path_type=pathlib.Path), default="data.sqlite3"
+)
+@click.option(
+    "--engine",
+    type=click.Choice(solver.Engine, case_sensitive=False),
+    default=solver.Engine.AUTOMATIC,
+)
+def replay_trial(
+    trial_id: Optional[int],
+    slowest: Optional[int],
+    profile: bool,
+    db_path: pathlib.Path,
+    engine: solver.Engine,
+):
+    """Regenerate and re-solve trials recorded with --record_trials."""
+    with contextlib.closing(solution_db.SolutionDb(db_path)) as db:
+        try:
+            if slowest is not None:
+                trial_ids = db.slowest_trials(slowest)
+            elif trial_id is not None:
+                trial_ids = [trial_id]
+            else:
+                raise click.UsageError("Give a TRIAL_ID or --slowest")
+            trials = [db.get_trial(t) for t in trial_ids]
+        except sqlite3.OperationalError:
+            raise click.UsageError(f"{db_path} has no recorded trials")
+
+    for requested_id, trial in zip(trial_ids, trials):
+        if trial is None:
+            print(f"[red]No trial {requested_id}")
+            continue
+        puzzle = generate.generate(trial.config, trial.seed)
+        if trial.hints is not None and game.pack_hints(puzzle.hints) != trial.hints:
+            print(f"[bold red]Trial {trial.trial_id} regenerated a different puzzle")
+
+        profiler = cProfile.Profile() if profile else None
+        start = datetime.datetime.now()
+        if profiler is not None:
+            profiler.enable()
+        instance = solver.build(
+            puzzle, encoding=solver.Encoding.TEMPLATE, engine=engine
+        )
+        check = instance.check_uniqueness()
+        if profiler is not None:
+            profiler.disable()
+        end = datetime.datetime.now()
+
+        print(
+            f"Trial {trial.trial_id}: size {trial.config.size}, "
+            f"p={trial.config.prob:.3f}, seed {trial.seed}"
+        )
+        print(puzzle.to_text(with_hints=True, with_solution=puzzle.solution))
+        print(
+            f"  recorded: {_recorded_result(trial)}, "
+            f"{trial.solve_time} total, {trial.build_time} building"
+        )
+        print(
+            f"  replayed: {check.uniqueness.value}, "
+            f"{end - start} total, {instance.build_time} building"
+        )
+        if profiler is not None:
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+
+
+def _count_unique(size: int, threads: int) -> list[int]:
+    counts = [0] * (size * size + 1)
+    tasks = exact.tasks(size)
+    with (
+        workers.WorkerPool(threads) as pool,
+        rich.progress.Progress(transient=True) as progress,
+    ):
+        task = progress.add_task(f"Counting {size}x{size}...", total=len(tasks))
+        for chunk_counts in pool.imap_unordered(exact.count_task, tasks):
+            counts = exact.add_counts(counts, chunk_counts)
+            progress.advance(task)
+    return counts
+
+
+def make_exact_table(
+    size: int,
+    unique_counts: list[int],
+    existing_data: dict[data.InstanceConfig, data.SolutionStatistics],
+    p_steps: int,
+) -> rich.table.Table:
+    sampled = {
+        config.prob: stats
+        for config, stats in existing_data.items()
+        if config.size == size and stats.total
+    }
+    probs = sorted(sampled)
+    if not probs:
+        probs = data.SamplerConfig(0.0, 1.0, p_steps, size, size).all_probs()
+    table = rich.table.Table(title=f"{size}x{size}")
+    table.add_column("p", justify="right")
+    table.add_column("Exact", justify="right")
+    if sampled:
+        table.add_column("Sampled", justify="right")
+        table.add_column("95% interval", justify="right")
+        table.add_column("Trials", justify="right")
+    for p in probs:
+        expected = exact.p_unique(unique_counts, p)
+        row = [f"{p:.3f}", f"{expected:.4f}"]
+        if sampled:
+            stats = sampled[p]
+            lo, hi = stats.wilson_interval()
+            style = "green" if lo <= expected <= hi else "bold red"
+            row += [
+                f"{stats.ratio():.4f}",
+                rich.text.Text(f"{lo:.4f}-{hi:.4f}", style),
+                str(stats.total),
+            ]
+        table.add_row(*row)
+    return table
+
+
+@click.command
+@click.argument(
+    "sizes", nargs=-1, required=True, type=click.IntRange(1, exact.MAX_SIZE)
+)
+@click.option("--threads", type=int, default=5)
+@click.option(
+    "--db_path", type=click.Path(path_type=pathlib.Path), default="data.sqlite3"
+)
+@click.option(
+    "--recount",
+    is_flag=True,
+    help="Count again even if the database already has counts for a size",
+)
+@click.option(
+    "--p_steps",
+    type=int,
+    default=10,
+    help="Values of p to show for sizes that haven't been sampled",
+)
+def exact_uniqueness(
+    sizes: tuple[int, ...],
+    threads: int,
+    db_path: pathlib.Path,
+    recount: bool,
+    p_steps: int,
+):
+    """Count the unique grids of each size exactly, instead of sampling.
+
+    Every grid is enumerated and grouped by its hints, and the grids
+    alone in their group are counted by how many cells they fill, which
+    gives P(unique) at every p at once. The counts are kept in the
+    database, and shown next to whatever the random sweeps measured at
+    the same sizes, with any interval that misses the exact value in
+    red.
+    """
+    lower_priority()
+    with contextlib.closing(solution_db.SolutionDb(db_path)) as db:
+        for size in sizes:
+            unique_counts = None if recount else db.get_exact(size)
+            if unique_counts is None:
+                start = datetime.datetime.now()
+                unique_counts = _count_unique(size, threads)
+                print(f"Counted {size}x{size} in {datetime.datetime.now() - start}")
+                db.put_exact(size, unique_counts)
+            print(make_exact_table(size, unique_counts, db.get_stats(), p_steps))
+            print(
+                f"{sum(unique_counts)} of {2 ** (size * size)} {size}x{size} grids "
+                "are unique"
+            )
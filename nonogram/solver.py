@@ -1,82 +1,631 @@
-import cpmpy
-import cpmpy.expressions.variables
+from __future__ import annotations
+
 import itertools
 import dataclasses
 import datetime
+import enum
+import queue
+import threading
 import time
+from typing import TYPE_CHECKING, Iterator, Optional
+
+import numpy as np
 
+from nonogram import backtrack
 from nonogram import game
 from nonogram import data
+from nonogram import linesolver
+from nonogram import model_template
+from nonogram import solve_cache
+
+# cpmpy pulls in all of ortools and pandas, which is most of the time
+# it takes to start up, so it's only imported once there's a model to
+# build
+if TYPE_CHECKING:
+    import cpmpy
+    import cpmpy.expressions.variables
+    import cpmpy.solvers.ortools
+
+
+class Encoding(enum.Enum):
+    # one intvar per hint holding the index its extent starts at
+    STARTS = enum.auto()
+    # one boolvar per cell, each line checked by an automaton
+    CELLS = enum.auto()
+    # the cells encoding, from a model_template.ModelTemplate shared by
+    # every puzzle of the same shape and rebound to each
+    TEMPLATE = enum.auto()
+
+
+class Search(enum.Enum):
+    # whatever CP-SAT picks
+    AUTOMATIC = enum.auto()
+    # branch on the variables in the order they were made
+    FIXED = enum.auto()
+    # restart often, with a different heuristic each time
+    QUICK_RESTART = enum.auto()
+
+
+class Engine(enum.Enum):
+    # BACKTRACK for puzzles no bigger than BACKTRACK_MAX_SIZE, CP_SAT
+    # for the rest
+    AUTOMATIC = enum.auto()
+    CP_SAT = enum.auto()
+    # backtrack.Backtracker, with no model to build
+    BACKTRACK = enum.auto()
+
+
+# past this many rows or columns, the backtracker's search can take
+# longer than CP-SAT's, model building and all
+BACKTRACK_MAX_SIZE = 15
+# build options that only change anything when CP-SAT does the search
+CP_SAT_OPTIONS = ("encoding", "presolve", "workers")
+
+
+# names in SatParameters.SearchBranching
+_SEARCH_BRANCHING = {
+    Search.AUTOMATIC: "AUTOMATIC_SEARCH",
+    Search.FIXED: "FIXED_SEARCH",
+    Search.QUICK_RESTART: "PORTFOLIO_WITH_QUICK_RESTART_SEARCH",
+}
 
 
 @dataclasses.dataclass
 class Instance:
     puzzle: game.Puzzle
-    model: cpmpy.solvers.ortools.CPM_ortools
+    # built the first time it's needed, and never if the line solver
+    # or the solve cache already has the answer
+    model: Optional[cpmpy.solvers.ortools.CPM_ortools] = None
+    encoding: Encoding = Encoding.STARTS
     build_time: datetime.timedelta = datetime.timedelta()
     variables: dict[
         tuple[game.Dim, int, int], cpmpy.expressions.variables._IntVarImpl
     ] = dataclasses.field(default_factory=dict)
+    cell_variables: Optional[cpmpy.expressions.variables.NDVarArray] = None
+    # every row start variable in one flat list, with the row and
+    # length of its extent alongside, so extract_grid can read each
+    # value once and paint the grid with numpy
+    start_variables: list[cpmpy.expressions.variables._IntVarImpl] = dataclasses.field(
+        default_factory=list
+    )
+    start_rows: Optional[np.ndarray] = None
+    start_lengths: Optional[np.ndarray] = None
+    # cell states from the line solver presolve, None if it found a
+    # contradiction or wasn't run
+    cells: Optional[np.ndarray] = None
+    consistent: bool = True
+    # whether the line solver ran before the search, which is what
+    # filled in cells
+    presolve: bool = False
+    cache: Optional[solve_cache.SolveCache] = None
+    # ignore what's in the cache, but still store fresh results
+    refresh_cache: bool = False
+    search: Search = Search.AUTOMATIC
+    # CP-SAT search threads, None for one per core
+    num_workers: Optional[int] = None
+    stats: data.SolveStats = dataclasses.field(default_factory=data.SolveStats)
+    engine: Engine = Engine.CP_SAT
+    backtracker: Optional[backtrack.Backtracker] = None
+    template: Optional[model_template.ModelTemplate] = None
 
-    def solve(self, test_uniqueness: bool) -> data.Solution:
-        time_solve_start = time.process_time()
-        has_solution = self.model.solve()
-        time_solve_end = time.process_time()
-        solve_time = datetime.timedelta(seconds=time_solve_end - time_solve_start)
-        if not has_solution:
-            raise RuntimeError("No solution found")
+    def presolved(self) -> bool:
+        return not self.consistent or (
+            self.cells is not None and linesolver.is_solved(self.cells)
+        )
+
+    def presolved_grids(self) -> list[data.Grid]:
+        if not self.consistent or self.cells is None:
+            return []
+        return [linesolver.to_grid(self.cells)]
+
+    def ensure_model(self) -> cpmpy.solvers.ortools.CPM_ortools:
+        if self.encoding == Encoding.TEMPLATE:
+            # shared with every puzzle of the same shape in this
+            # process, so another one may have been bound to it since
+            if self.template is None or self.template.bound is not self:
+                time_build_start = time.process_time()
+                self.template = model_template.get(
+                    self.puzzle.n_rows, self.puzzle.n_cols
+                )
+                automata = [
+                    _automaton(hints)
+                    for dim in (game.Dim.ROW, game.Dim.COL)
+                    for hints in self.puzzle.hints[dim]
+                ]
+                self.model = self.template.bind(self, automata, self.cells)
+                self.cell_variables = self.template.cells
+                self._built(time_build_start)
+        elif self.model is None:
+            import cpmpy
+
+            time_build_start = time.process_time()
+            self.model = cpmpy.SolverLookup.get("ortools")
+            if self.encoding == Encoding.CELLS:
+                _build_cells(self, self.cells)
+            else:
+                _build_starts(self, self.cells)
+            self._built(time_build_start)
+        assert self.model is not None
+        return self.model
+
+    def _built(self, time_build_start: float):
+        assert self.model is not None
+        time_build_end = time.process_time()
+        self.build_time += datetime.timedelta(seconds=time_build_end - time_build_start)
+        proto = self.model.ort_model.Proto()
+        self.stats.num_variables = len(proto.variables)
+        self.stats.num_constraints = len(proto.constraints)
+        self.stats.build_time = self.build_time
+
+    def ensure_backtracker(self) -> backtrack.Backtracker:
+        if self.backtracker is None:
+            time_build_start = time.process_time()
+            self.backtracker = backtrack.Backtracker(self.puzzle, self.cells)
+            time_build_end = time.process_time()
+            self.build_time += datetime.timedelta(
+                seconds=time_build_end - time_build_start
+            )
+            self.stats.build_time = self.build_time
+        return self.backtracker
+
+    def ensure_built(self):
+        """Build whatever the engine searches, so it isn't timed as searching."""
+        if self.engine == Engine.BACKTRACK:
+            self.ensure_backtracker()
+        else:
+            self.ensure_model()
 
+    def _backtrack(
+        self, solution_limit: int, time_limit: Optional[float]
+    ) -> Iterator[data.Grid]:
+        backtracker = self.ensure_backtracker()
+        search_start = self._begin_search()
+        cpu_start = time.process_time()
+        try:
+            for grid in backtracker.solve(solution_limit, time_limit):
+                self._record_solution(search_start)
+                yield grid
+        finally:
+            self._end_search()
+            self.stats.wall_time = datetime.timedelta(
+                seconds=time.perf_counter() - search_start
+            )
+            self.stats.user_time = datetime.timedelta(
+                seconds=time.process_time() - cpu_start
+            )
+
+    def _params(self) -> dict:
+        from ortools.sat import sat_parameters_pb2
+
+        # passed through to CP-SAT's SatParameters by cpmpy
+        branching = sat_parameters_pb2.SatParameters.SearchBranching.Value(
+            _SEARCH_BRANCHING[self.search]
+        )
+        params = {"search_branching": branching}
+        if self.num_workers is not None:
+            params["num_workers"] = self.num_workers
+        return params
+
+    def _begin_search(self) -> float:
+        self.stats.solution_times = []
+        return time.perf_counter()
+
+    def _record_solution(self, search_start: float):
+        self.stats.solution_times.append(
+            datetime.timedelta(seconds=time.perf_counter() - search_start)
+        )
+
+    def _end_search(self):
+        if self.engine == Engine.BACKTRACK:
+            assert self.backtracker is not None
+            self.stats.branches = self.backtracker.branches
+            self.stats.conflicts = self.backtracker.conflicts
+            self.stats.propagations = self.backtracker.propagations
+            return
+        assert self.model is not None
+        response = self.model.ort_solver.response_proto
+        self.stats.branches = response.num_branches
+        self.stats.conflicts = response.num_conflicts
+        self.stats.propagations = (
+            response.num_binary_propagations + response.num_integer_propagations
+        )
+        self.stats.wall_time = datetime.timedelta(seconds=response.wall_time)
+        self.stats.user_time = datetime.timedelta(seconds=response.user_time)
+
+    def _finished(self) -> bool:
+        # False if the search was cut short by a solution or time limit
+        if self.engine == Engine.BACKTRACK:
+            assert self.backtracker is not None
+            return self.backtracker.finished
+
+        import cpmpy.solvers.solver_interface
+
+        assert self.model is not None
+        return self.model.status().exitstatus in (
+            cpmpy.solvers.solver_interface.ExitStatus.OPTIMAL,
+            cpmpy.solvers.solver_interface.ExitStatus.UNSATISFIABLE,
+        )
+
+    def _settings(self, kind: str) -> str:
+        # everything that changes how a search goes, so a cached result
+        # and its time only ever stand in for an identical search
+        return ":".join(
+            [
+                kind,
+                self.engine.name,
+                self.encoding.name,
+                f"presolve={self.presolve}",
+                self.search.name,
+                f"workers={self.num_workers}",
+            ]
+        )
+
+    def _cached(self, kind: str) -> Optional[solve_cache.CachedResult]:
+        if self.cache is None or self.refresh_cache:
+            return None
+        return self.cache.get(self.puzzle, self._settings(kind))
+
+    def _store(
+        self,
+        kind: str,
+        grids: list[data.Grid],
+        solve_time: datetime.timedelta,
+    ):
+        if self.cache is not None:
+            self.cache.put(self.puzzle, self._settings(kind), grids, solve_time)
+
+    def solve(
+        self, test_uniqueness: bool, time_limit: Optional[float] = None
+    ) -> data.Solution:
         if test_uniqueness:
-            num_solutions = self.model.solveAll(solution_limit=2)
+            check = self.check_uniqueness(time_limit)
+            grids = check.grids
+            solve_time = check.solve_time
+            timed_out = check.uniqueness == data.Uniqueness.TIMEOUT
         else:
-            num_solutions = 0
+            grids, solve_time, timed_out = self._first_solution(time_limit)
+        if timed_out:
+            return data.Solution(
+                is_unique=False,
+                solve_time=solve_time,
+                grid=grids[0] if grids else None,
+                config=self.puzzle.config,
+                timed_out=True,
+            )
+        if not grids:
+            raise RuntimeError("No solution found")
 
         return data.Solution(
-            is_unique=num_solutions == 1,
+            is_unique=test_uniqueness and len(grids) == 1,
             solve_time=solve_time,
-            grid=self.extract_grid(),
+            grid=grids[0],
             config=self.puzzle.config,
         )
 
-    def solve_all(self, solution_limit: int) -> data.Solutions:
-        grids = []
-
-        def solution_cb():
-            grids.append(self.extract_grid())
-
+    def _first_solution(
+        self, time_limit: Optional[float] = None
+    ) -> tuple[list[data.Grid], datetime.timedelta, bool]:
+        # the grids, how long they took, and whether the search timed out
+        cached = self._cached("first_solution")
+        if cached is not None:
+            return cached.grids, cached.solve_time, False
         time_solve_start = time.process_time()
-        self.model.solveAll(display=solution_cb, solution_limit=solution_limit)
+        grids = self._search_first(time_limit)
         time_solve_end = time.process_time()
-        solve_all_time = datetime.timedelta(seconds=time_solve_end - time_solve_start)
+        solve_time = datetime.timedelta(seconds=time_solve_end - time_solve_start)
+        timed_out = not grids and not self.presolved() and not self._finished()
+        if not self.presolved() and not timed_out:
+            self._store("first_solution", grids, solve_time)
+        return grids, solve_time, timed_out
+
+    def _search_first(self, time_limit: Optional[float]) -> list[data.Grid]:
+        if self.presolved():
+            return self.presolved_grids()
+        if self.engine == Engine.BACKTRACK:
+            return list(self._backtrack(1, time_limit))
+        model = self.ensure_model()
+        search_start = self._begin_search()
+        found = model.solve(time_limit=time_limit, **self._params())
+        self._end_search()
+        if found:
+            self._record_solution(search_start)
+            return [self.extract_grid()]
+        return []
 
+    def check_uniqueness(
+        self, time_limit: Optional[float] = None
+    ) -> data.UniquenessCheck:
+        cached = self._cached("uniqueness")
+        timed_out = False
+        if cached is not None:
+            grids = cached.grids
+            solve_time = cached.solve_time
+        else:
+            time_solve_start = time.process_time()
+            if self.presolved():
+                # a presolved grid is unique as is: line solving only
+                # makes sound deductions
+                grids = self.presolved_grids()
+            elif self.engine == Engine.BACKTRACK:
+                grids = list(self._backtrack(2, time_limit))
+                timed_out = len(grids) < 2 and not self._finished()
+            else:
+                # the ortools interface is stateless, so a second
+                # solve() with the first grid blocked would start the
+                # search over. CP-SAT's own enumeration blocks each
+                # solution it finds and carries on from there, so one
+                # search stopped at two solutions is the cheapest way
+                # to get a witness pair.
+                grids = []
+                model = self.ensure_model()
+                search_start = self._begin_search()
+
+                def solution_cb():
+                    self._record_solution(search_start)
+                    grids.append(self.extract_grid())
+
+                model.solveAll(
+                    display=solution_cb,
+                    solution_limit=2,
+                    time_limit=time_limit,
+                    **self._params(),
+                )
+                self._end_search()
+                # stopping at the second solution doesn't count as
+                # finishing either, but it settles the question
+                timed_out = len(grids) < 2 and not self._finished()
+            time_solve_end = time.process_time()
+            solve_time = datetime.timedelta(seconds=time_solve_end - time_solve_start)
+            if not self.presolved() and not timed_out:
+                self._store("uniqueness", grids, solve_time)
+
+        if timed_out:
+            uniqueness = data.Uniqueness.TIMEOUT
+        elif not grids:
+            uniqueness = data.Uniqueness.UNSOLVABLE
+        elif len(grids) == 1:
+            uniqueness = data.Uniqueness.UNIQUE
+        else:
+            uniqueness = data.Uniqueness.MULTIPLE
+        return data.UniquenessCheck(
+            uniqueness=uniqueness,
+            solve_time=solve_time,
+            grids=grids,
+            cached=cached is not None,
+        )
+
+    def iter_solutions(
+        self, solution_limit: int, time_limit: Optional[float] = None
+    ) -> "SolutionStream":
+        return SolutionStream(self, solution_limit, time_limit)
+
+    def solve_all(
+        self, solution_limit: int, time_limit: Optional[float] = None
+    ) -> data.Solutions:
+        stream = self.iter_solutions(solution_limit, time_limit)
+        grids = list(stream)
         return data.Solutions(
-            solve_all_time=solve_all_time,
+            solve_all_time=stream.solve_time,
             grids=grids,
+            cached=stream.cached,
+            timed_out=stream.timed_out,
         )
 
-    def extract_grid(self) -> list[list[bool]]:
-        result = []
-        for row_idx, row_hints in enumerate(self.puzzle.hints[game.Dim.ROW]):
-            row = []
-            for col_idx, col_hints in enumerate(self.puzzle.hints[game.Dim.COL]):
-                row_variables = [
-                    self.variables[game.Dim.ROW, row_idx, i]
-                    for i in range(len(row_hints))
-                ]
-                row_hint_covers = any(
-                    ((rv.value() + rh) > col_idx) & (col_idx >= rv.value())
-                    for rv, rh in zip(row_variables, row_hints)
+    def extract_grid(self) -> data.Grid:
+        if self.encoding in (Encoding.CELLS, Encoding.TEMPLATE):
+            assert self.cell_variables is not None
+            # NDVarArray.value() goes through argval and a list per
+            # cell; the cells are plain boolvars, so read them directly
+            cells = np.fromiter(
+                (v.value() for v in self.cell_variables.flat),
+                dtype=bool,
+                count=self.cell_variables.size,
+            )
+            return data.Grid.from_numpy(cells.reshape(self.cell_variables.shape))
+
+        assert self.start_rows is not None and self.start_lengths is not None
+        starts = np.fromiter(
+            (v.value() for v in self.start_variables),
+            dtype=np.intp,
+            count=len(self.start_variables),
+        )
+        # +1 at each extent's start and -1 just past its end, so a
+        # running sum along each row is nonzero exactly on filled cells
+        covered = np.zeros((self.puzzle.n_rows, self.puzzle.n_cols + 1), dtype=np.intp)
+        np.add.at(covered, (self.start_rows, starts), 1)
+        np.add.at(covered, (self.start_rows, starts + self.start_lengths), -1)
+        return data.Grid.from_numpy(np.cumsum(covered[:, :-1], axis=1) > 0)
+
+
+# how far the search can get ahead of whoever is consuming the grids
+# before it has to wait
+STREAM_QUEUE_SIZE = 64
+_DONE = object()
+
+
+class SolutionStream:
+    """Grids from an enumeration of every solution, as the solver finds them.
+
+    The search runs in a worker thread that hands grids over through a
+    bounded queue, so a consumer that writes them out as they arrive
+    never holds more than a queue's worth. Breaking out of the loop
+    stops the search. solve_time, cached, finished and timed_out are
+    filled in once the grids have run out.
+    """
+
+    def __init__(
+        self, instance: Instance, solution_limit: int, time_limit: Optional[float]
+    ):
+        self.instance = instance
+        self.solution_limit = solution_limit
+        self.time_limit = time_limit
+        self.solve_time = datetime.timedelta()
+        self.cached = False
+        # False if the search stopped early, at the solution limit or
+        # the time limit
+        self.finished = True
+        # stopped early by the time limit in particular
+        self.timed_out = False
+
+    def __iter__(self) -> Iterator[data.Grid]:
+        instance = self.instance
+        if instance.presolved():
+            yield from instance.presolved_grids()[: self.solution_limit]
+            return
+
+        kind = f"solve_all:{self.solution_limit}"
+        cached = instance._cached(kind)
+        if cached is not None:
+            self.cached = True
+            self.solve_time = cached.solve_time
+            yield from cached.grids
+            return
+
+        if instance.engine == Engine.BACKTRACK:
+            yield from self._backtrack(kind)
+            return
+
+        model = instance.ensure_model()
+        grids: queue.Queue = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+        stop = threading.Event()
+
+        def put(item) -> bool:
+            # gives up if the consumer has gone away, rather than
+            # blocking on a queue nobody will drain
+            while not stop.is_set():
+                try:
+                    grids.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        search_start = instance._begin_search()
+        # time spent waiting on the consumer, which isn't search time
+        blocked = 0.0
+
+        def solution_cb():
+            nonlocal blocked
+            instance._record_solution(search_start)
+            grid = instance.extract_grid()
+            wait_start = time.perf_counter()
+            delivered = put(grid)
+            blocked += time.perf_counter() - wait_start
+            if not delivered:
+                # in case the stop below landed before the search began
+                model.ort_solver.stop_search()
+
+        def search():
+            try:
+                model.solveAll(
+                    display=solution_cb,
+                    solution_limit=self.solution_limit,
+                    time_limit=self.time_limit,
+                    **instance._params(),
+                )
+                instance._end_search()
+                # process_time would count the consumer's work too, and
+                # thread_time would miss the other search workers
+                self.solve_time = instance.stats.wall_time - datetime.timedelta(
+                    seconds=blocked
                 )
+                put(_DONE)
+            except Exception as e:
+                put(e)
 
-                row.append(row_hint_covers)
-            result.append(row)
-        return result
+        worker = threading.Thread(target=search, daemon=True)
+        worker.start()
+        # the cache wants the whole set, but only if there's a cache
+        found: Optional[list[data.Grid]] = [] if instance.cache is not None else None
+        count = 0
+        try:
+            while True:
+                item = grids.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                count += 1
+                found = self._collect(found, item, count)
+                yield item
+        finally:
+            if worker.is_alive():
+                stop.set()
+                model.ort_solver.stop_search()
+            worker.join()
 
+        self.finished = instance._finished()
+        self.timed_out = not self.finished and count < self.solution_limit
+        if self.finished and found is not None:
+            instance._store(kind, found, self.solve_time)
+
+    def _collect(
+        self, found: Optional[list[data.Grid]], grid: data.Grid, count: int
+    ) -> Optional[list[data.Grid]]:
+        # no point holding on to grids that can't be stored: the
+        # backtracker never finishes once it reaches the solution limit,
+        # though CP-SAT can, and the cache can't take more than its budget
+        instance = self.instance
+        if found is None or instance.cache is None:
+            return None
+        if instance.engine == Engine.BACKTRACK and count >= self.solution_limit:
+            return None
+        if not instance.cache.fits(instance.puzzle, count):
+            return None
+        found.append(grid)
+        return found
+
+    def _backtrack(self, kind: str) -> Iterator[data.Grid]:
+        # fast enough that there's nothing to gain from a thread
+        instance = self.instance
+        found: Optional[list[data.Grid]] = [] if instance.cache is not None else None
+        count = 0
+        solve_seconds = 0.0
+        # only the time spent inside the search, not the consumer's
+        search = instance._backtrack(self.solution_limit, self.time_limit)
+        try:
+            while True:
+                time_solve_start = time.process_time()
+                grid = next(search, None)
+                solve_seconds += time.process_time() - time_solve_start
+                if grid is None:
+                    break
+                count += 1
+                found = self._collect(found, grid, count)
+                yield grid
+        finally:
+            search.close()
+            self.solve_time = datetime.timedelta(seconds=solve_seconds)
+        self.finished = instance._finished()
+        self.timed_out = not self.finished and count < self.solution_limit
+        if self.finished and found is not None:
+            instance._store(kind, found, self.solve_time)
 
-def build(puzzle: game.Puzzle):
-    time_build_start = time.process_time()
 
-    instance = Instance(puzzle, cpmpy.SolverLookup.get("ortools"))
+def _automaton(
+    hints: list[int],
+) -> tuple[list[tuple[int, int, int]], int, list[int]]:
+    # state j means we've matched the first j symbols of the pattern
+    # 1^h0 0 1^h1 0 ... 1^hk; extra 0s are allowed at the start, after
+    # each mandatory gap, and at the end.
+    pattern = []
+    for hint_idx, hint in enumerate(hints):
+        if hint_idx:
+            pattern.append(0)
+        pattern.extend([1] * hint)
+
+    transitions = [(0, 0, 0)]
+    for state, symbol in enumerate(pattern):
+        transitions.append((state, symbol, state + 1))
+        if symbol == 0:
+            transitions.append((state + 1, 0, state + 1))
+    if pattern:
+        transitions.append((len(pattern), 0, len(pattern)))
+    return transitions, 0, [len(pattern)]
+
+
+def _build_starts(instance: Instance, cells: Optional[np.ndarray]):
+    import cpmpy
 
     # let's try the representation where we store the index of each
     # extent.
@@ -87,6 +636,22 @@ def build(puzzle: game.Puzzle):
                     0, instance.puzzle.size(rc), name=f"{rc.value}{line_idx}h{hint_idx}"
                 )
 
+    row_extents = [
+        (row_idx, hint_idx, hint)
+        for row_idx, hints in enumerate(instance.puzzle.hints[game.Dim.ROW])
+        for hint_idx, hint in enumerate(hints)
+    ]
+    instance.start_variables = [
+        instance.variables[game.Dim.ROW, row_idx, hint_idx]
+        for row_idx, hint_idx, _ in row_extents
+    ]
+    instance.start_rows = np.array(
+        [row_idx for row_idx, _, _ in row_extents], dtype=np.intp
+    )
+    instance.start_lengths = np.array(
+        [hint for _, _, hint in row_extents], dtype=np.intp
+    )
+
     # extents can't run off the end of the row
     for rc, line in instance.puzzle.hints.items():
         for line_idx, hints in enumerate(line):
@@ -96,6 +661,20 @@ def build(puzzle: game.Puzzle):
                 # must be 0
                 instance.model += hv <= instance.puzzle.size(rc) - hint
 
+    # the line solver already knows where some extents can and can't
+    # start, and which cells are settled
+    if cells is not None:
+        for rc, line in instance.puzzle.hints.items():
+            for line_idx, hints in enumerate(line):
+                bounds = linesolver.start_bounds(
+                    hints, linesolver.line_view(cells, rc, line_idx).tolist()
+                )
+                assert bounds is not None, "presolve left an inconsistent line"
+                for hint_idx, (lo, hi) in enumerate(bounds):
+                    hv = instance.variables[rc, line_idx, hint_idx]
+                    instance.model += hv >= lo
+                    instance.model += hv <= hi
+
     # adjacent extents have to have a space between them
     for rc, line in instance.puzzle.hints.items():
         for line_idx, hints in enumerate(line):
@@ -135,10 +714,91 @@ def build(puzzle: game.Puzzle):
                 #
                 # if h0v is 1, then h0 of 1 covers column index 1. if
                 # h0v is 1, then h0 of 2 covers column index 1 and 2.
-                row_hint_covers == col_hint_covers
+                row_hint_covers
+                == col_hint_covers
             )
+            if cells is not None and row_hints:
+                if cells[row_idx, col_idx] == linesolver.FILLED:
+                    instance.model += row_hint_covers
+                elif cells[row_idx, col_idx] == linesolver.EMPTY:
+                    instance.model += ~row_hint_covers
+
+
+def _build_cells(instance: Instance, cells: Optional[np.ndarray]):
+    import cpmpy
+
+    puzzle = instance.puzzle
+    instance.cell_variables = cpmpy.boolvar(
+        shape=(puzzle.n_rows, puzzle.n_cols), name="cell"
+    )
+
+    for rc, line in puzzle.hints.items():
+        for line_idx, hints in enumerate(line):
+            if rc == game.Dim.ROW:
+                line_variables = instance.cell_variables[line_idx, :]
+            else:
+                line_variables = instance.cell_variables[:, line_idx]
+            transitions, start, accepting = _automaton(hints)
+            # cpmpy only grew a Regular global after the release we
+            # pin, so talk to CP-SAT's automaton constraint directly
+            instance.model += cpmpy.DirectConstraint(
+                "AddAutomaton",
+                (list(line_variables), start, accepting, transitions),
+                novar=[1, 2, 3],
+            )
+
+    if cells is not None:
+        for row_idx, col_idx in zip(*np.nonzero(cells == linesolver.FILLED)):
+            instance.model += instance.cell_variables[row_idx, col_idx]
+        for row_idx, col_idx in zip(*np.nonzero(cells == linesolver.EMPTY)):
+            instance.model += ~instance.cell_variables[row_idx, col_idx]
+
+
+def choose_engine(puzzle: game.Puzzle, engine: Engine) -> Engine:
+    """The engine that will actually search, with AUTOMATIC resolved."""
+    if engine != Engine.AUTOMATIC:
+        return engine
+    small = max(puzzle.n_rows, puzzle.n_cols) <= BACKTRACK_MAX_SIZE
+    return Engine.BACKTRACK if small else Engine.CP_SAT
+
+
+def build(
+    puzzle: game.Puzzle,
+    presolve: bool = True,
+    encoding: Encoding = Encoding.STARTS,
+    cache: Optional[solve_cache.SolveCache] = None,
+    refresh_cache: bool = False,
+    search: Search = Search.AUTOMATIC,
+    num_workers: Optional[int] = None,
+    engine: Engine = Engine.AUTOMATIC,
+):
+    time_build_start = time.process_time()
+
+    engine = choose_engine(puzzle, engine)
+    if engine == Engine.BACKTRACK:
+        # up front, rather than from whatever first needs a search
+        backtrack.check_size(puzzle)
+
+    instance = Instance(
+        puzzle,
+        encoding=encoding,
+        cache=cache,
+        refresh_cache=refresh_cache,
+        search=search,
+        num_workers=num_workers,
+        engine=engine,
+    )
+    # the backtracker settles lines the same way the line solver does,
+    # so there's nothing for a presolve to add
+    if presolve and engine == Engine.CP_SAT:
+        instance.presolve = True
+        instance.cells = linesolver.propagate(puzzle)
+        instance.consistent = instance.cells is not None
 
     time_build_end = time.process_time()
     instance.build_time = datetime.timedelta(seconds=time_build_end - time_build_start)
+    instance.stats.build_time = instance.build_time
 
+    # the CP model is put together by Instance.ensure_model once
+    # something actually needs to search
     return instance
@@ -0,0 +1,263 @@
+import collections
+import dataclasses
+import multiprocessing
+import multiprocessing.connection
+import time
+from typing import Any, Callable, Iterable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# imported once in the forkserver, so every worker forked from it
+# starts with them already loaded instead of paying for cpmpy, ortools
+# and numpy on startup
+PRELOAD = [
+    "numpy",
+    "cpmpy",
+    "ortools.sat.python.cp_model",
+    "nonogram.generate",
+    "nonogram.linesolver",
+    "nonogram.placement_cache",
+    "nonogram.backtrack",
+    "nonogram.exact",
+    "nonogram.model_template",
+    "nonogram.solver",
+    "nonogram.portfolio",
+    "nonogram.solve_cache",
+    "nonogram.corpus",
+]
+
+# aim for chunks that take about this long to run, which keeps the
+# pipe traffic small next to the solving without leaving workers idle
+# behind one huge chunk at the end
+TARGET_CHUNK_SECONDS = 0.25
+MAX_CHUNKSIZE = 512
+# chunks queued per worker, so nobody waits on the parent between
+# chunks
+CHUNKS_PER_WORKER = 2
+# weight of the newest chunk in the running per-task latency
+LATENCY_SMOOTHING = 0.2
+
+
+def _context():
+    ctx = multiprocessing.get_context("forkserver")
+    ctx.set_forkserver_preload(PRELOAD)
+    return ctx
+
+
+def warm():
+    """Build and search a tiny puzzle so the first real one doesn't pay for it."""
+    from nonogram import data
+    from nonogram import game
+    from nonogram import solver
+
+    puzzle = game.Puzzle(
+        config=data.InstanceConfig(size=2, prob=0.5),
+        hints={game.Dim.ROW: [[1], [1]], game.Dim.COL: [[1], [1]]},
+    )
+    for encoding in solver.Encoding:
+        solver.build(
+            puzzle, presolve=False, encoding=encoding, engine=solver.Engine.CP_SAT
+        ).check_uniqueness()
+    solver.build(puzzle, engine=solver.Engine.BACKTRACK).check_uniqueness()
+
+
+# set by retire() in a worker, checked once its chunk is done
+_retiring = False
+
+
+def retire():
+    """Have the worker this runs in replaced once its current chunk is done.
+
+    For tasks that leave a process in a state nobody should inherit,
+    like a search that ran into its time limit. Does nothing outside a
+    WorkerPool worker.
+    """
+    global _retiring
+    _retiring = True
+
+
+def _worker_main(
+    conn: multiprocessing.connection.Connection,
+    initializer: Optional[Callable[..., Any]],
+    initargs: tuple,
+):
+    warm()
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        fn, chunk, batched = task
+        time_start = time.perf_counter()
+        try:
+            results = fn(chunk) if batched else [fn(item) for item in chunk]
+        except Exception as e:
+            conn.send((False, e, False))
+            continue
+        time_end = time.perf_counter()
+        conn.send((True, (results, time_end - time_start), _retiring))
+        if _retiring:
+            return
+
+
+@dataclasses.dataclass
+class _Worker:
+    process: multiprocessing.process.BaseProcess
+    conn: multiprocessing.connection.Connection
+    # chunks sent to this worker and not back yet, oldest first
+    pending: collections.deque = dataclasses.field(default_factory=collections.deque)
+
+
+class WorkerPool:
+    """A process pool whose workers stay warm for the life of the pool.
+
+    Workers are forked from a forkserver that has already imported the
+    solver stack, run warm() once, and then take tasks in chunks sized
+    from how long tasks have been taking, so tiny puzzles don't spend
+    most of their time in a pipe. Each worker has a pipe of its own, so
+    one that calls retire() can be swapped for a fresh process without
+    losing the chunks queued up behind it. Workers inherit the niceness
+    of the process that creates the pool.
+    """
+
+    def __init__(
+        self,
+        processes: int,
+        initializer: Optional[Callable[..., Any]] = None,
+        initargs: tuple = (),
+        target_chunk_seconds: float = TARGET_CHUNK_SECONDS,
+        max_chunksize: int = MAX_CHUNKSIZE,
+    ):
+        self.processes = processes
+        self.initializer = initializer
+        self.initargs = initargs
+        self.target_chunk_seconds = target_chunk_seconds
+        self.max_chunksize = max_chunksize
+        # seconds per task, None until the first chunk comes back
+        self.latency: Optional[float] = None
+        self.retired = 0
+        self.ctx = _context()
+        self.workers = [self._start() for _ in range(processes)]
+
+    def __enter__(self) -> "WorkerPool":
+        return self
+
+    def __exit__(self, *exc_info):
+        for worker in self.workers:
+            worker.process.terminate()
+        for worker in self.workers:
+            worker.process.join()
+            worker.conn.close()
+
+    def _start(self) -> _Worker:
+        parent_conn, child_conn = self.ctx.Pipe()
+        process = self.ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self.initializer, self.initargs),
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        return _Worker(process, parent_conn)
+
+    def _replace(self, worker: _Worker, kill: bool = False):
+        if kill:
+            worker.process.terminate()
+        worker.process.join()
+        worker.conn.close()
+        self.workers[self.workers.index(worker)] = self._start()
+
+    def chunksize(self) -> int:
+        if self.latency is None:
+            # one task each until there's a measurement
+            return 1
+        size = int(self.target_chunk_seconds / max(self.latency, 1e-9))
+        return max(1, min(size, self.max_chunksize))
+
+    def _observe(self, n_tasks: int, seconds: float):
+        latency = seconds / n_tasks
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += LATENCY_SMOOTHING * (latency - self.latency)
+
+    def imap_unordered(
+        self, fn: Callable[[T], R], items: Iterable[T], batched: bool = False
+    ) -> Iterator[R]:
+        """Like Pool.imap_unordered, but chunked adaptively.
+
+        Unlike Pool.imap_unordered this only pulls from items as
+        workers free up, so it's safe to hand it an endless iterator
+        or one whose later items depend on earlier results. If batched,
+        fn is called with a whole chunk at once and returns a list with
+        a result for each of its items.
+        """
+        item_itr = iter(items)
+        # chunks left behind by retired workers, to go out first
+        backlog: collections.deque = collections.deque()
+        exhausted = False
+
+        def next_chunk() -> list[T]:
+            nonlocal exhausted
+            if backlog:
+                return backlog.popleft()
+            chunk: list[T] = []
+            if exhausted:
+                return chunk
+            for item in item_itr:
+                chunk.append(item)
+                if len(chunk) >= self.chunksize():
+                    break
+            else:
+                exhausted = True
+            return chunk
+
+        try:
+            while True:
+                for worker in self.workers:
+                    while len(worker.pending) < CHUNKS_PER_WORKER:
+                        chunk = next_chunk()
+                        if not chunk:
+                            break
+                        worker.conn.send((fn, chunk, batched))
+                        worker.pending.append(chunk)
+                busy = {
+                    worker.conn: worker for worker in self.workers if worker.pending
+                }
+                if not busy:
+                    return
+
+                results = []
+                for conn in multiprocessing.connection.wait(list(busy)):
+                    worker = busy[conn]
+                    try:
+                        ok, payload, retiring = conn.recv()
+                    except EOFError:
+                        raise RuntimeError(
+                            f"worker {worker.process.pid} died"
+                            f" with exit code {worker.process.exitcode}"
+                        )
+                    chunk = worker.pending.popleft()
+                    if not ok:
+                        raise payload
+                    chunk_results, seconds = payload
+                    self._observe(len(chunk), seconds)
+                    results.extend(chunk_results)
+                    if retiring:
+                        # it exits without reading anything else it
+                        # was sent
+                        backlog.extend(worker.pending)
+                        worker.pending.clear()
+                        self._replace(worker)
+                        self.retired += 1
+                yield from results
+        finally:
+            # anything still out would come back into the next call
+            for worker in list(self.workers):
+                if worker.pending:
+                    self._replace(worker, kill=True)
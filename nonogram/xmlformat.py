@@ -1,75 +1,48 @@
-import bs4
-import bs4.element
+import io
+from typing import Iterator
+
+from lxml import etree
 
 from nonogram import game
 from nonogram import data
 
 
-def canonicalize_attr_value(av) -> str:
-    if isinstance(av, list):
-        return av[0]
-    elif isinstance(av, str):
-        return av
-    raise RuntimeError("Not an attribute value list")
-
-
-def load(s: str) -> game.Puzzle:
+def _load_puzzle(puzzle_node) -> game.Puzzle:
     hints = {}
 
-    soup = bs4.BeautifulSoup(s, "lxml-xml")
-
-    for clue in soup.find_all("count"):
-        assert isinstance(clue, bs4.Tag), "Puzzle xml is malformed somehow"
-        if "color" in clue.attrs:
+    for clue in puzzle_node.iter("count"):
+        if "color" in clue.attrib:
             raise NotImplementedError(
                 "Puzzle has colors; solver does not support colors"
             )
 
-    for clues_node in soup.find_all("clues"):
-        assert isinstance(clues_node, bs4.Tag), "Puzzle xml is malformed somehow"
-
+    for clues_node in puzzle_node.iter("clues"):
         if clues_node.get("type") == "columns":
             dim = game.Dim.COL
         else:
             dim = game.Dim.ROW
 
-        dim_data = []
+        hints[dim] = [
+            [int(clue_node.text) for clue_node in line_node.iterchildren("count")]
+            for line_node in clues_node.iterchildren("line")
+        ]
 
-        for line_idx, line_node in enumerate(clues_node.find_all("line")):
-            line_data = []
-            assert isinstance(line_node, bs4.Tag), "Puzzle xml is malformed somehow"
-            for clue_idx, clue_node in enumerate(line_node.children):
-                line_data += [int(clue_node.text)]
-            dim_data += [line_data]
-
-        hints[dim] = dim_data
-
-    puzzle_node = soup.find("puzzle")
-    assert puzzle_node is not None, f"puzzle {s} has no <puzzle> tag"
-    assert isinstance(puzzle_node, bs4.Tag), "Puzzle xml is malformed somehow"
-    default_color = canonicalize_attr_value(
-        puzzle_node.attrs.get("defaultcolor", "black")
-    )
-    background_color = canonicalize_attr_value(
-        puzzle_node.attrs.get("backgroundcolor", "white")
-    )
+    default_color = puzzle_node.get("defaultcolor", "black")
+    background_color = puzzle_node.get("backgroundcolor", "white")
 
     color_chars = {
         "black": "X",
         "white": ".",
     }
-    for color_node in soup.find_all("color"):
-        assert isinstance(color_node, bs4.Tag), "Puzzle xml is malformed somehow"
-        color_name = canonicalize_attr_value(color_node.attrs["name"])
-        color_chars[color_name] = canonicalize_attr_value(color_node.attrs["char"])
+    for color_node in puzzle_node.iter("color"):
+        color_chars[color_node.get("name")] = color_node.get("char")
 
     grid = None
-    for solution_node in soup.find_all("solution"):
-        assert isinstance(solution_node, bs4.Tag), "Puzzle xml is malformed somehow"
-        if "type" not in solution_node.attrs or solution_node.attrs["type"] == "goal":
-            for image_node in solution_node.find_all("image"):
+    for solution_node in puzzle_node.iter("solution"):
+        if solution_node.get("type", "goal") == "goal":
+            for image_node in solution_node.iter("image"):
                 grid = []
-                for row_chars in image_node.text.splitlines():
+                for row_chars in "".join(image_node.itertext()).splitlines():
                     grid_row = []
                     for char in row_chars:
                         if char == color_chars[background_color]:
@@ -85,9 +58,45 @@ def load(s: str) -> game.Puzzle:
     height = len(hints[game.Dim.ROW])
     width = len(hints[game.Dim.COL])
     size = (height + width) // 2
-    if grid:
-        prob = sum(sum(row) for row in grid) / (height * width)
+    solution = data.Grid.from_rows(grid) if grid else None
+    if solution:
+        prob = solution.count() / (height * width)
     else:
         prob = 0
     instance_config = data.InstanceConfig(size=size, prob=prob)
-    return game.Puzzle(config=instance_config, hints=hints, solution=grid)
+    return game.Puzzle(config=instance_config, hints=hints, solution=solution)
+
+
+def _puzzle_nodes(s: str) -> Iterator:
+    # one pass over the document, handing over each <puzzle> as soon
+    # as it's complete and dropping it once it's been turned into a
+    # game.Puzzle. the encoding override is needed because the text
+    # has already been decoded but may still carry an xml declaration
+    # that says otherwise.
+    for _, puzzle_node in etree.iterparse(
+        io.BytesIO(s.encode()), events=("end",), tag="puzzle", encoding="utf-8"
+    ):
+        yield puzzle_node
+        puzzle_node.clear()
+
+
+def load_all(s: str, skip_unsupported: bool = False) -> list[game.Puzzle]:
+    """Load every puzzle in a <puzzleset>.
+
+    Raises NotImplementedError on the first color puzzle unless
+    skip_unsupported is set, in which case color puzzles are dropped.
+    """
+    puzzles = []
+    for puzzle_node in _puzzle_nodes(s):
+        try:
+            puzzles.append(_load_puzzle(puzzle_node))
+        except NotImplementedError:
+            if not skip_unsupported:
+                raise
+    return puzzles
+
+
+def load(s: str) -> game.Puzzle:
+    for puzzle_node in _puzzle_nodes(s):
+        return _load_puzzle(puzzle_node)
+    raise AssertionError(f"puzzle {s} has no <puzzle> tag")
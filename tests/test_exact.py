@@ -0,0 +1,66 @@
+import collections
+import functools
+import itertools
+import unittest
+from unittest import mock
+
+from nonogram import exact
+
+
+def _count_brute_force(size: int) -> list[int]:
+    # every grid's row and column hints, then the grids nobody shares
+    # them with, by filled cells
+    signatures = collections.Counter()
+    grids = []
+    for cells in itertools.product([0, 1], repeat=size * size):
+        rows = [sum(cells[r * size + c] << c for c in range(size)) for r in range(size)]
+        cols = [sum(cells[r * size + c] << r for r in range(size)) for c in range(size)]
+        signature = (
+            tuple(exact.line_hints(mask) for mask in rows),
+            tuple(exact.line_hints(mask) for mask in cols),
+        )
+        signatures[signature] += 1
+        grids.append((signature, sum(cells)))
+    counts = [0] * (size * size + 1)
+    for signature, filled in grids:
+        if signatures[signature] == 1:
+            counts[filled] += 1
+    return counts
+
+
+def _count(size: int) -> list[int]:
+    return functools.reduce(exact.add_counts, map(exact.count_task, exact.tasks(size)))
+
+
+class ExactTest(unittest.TestCase):
+    def test_line_hints(self):
+        self.assertEqual(exact.line_hints(0), ())
+        self.assertEqual(exact.line_hints(0b1), (1,))
+        self.assertEqual(exact.line_hints(0b1101110), (3, 2))
+
+    def test_matches_brute_force(self):
+        for size in range(1, 4):
+            with self.subTest(size=size):
+                self.assertEqual(_count(size), _count_brute_force(size))
+
+    def test_matches_brute_force_split_into_chunks(self):
+        # a chunk per full set of row hints. every hint sequence up to 3
+        # long reads the same backwards, so it takes 4 on a side for
+        # any chunk to stand in for its mirror image as well
+        with mock.patch.object(exact, "CHUNK_GRIDS", 1):
+            for size in range(1, 5):
+                with self.subTest(size=size):
+                    weights = [weight for _, weight in exact.chunks(size)]
+                    self.assertEqual(
+                        len(weights),
+                        len(exact._tables(size).classes) ** size - weights.count(2),
+                    )
+                    self.assertEqual(2 in weights, size == 4)
+                    self.assertEqual(_count(size), _count_brute_force(size))
+
+    def test_p_unique(self):
+        counts = _count(2)
+        # an empty grid and a full grid are always unique
+        self.assertEqual(exact.p_unique(counts, 0.0), 1.0)
+        self.assertEqual(exact.p_unique(counts, 1.0), 1.0)
+        self.assertAlmostEqual(exact.p_unique(counts, 0.5), sum(counts) / 16)
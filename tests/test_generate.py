@@ -0,0 +1,23 @@
+import unittest
+
+from nonogram import data
+from nonogram import generate
+
+
+class GenerateTest(unittest.TestCase):
+    def test_seeded_batch_matches_generate(self):
+        config = data.InstanceConfig(size=7, prob=0.4)
+        seeds = [generate.trial_seed(1234, trial) for trial in range(20)]
+        batch = generate.generate_seeded(config, seeds)
+        self.assertEqual(len(batch), len(seeds))
+        for puzzle, seed in zip(batch, seeds):
+            expected = generate.generate(config, seed)
+            self.assertEqual(puzzle.hints, expected.hints)
+            self.assertEqual(puzzle.solution, expected.solution)
+
+    def test_batch_of_one_matches_generate(self):
+        config = data.InstanceConfig(size=5, prob=0.5)
+        puzzle = generate.generate_batch(config, 1, seed=99).puzzle(0)
+        expected = generate.generate(config, 99)
+        self.assertEqual(puzzle.hints, expected.hints)
+        self.assertEqual(puzzle.solution, expected.solution)
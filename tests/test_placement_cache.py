@@ -0,0 +1,108 @@
+import pathlib
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+from nonogram import linesolver
+from nonogram import placement_cache
+
+
+def _hints(mask: int, n: int) -> tuple[int, ...]:
+    cells = "".join("1" if mask >> c & 1 else "0" for c in range(n))
+    return tuple(len(run) for run in cells.split("0") if run)
+
+
+def _settle_brute_force(hints, line):
+    # every mask with these hints that agrees with the known cells
+    n = len(line)
+    fits = [
+        mask
+        for mask in range(1 << n)
+        if _hints(mask, n) == tuple(hints)
+        and all(
+            v == linesolver.UNKNOWN or (mask >> c & 1) == v for c, v in enumerate(line)
+        )
+    ]
+    if not fits:
+        return None
+    result = []
+    for c in range(n):
+        values = {mask >> c & 1 for mask in fits}
+        if values == {1}:
+            result.append(linesolver.FILLED)
+        elif values == {0}:
+            result.append(linesolver.EMPTY)
+        else:
+            result.append(linesolver.UNKNOWN)
+    return result
+
+
+class SettleLineTest(unittest.TestCase):
+    def test_cached_and_uncached_agree(self):
+        rng = random.Random(0)
+        states = [linesolver.UNKNOWN, linesolver.EMPTY, linesolver.FILLED]
+        for _ in range(2000):
+            n = rng.randint(1, 10)
+            hints = rng.choice(list(placement_cache.all_hints(n)))
+            # mostly unknown cells, so that a fair share of lines are
+            # still consistent
+            line = rng.choices(states, weights=[6, 1, 1], k=n)
+            cached = linesolver.settle_line(hints, line)
+            with mock.patch.object(linesolver, "CACHED_MAX_PLACEMENTS", -1):
+                uncached = linesolver.settle_line(hints, line)
+            with self.subTest(hints=hints, line=line):
+                self.assertEqual(cached, uncached)
+                self.assertEqual(cached, _settle_brute_force(hints, line))
+
+
+class PlacementCacheTest(unittest.TestCase):
+    def test_placements_match_count(self):
+        for n in range(9):
+            for hints in placement_cache.all_hints(n):
+                found = placement_cache.placements(n, hints)
+                self.assertEqual(len(found), placement_cache.placement_count(n, hints))
+                self.assertTrue(all(_hints(mask, n) == hints for mask in found))
+
+    def test_least_recently_used_goes_first(self):
+        cache = placement_cache.PlacementCache(max_entries=2)
+        cache.get(5, (1,))
+        cache.get(5, (2,))
+        cache.get(5, (1,))
+        cache.get(5, (3,))
+        self.assertEqual(list(cache.entries), [(5, (1,)), (5, (3,))])
+        info = cache.info()
+        self.assertEqual((info.hits, info.misses, info.entries), (1, 3, 2))
+
+    def test_prewarm_refuses_long_lines(self):
+        cache = placement_cache.PlacementCache()
+        with self.assertRaises(ValueError):
+            cache.prewarm(placement_cache.MAX_PREWARM_LENGTH + 1)
+
+    def test_save_load_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = pathlib.Path(tmp) / "placements.json"
+            placement_cache.write_prewarmed(path, placement_cache.MAX_PREWARM_LENGTH)
+            # far too small for the file, which load has to make room for
+            cache = placement_cache.PlacementCache(max_entries=10)
+            cache.load(path)
+
+        expected = {
+            (length, hints)
+            for length in range(placement_cache.MAX_PREWARM_LENGTH + 1)
+            for hints in placement_cache.all_hints(length)
+        }
+        self.assertEqual(set(cache.entries), expected)
+        self.assertEqual(cache.max_entries, len(expected))
+        for (length, hints), value in cache.entries.items():
+            self.assertEqual(
+                value, placement_cache.LinePlacements.compute(length, hints)
+            )
+        self.assertEqual(cache.info().misses, 0)
+
+    def test_load_rejects_other_versions(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = pathlib.Path(tmp) / "placements.json"
+            path.write_text('{"version": 0, "lines": []}')
+            with self.assertRaises(ValueError):
+                placement_cache.PlacementCache().load(path)